@@ -0,0 +1,73 @@
+"""Re-embed ratio of fixed vs content-defined chunking after typical edits.
+
+For every file in the corpus, applies a set of small edits and counts the
+chunks whose text did not exist before the edit. Those are the chunks
+that miss the embedding cache and have to be re-embedded and re-upserted.
+
+Usage:
+    python bench/chunking_bench.py [--corpus DIR] [--min-size 3000]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from service.piplines.chunking import chunk_file  # noqa: E402
+
+EXTENSIONS = ('.py', '.md', '.js', '.ts', '.java', '.go', '.rs')
+
+
+def edits(text: str):
+    lines = text.splitlines(keepends=True)
+    mid, third = len(lines) // 2, len(lines) // 3
+    return {
+        'insert line at top': '# added comment\n' + text,
+        'edit middle line': ''.join(lines[:mid] + ['    value = compute()  # edited\n'] + lines[mid + 1:]),
+        'delete a line': ''.join(lines[:third] + lines[third + 1:]),
+        'append function': text + '\n\ndef added_helper(x):\n    return x * 2\n',
+        'insert block in middle': ''.join(lines[:mid] + ['\n', 'def inserted():\n', '    pass\n', '\n'] + lines[mid:]),
+    }
+
+
+def reembedded(mode: str, before: str, after: str):
+    old = {c[3] for c in chunk_file('repo', 'file', before, mode)}
+    new = [c[3] for c in chunk_file('repo', 'file', after, mode)]
+    changed = sum(1 for t in new if t not in old)
+    return changed, len(new)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=ROOT)
+    parser.add_argument('--min-size', type=int, default=3000, help='skip files smaller than this (chars)')
+    args = parser.parse_args()
+
+    texts = []
+    for dirpath, dirnames, filenames in os.walk(args.corpus):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.') and d not in ('data', '__pycache__', 'node_modules')]
+        for name in filenames:
+            if name.endswith(EXTENSIONS):
+                with open(os.path.join(dirpath, name), encoding='utf-8', errors='ignore') as f:
+                    text = f.read()
+                if len(text) >= args.min_size:
+                    texts.append(text)
+    print(f'corpus: {len(texts)} files >= {args.min_size} chars from {args.corpus}\n')
+
+    print(f"{'edit':24} {'mode':6} {'re-embed ratio':>15} {'chunks re-embedded':>19}")
+    for edit_name in edits('x\n'):
+        for mode in ('fixed', 'cdc'):
+            ratios, counts = [], []
+            for text in texts:
+                changed, total = reembedded(mode, text, edits(text)[edit_name])
+                ratios.append(changed / max(1, total))
+                counts.append(changed)
+            if ratios:
+                print(f'{edit_name:24} {mode:6} {statistics.mean(ratios):15.3f} {statistics.mean(counts):19.2f}')
+
+
+if __name__ == '__main__':
+    main()
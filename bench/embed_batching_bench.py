@@ -0,0 +1,125 @@
+"""Single-text query embeddings under concurrency: one model run per call vs the shared batcher.
+
+`--clients` threads each embed `--requests` distinct prompts one at a time, the
+way /rag/query embeds its prompt, in three modes:
+- direct: every call runs the model on its own (what get_embeddings did),
+- batcher: EmbeddingBatcher.embed from each thread,
+- batcher async: EmbeddingBatcher.embed_async from an event loop per thread
+  (the /rag/query path),
+and reports throughput, latency percentiles and model runs per mode.
+
+With the model on disk (ONNX_MODEL_PATH) the real session is used; otherwise a
+stand-in costs `--run-ms` per run plus `--text-ms` per text, which is the shape
+of an ONNX run (fixed per-run overhead plus per-row work). Its runs take turns,
+as ONNX Runtime runs do when each already uses every core (intra-op threads).
+
+    python bench/embed_batching_bench.py --clients 16 --requests 50 --wait-ms 5
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from service.embedding import embedding_utils  # noqa: E402
+from service.embedding.embedding_utils import EmbeddingBatcher  # noqa: E402
+
+
+class CountingModel:
+    def __init__(self, fn):
+        self.fn = fn
+        self.runs = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.runs += 1
+        return self.fn(texts)
+
+
+def stand_in(run_ms, text_ms, dim=384):
+    cores = threading.Lock()
+
+    def embed(texts):
+        with cores:
+            time.sleep((run_ms + text_ms * len(texts)) / 1000.0)
+        return np.ones((len(texts), dim), dtype='float32')
+    return embed
+
+
+def _drive(clients, requests, call):
+    """Run `call(text)` from `clients` threads; returns (wall seconds, per-call latencies)."""
+    latencies = [[] for _ in range(clients)]
+    barrier = threading.Barrier(clients + 1)
+
+    def client(c):
+        barrier.wait()
+        for r in range(requests):
+            t0 = time.perf_counter()
+            call(f'how is request {r} of client {c} authenticated?')
+            latencies[c].append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0, np.array([x for lat in latencies for x in lat])
+
+
+def _drive_async(clients, requests, batcher):
+    async def one(text):
+        return await batcher.embed_async([text])
+    return _drive(clients, requests, lambda text: asyncio.run(one(text)))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--clients', type=int, default=16)
+    ap.add_argument('--requests', type=int, default=50, help='prompts per client')
+    ap.add_argument('--wait-ms', type=float, default=embedding_utils.EMBED_BATCH_WAIT_MS)
+    ap.add_argument('--max-batch', type=int, default=embedding_utils.EMBED_BATCH_SIZE)
+    ap.add_argument('--run-ms', type=float, default=4.0, help='stand-in cost per model run')
+    ap.add_argument('--text-ms', type=float, default=0.3, help='stand-in cost per text')
+    args = ap.parse_args()
+
+    model_path = embedding_utils._model_path()
+    if os.path.exists(model_path):
+        fn, source = embedding_utils._encode, model_path
+        fn(['warmup'])
+    else:
+        fn = stand_in(args.run_ms, args.text_ms)
+        source = f'stand-in ({args.run_ms} ms/run + {args.text_ms} ms/text; {model_path} not found)'
+
+    results = {}
+    model = CountingModel(fn)
+    results['direct'] = (*_drive(args.clients, args.requests, lambda text: model([text])), model.runs)
+    for name in ('batcher', 'batcher async'):
+        model = CountingModel(fn)
+        batcher = EmbeddingBatcher(model, max_batch=args.max_batch, max_wait=args.wait_ms / 1000.0)
+        if name == 'batcher':
+            wall, lat = _drive(args.clients, args.requests, lambda text: batcher.embed([text]))
+        else:
+            wall, lat = _drive_async(args.clients, args.requests, batcher)
+        batcher.stop()
+        results[name] = (wall, lat, model.runs)
+
+    total = args.clients * args.requests
+    print(f'model: {source}')
+    print(f'{args.clients} clients x {args.requests} prompts; wait {args.wait_ms} ms, max batch {args.max_batch}')
+    print(f'{"":<14} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"runs":>6} {"texts/run":>10}')
+    for name, (wall, lat, runs) in results.items():
+        p50, p95, p99 = (1000 * np.percentile(lat, q) for q in (50, 95, 99))
+        print(f'{name:<14} {total / wall:>8.0f} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f} {runs:>6} {total / runs:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
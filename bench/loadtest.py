@@ -0,0 +1,339 @@
+"""Load test and configuration sweep for the HTTP service.
+
+For every combination of --workers, --threads, --max-concurrency,
+--index-workers and --cache-ttl, starts `gunicorn bench.stub_app:app`
+(Pinecone, Gemini, Mongo and the ONNX model replaced by stand-ins with the
+configured latencies, see bench/stub_app.py), replays a mixed workload from
+--clients closed-loop clients and reports throughput, latency percentiles,
+the 429 rate and peak RSS of the whole gunicorn process tree. It then
+recommends the configuration with the highest throughput that meets
+--slo-p95-ms, --max-reject-rate and --rss-budget-mb.
+
+Workload knobs: --query-ratio (queries vs index calls), --prompts and --zipf
+(how skewed repeated prompts are; 0 is uniform), --repos (synthetic repos
+and their chunk counts) and --index-files/--file-bytes (size of index calls).
+
+Usage:
+    python bench/loadtest.py --duration 20 --clients 16 --workers 1,2,4 --max-concurrency 1,2,4
+    python bench/loadtest.py --url http://127.0.0.1:8000 --duration 30   # an already running server
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _ints(value):
+    return [int(v) for v in str(value).split(',') if v.strip()]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# ---- process tree RSS -------------------------------------------------------
+
+def _children(pid: int):
+    out = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            out.append(int(entry))
+    return out
+
+
+def tree_rss(pid: int) -> int:
+    """Resident bytes of `pid` and all its descendants (Linux /proc)."""
+    total, stack = 0, [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+        stack.extend(_children(p))
+    return total
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, tree_rss(self.pid))
+            self.stopped.wait(self.interval)
+
+
+# ---- workload ---------------------------------------------------------------
+
+class Workload:
+    def __init__(self, args, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.query_ratio = args.query_ratio
+        self.repos = [spec.partition(':')[0] for spec in args.repos.split(',') if spec]
+        self.prompts = [f'How is request {i} validated and where are errors handled?' for i in range(args.prompts)]
+        weights = [1.0 / (rank + 1) ** args.zipf for rank in range(args.prompts)]
+        self.cum = list(itertools.accumulate(weights))
+        self.index_files = args.index_files
+        self.file_bytes = args.file_bytes
+        self.top_k = args.top_k
+
+    def next(self):
+        """(kind, path, payload) of the next request."""
+        if self.rng.random() < self.query_ratio:
+            prompt = self.rng.choices(self.prompts, cum_weights=self.cum)[0]
+            return 'query', '/rag/query', {'repoId': self.rng.choice(self.repos), 'prompt': prompt, 'top_k': self.top_k}
+        n = self.rng.randrange(1_000_000)
+        line = f'def f_{n}(x):\n    return x * {n}\n'
+        content = (line * (self.file_bytes // len(line) + 1))[:self.file_bytes]
+        files = [{'filename': f'src/load_{n}_{i}.py', 'content': content} for i in range(self.index_files)]
+        return 'index', '/rag/index', {'repoId': f'load-{n % 4}', 'files': files, 'metadata': {}}
+
+
+def _post(url: str, payload, timeout: float):
+    data = json.dumps(payload).encode('utf-8')
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            r.read()
+            return r.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except Exception:
+        return 0  # connection error or timeout
+
+
+def drive(base_url: str, args, duration: float, warmup: float):
+    """Run --clients closed-loop clients; returns [(kind, status, seconds)] after the warmup."""
+    records, lock = [], threading.Lock()
+    start = time.monotonic()
+    measure_from, stop_at = start + warmup, start + warmup + duration
+
+    def client(i):
+        workload = Workload(args, seed=i)
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                return
+            kind, path, payload = workload.next()
+            t0 = time.perf_counter()
+            status = _post(base_url + path, payload, args.timeout)
+            dt = time.perf_counter() - t0
+            if now >= measure_from:
+                with lock:
+                    records.append((kind, status, dt))
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return records
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+def summarize(records, duration: float):
+    total = len(records)
+    ok = [r for r in records if 200 <= r[1] < 300]
+    out = {
+        'requests': total,
+        'throughput': round(len(ok) / duration, 2),
+        'reject_rate': round(sum(1 for r in records if r[1] == 429) / total, 4) if total else None,
+        'error_rate': round(sum(1 for r in records if r[1] != 429 and not 200 <= r[1] < 300) / total, 4) if total else None,
+    }
+    for kind in ('query', 'index'):
+        lat = [r[2] * 1000 for r in ok if r[0] == kind]
+        out[kind] = {'ok': len(lat), 'p50_ms': _pct(lat, 50), 'p95_ms': _pct(lat, 95), 'p99_ms': _pct(lat, 99),
+                     'mean_ms': statistics.fmean(lat) if lat else None}
+    return out
+
+
+# ---- server lifecycle -------------------------------------------------------
+
+def start_server(config, args, port: int, workdir: str):
+    env = dict(os.environ,
+               MAX_CONCURRENCY=str(config['max_concurrency']),
+               QUERY_CACHE_TTL=str(config['cache_ttl']),
+               BACKGROUND_INDEX='true' if config['index_workers'] else 'false',
+               INDEX_WORKERS=str(max(1, config['index_workers'])),
+               STUB_REPOS=args.repos,
+               STUB_PINECONE_MS=str(args.pinecone_ms),
+               STUB_EMBED_MS=str(args.embed_ms),
+               STUB_MONGO_MS=str(args.mongo_ms),
+               LLM_PROVIDER='local',
+               LLM_LOCAL_LATENCY=str(args.llm_ms / 1000.0),
+               LLM_LOCAL_JITTER=str(args.llm_jitter_ms / 1000.0),
+               LOG_LEVEL='WARNING')
+    cmd = [sys.executable, '-m', 'gunicorn', 'bench.stub_app:app', '-b', f'127.0.0.1:{port}',
+           '-w', str(config['workers']), '--threads', str(config['threads']),
+           '--chdir', workdir, '--pythonpath', ROOT, '--timeout', '120', '--log-level', 'warning']
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'gunicorn exited: {proc.stderr.read().decode(errors="replace")[-2000:]}')
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/rag/health', timeout=1) as r:
+                if r.status == 200:
+                    return proc
+        except Exception:
+            time.sleep(0.1)
+    proc.kill()
+    raise TimeoutError('server did not become healthy')
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def run_config(config, args):
+    port = _free_port()
+    workdir = tempfile.mkdtemp(prefix='ragsvc-load-')
+    proc = start_server(config, args, port, workdir)
+    sampler = RssSampler(proc.pid)
+    sampler.start()
+    try:
+        records = drive(f'http://127.0.0.1:{port}', args, args.duration, args.warmup)
+    finally:
+        sampler.stopped.set()
+        sampler.join()
+        stop_server(proc)
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = summarize(records, args.duration)
+    result['peak_rss_mb'] = round(sampler.peak / 2**20, 1)
+    return result
+
+
+def recommend(results, args):
+    """Highest throughput within the SLOs; among configs within 5% of it, the smallest RSS."""
+    ok = [r for r in results
+          if r['query']['p95_ms'] is not None and r['query']['p95_ms'] <= args.slo_p95_ms
+          and (r['reject_rate'] or 0) <= args.max_reject_rate
+          and (not args.rss_budget_mb or r['peak_rss_mb'] <= args.rss_budget_mb)]
+    if not ok:
+        return None
+    best = max(r['throughput'] for r in ok)
+    near = [r for r in ok if r['throughput'] >= 0.95 * best]
+    return min(near, key=lambda r: (r['peak_rss_mb'], -r['throughput']))
+
+
+def _fmt(v, width=8):
+    return f'{"-" if v is None else (f"{v:.1f}" if isinstance(v, float) else v):>{width}}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='drive this running server instead of sweeping configurations')
+    parser.add_argument('--workers', type=_ints, default=[1, 2, 4], help='gunicorn -w values')
+    parser.add_argument('--threads', type=_ints, default=[4], help='gunicorn --threads values')
+    parser.add_argument('--max-concurrency', type=_ints, default=[1, 2, 4])
+    parser.add_argument('--index-workers', type=_ints, default=[0], help='0 = synchronous indexing')
+    parser.add_argument('--cache-ttl', type=_ints, default=[300], help='QUERY_CACHE_TTL values (0 disables)')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--timeout', type=float, default=60.0, help='client timeout per request')
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--query-ratio', type=float, default=0.9)
+    parser.add_argument('--prompts', type=int, default=200)
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--repos', default='repo-0:200,repo-1:2000')
+    parser.add_argument('--top-k', type=int, default=6)
+    parser.add_argument('--index-files', type=int, default=10)
+    parser.add_argument('--file-bytes', type=int, default=4000)
+    parser.add_argument('--pinecone-ms', type=float, default=20.0)
+    parser.add_argument('--llm-ms', type=float, default=300.0)
+    parser.add_argument('--llm-jitter-ms', type=float, default=200.0)
+    parser.add_argument('--embed-ms', type=float, default=5.0)
+    parser.add_argument('--mongo-ms', type=float, default=2.0)
+    parser.add_argument('--slo-p95-ms', type=float, default=1500.0)
+    parser.add_argument('--max-reject-rate', type=float, default=0.01)
+    parser.add_argument('--rss-budget-mb', type=float, default=0.0, help='0 = no limit')
+    parser.add_argument('--json', help='write all results to this file')
+    args = parser.parse_args()
+
+    if args.url:
+        result = summarize(drive(args.url.rstrip('/'), args, args.duration, args.warmup), args.duration)
+        print(json.dumps(result, indent=2))
+        return
+
+    configs = [dict(workers=w, threads=t, max_concurrency=c, index_workers=iw, cache_ttl=ttl)
+               for w, t, c, iw, ttl in itertools.product(args.workers, args.threads, args.max_concurrency,
+                                                         args.index_workers, args.cache_ttl)]
+    header = (f'{"w":>3} {"thr":>4} {"conc":>5} {"idxw":>5} {"ttl":>5} | {"rps":>8} {"q p50":>8} {"q p95":>8} '
+              f'{"q p99":>8} {"i p95":>8} {"429%":>8} {"err%":>8} {"rss MB":>8}')
+    print(header)
+    print('-' * len(header))
+    results = []
+    for config in configs:
+        try:
+            r = {**config, **run_config(config, args)}
+        except Exception as e:
+            print(f'{config}: failed: {e}')
+            continue
+        results.append(r)
+        print(f'{config["workers"]:>3} {config["threads"]:>4} {config["max_concurrency"]:>5} '
+              f'{config["index_workers"]:>5} {config["cache_ttl"]:>5} | {_fmt(r["throughput"])} '
+              f'{_fmt(r["query"]["p50_ms"])} {_fmt(r["query"]["p95_ms"])} {_fmt(r["query"]["p99_ms"])} '
+              f'{_fmt(r["index"]["p95_ms"])} {_fmt((r["reject_rate"] or 0) * 100)} '
+              f'{_fmt((r["error_rate"] or 0) * 100)} {_fmt(r["peak_rss_mb"])}', flush=True)
+
+    best = recommend(results, args)
+    print()
+    if best is None:
+        print(f'no configuration met p95 <= {args.slo_p95_ms:.0f} ms and 429 rate <= {args.max_reject_rate:.1%}')
+    else:
+        print('recommended: ' + ' '.join(f'{k}={best[k]}' for k in
+                                        ('workers', 'threads', 'max_concurrency', 'index_workers', 'cache_ttl')))
+        print(f'  gunicorn -w {best["workers"]} --threads {best["threads"]} main:app  with  '
+              f'MAX_CONCURRENCY={best["max_concurrency"]} QUERY_CACHE_TTL={best["cache_ttl"]}'
+              + (f' BACKGROUND_INDEX=true INDEX_WORKERS={best["index_workers"]}' if best['index_workers'] else ''))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': {k: v for k, v in vars(args).items() if k != 'json'}, 'results': results,
+                       'recommended': best}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""Benchmark the Mongo access patterns of service/db/database.py.
+
+Measures, with and without the indexes from `ensure_indexes()`:
+
+- job lookups by job_id and the "recent jobs of a repo" listing
+- progress checkpoints written one update_one per batch vs deferred into bulk_writes
+- the size of a query log document in the old (full answer) and compact form
+
+By default it runs against an in-process stand-in that models what matters here:
+every call costs a round trip (--rtt-ms) and a query without a usable index
+examines every document. With --uri it runs against a real mongod, in a
+throwaway database (--db, dropped afterwards).
+
+    python bench/mongo_bench.py --jobs 20000 --lookups 2000
+    python bench/mongo_bench.py --uri mongodb://localhost:27017
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bson  # noqa: E402
+
+from service.db import database  # noqa: E402
+
+
+class _Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        self.docs.sort(key=lambda d: d.get(key) or 0, reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class _Result:
+    def __init__(self, matched):
+        self.matched_count = self.modified_count = matched
+
+
+class StandInCollection:
+    """Just enough of pymongo's Collection for database.py, with equality indexes and a round-trip cost."""
+
+    def __init__(self, stats, rtt):
+        self.docs = []
+        self.indexes = {}  # leading field -> value -> [doc]
+        self.stats = stats
+        self.rtt = rtt
+
+    def _trip(self):
+        self.stats['round_trips'] += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def _candidates(self, flt):
+        for field, by_value in self.indexes.items():
+            value = flt.get(field)
+            if value is not None and not isinstance(value, dict):
+                return by_value.get(value, [])
+        return self.docs
+
+    def _match(self, flt):
+        out = []
+        for doc in self._candidates(flt):
+            self.stats['docs_examined'] += 1
+            if all(doc.get(k) in v['$in'] if isinstance(v, dict) else doc.get(k) == v for k, v in flt.items()):
+                out.append(doc)
+        return out
+
+    @staticmethod
+    def _project(doc, projection):
+        if not projection:
+            return dict(doc)
+        include = {k for k, v in projection.items() if v and k != '_id'}
+        if include:
+            return {k: doc[k] for k in include if k in doc}
+        return {k: v for k, v in doc.items() if projection.get(k, 1)}
+
+    def _index_doc(self, doc):
+        for field, by_value in self.indexes.items():
+            if field in doc:
+                by_value[doc[field]].append(doc)
+
+    def create_index(self, keys, **options):
+        self._trip()
+        field = keys[0][0]
+        if field not in self.indexes:
+            self.indexes[field] = defaultdict(list)
+            for doc in self.docs:
+                if field in doc:
+                    self.indexes[field][doc[field]].append(doc)
+
+    def insert_one(self, doc):
+        self._trip()
+        self.docs.append(dict(doc))
+        self._index_doc(self.docs[-1])
+
+    def insert_many(self, docs, ordered=True):
+        self._trip()
+        for doc in docs:
+            self.docs.append(dict(doc))
+            self._index_doc(self.docs[-1])
+
+    def _update(self, flt, update):
+        matched = self._match(flt)[:1]
+        for doc in matched:
+            doc.update(update.get('$set', {}))
+        return matched
+
+    def update_one(self, flt, update, upsert=False):
+        self._trip()
+        matched = self._update(flt, update)
+        if not matched and upsert:
+            self.docs.append({**flt, **update.get('$set', {})})
+            self._index_doc(self.docs[-1])
+        return _Result(len(matched))
+
+    def bulk_write(self, ops, ordered=True):
+        self._trip()
+        for op in ops:
+            self._update(op._filter, op._doc)
+
+    def find_one(self, flt, projection=None):
+        self._trip()
+        matched = self._match(flt)
+        return self._project(matched[0], projection) if matched else None
+
+    def find(self, flt, projection=None):
+        self._trip()
+        return _Cursor([self._project(d, projection) for d in self._match(flt)])
+
+    def delete_many(self, flt):
+        self._trip()
+        gone = {id(d) for d in self._match(flt)}
+        self.docs = [d for d in self.docs if id(d) not in gone]
+        for by_value in self.indexes.values():
+            for key in list(by_value):
+                by_value[key] = [d for d in by_value[key] if id(d) not in gone]
+
+
+class StandInDatabase:
+    def __init__(self, rtt=0.0):
+        self.stats = defaultdict(int)
+        self.rtt = rtt
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = StandInCollection(self.stats, self.rtt)
+        return self.collections[name]
+
+    __getattr__ = __getitem__
+
+    def list_collection_names(self):
+        return list(self.collections)
+
+    def create_collection(self, name, **options):
+        return self[name]
+
+
+def _use(db, indexed: bool):
+    database._db = db
+    database._init_attempted = True
+    # pretend the indexes exist so get_db() does not create them yet
+    database._indexes_ensured = True
+    if indexed:
+        database._indexes_ensured = False
+        database.ensure_indexes(db)
+
+
+def _timed(db, fn, n):
+    stats = getattr(db, 'stats', None)
+    before = dict(stats) if stats is not None else {}
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    out = {'ms_per_op': elapsed * 1000 / n}
+    if stats is not None:
+        out.update({k: (stats[k] - before.get(k, 0)) / n for k in ('round_trips', 'docs_examined')})
+    return out
+
+
+def _fmt(label, r):
+    extra = ''.join(f'  {k}={v:,.2f}' for k, v in r.items() if k != 'ms_per_op')
+    print(f'  {label:<34} {r["ms_per_op"]:8.3f} ms/op{extra}')
+
+
+def _seed_jobs(n, repos):
+    now = time.time()
+    ids = []
+    for i in range(n):
+        job_id = str(uuid.uuid4())
+        ids.append(job_id)
+        database.create_index_job({'job_id': job_id, 'repo_id': f'repo-{i % repos}', 'status': 'completed',
+                                   'created_at': now - n + i, 'files_done': 50, 'total_files': 50,
+                                   'metadata': {'branch': 'main'}, 'result': {'chunk_count': 1234, 'upserts': 1234}})
+    return ids
+
+
+def _lookups(db, ids, repos, n):
+    rnd = random.Random(0)
+    _fmt('get_index_job(job_id)', _timed(db, lambda i: database.get_index_job(rnd.choice(ids)), n))
+    _fmt('recent_index_jobs(repo, 20)',
+         _timed(db, lambda i: database.recent_index_jobs(f'repo-{rnd.randrange(repos)}', 20), max(1, n // 10)))
+
+
+def _checkpoints(db, ids, args, defer):
+    """Checkpoint writes of `active_jobs` jobs, one per batch, `batch_ms` of (simulated) work apart."""
+    database.JOB_UPDATE_FLUSH_SECONDS = args.flush_ms / 1000.0
+    active = ids[:args.active_jobs]
+
+    def step(i):
+        time.sleep(args.batch_ms / 1000.0)
+        database.update_index_job(active[i % len(active)], {'batches_done': i // len(active) + 1,
+                                                            'heartbeat': time.time()}, defer=defer)
+        if i == args.active_jobs * args.batches - 1:
+            database.flush_index_job_updates()
+    r = _timed(db, step, args.active_jobs * args.batches)
+    r['ms_per_op'] -= args.batch_ms
+    return r
+
+
+def _log_sizes():
+    prompt = 'How should I refactor the retry logic in the vector store client? ' * 3
+    result = {'suggestions': [f'Suggestion {i}: ' + 'x' * 200 for i in range(6)],
+              'insights': [f'Insight {i}: ' + 'y' * 150 for i in range(4)], 'guidance': 'z' * 1500}
+    old = {'repoId': 'repo-0', 'log': {'prompt': prompt, 'result': result}}
+    new = {'repoId': 'repo-0', 'ts': time.time(), 'prompt': prompt, 'model': 'gemini-2.5-flash', 'cached': False,
+           'chunks': 6, 'suggestions': 6, 'insights': 4, 'guidance_chars': 1500}
+    print(f'  query log document: {len(bson.encode(old)):,} B full answer -> {len(bson.encode(new)):,} B compact')
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--uri', help='run against this mongod instead of the in-process stand-in')
+    ap.add_argument('--db', default='ragsvc_bench', help='throwaway database used with --uri')
+    ap.add_argument('--rtt-ms', type=float, default=0.3, help='stand-in round-trip time')
+    ap.add_argument('--jobs', type=int, default=20000, help='index_jobs documents to seed')
+    ap.add_argument('--repos', type=int, default=200)
+    ap.add_argument('--lookups', type=int, default=1000)
+    ap.add_argument('--active-jobs', type=int, default=4)
+    ap.add_argument('--batches', type=int, default=100, help='checkpoints per active job')
+    ap.add_argument('--batch-ms', type=float, default=2.0, help='work between two checkpoints of the job set')
+    ap.add_argument('--flush-ms', type=float, default=100.0, help='JOB_UPDATE_FLUSH_SECONDS, in ms')
+    args = ap.parse_args()
+
+    if args.uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.uri)
+        client.drop_database(args.db)
+        make_db = lambda: client[args.db]  # noqa: E731
+    else:
+        make_db = lambda: StandInDatabase(args.rtt_ms / 1000.0)  # noqa: E731
+
+    print(f'{args.jobs:,} jobs over {args.repos} repos ({"mongod " + args.uri if args.uri else "stand-in"})')
+    for indexed in (False, True):
+        if args.uri:
+            client.drop_database(args.db)
+        db = make_db()
+        _use(db, indexed=False)
+        ids = _seed_jobs(args.jobs, args.repos)
+        if indexed:
+            _use(db, indexed=True)
+        print('with indexes' if indexed else 'without indexes')
+        _lookups(db, ids, args.repos, args.lookups)
+        _fmt(f'checkpoint update_one, {args.active_jobs} jobs', _checkpoints(db, ids, args, False))
+        _fmt(f'checkpoint bulk_write, {args.active_jobs} jobs', _checkpoints(db, ids, args, True))
+    _log_sizes()
+    if args.uri:
+        client.drop_database(args.db)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Compare mean pooling in NumPy with pooling fused into the ONNX graph.
+
+For the same model this runs batches through
+- the plain export (`last_hidden_state` copied out) pooled the way
+  embedding_utils used to (`hidden * mask[:, :, None]`) and with
+  embedding_utils.mean_pool (a batched matmul), and
+- the fused export (service/utils/export_onnx.py, `sentence_embedding` only),
+and reports time per batch, bytes copied out of the session and peak memory
+per batch (session output plus NumPy temporaries), plus the agreement of
+the outputs.
+
+With the exported model on disk (ONNX_MODEL_PATH, default
+service/embedding/model.onnx) that model is used; otherwise a stand-in with
+the same input/output layout (embedding lookup and --layers dense layers)
+is generated, which isolates the pooling and output cost.
+
+    python bench/pooling_bench.py --batch 32 --seq 256 --runs 20
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import onnx  # noqa: E402
+import onnxruntime as ort  # noqa: E402
+from onnx import TensorProto, helper, numpy_helper  # noqa: E402
+
+from service.embedding.embedding_utils import DEFAULT_MODEL_PATH, POOLED_OUTPUT, mean_pool  # noqa: E402
+from service.utils.export_onnx import HIDDEN_OUTPUT, fuse_pooling  # noqa: E402
+
+
+def stand_in_model(vocab=30522, dim=384, layers=2):
+    rng = np.random.default_rng(0)
+    inits = [numpy_helper.from_array((rng.standard_normal((vocab, dim)) * 0.1).astype('float32'), 'table')]
+    nodes = [helper.make_node('Gather', ['table', 'input_ids'], ['h0'])]
+    for i in range(layers):
+        inits.append(numpy_helper.from_array((rng.standard_normal((dim, dim)) / np.sqrt(dim)).astype('float32'), f'w{i}'))
+        out = HIDDEN_OUTPUT if i == layers - 1 else f'h{i + 1}'
+        nodes.append(helper.make_node('MatMul', [f'h{i}', f'w{i}'], [f'm{i}']))
+        nodes.append(helper.make_node('Tanh', [f'm{i}'], [out]))
+    graph = helper.make_graph(
+        nodes, 'stand_in',
+        [helper.make_tensor_value_info('input_ids', TensorProto.INT64, ['batch', 'sequence']),
+         helper.make_tensor_value_info('attention_mask', TensorProto.INT64, ['batch', 'sequence'])],
+        [helper.make_tensor_value_info(HIDDEN_OUTPUT, TensorProto.FLOAT, ['batch', 'sequence', dim])],
+        inits)
+    return helper.make_model(graph, opset_imports=[helper.make_opsetid('', 14)], ir_version=8)
+
+
+def _inputs(sess, batch, seq, rng):
+    ids = rng.integers(1000, 20000, size=(batch, seq), dtype='int64')
+    lengths = rng.integers(seq // 4, seq + 1, size=batch)
+    mask = (np.arange(seq)[None, :] < lengths[:, None]).astype('int64')
+    feed = {'input_ids': ids * mask, 'attention_mask': mask}
+    names = {i.name for i in sess.get_inputs()}
+    if 'token_type_ids' in names:
+        feed['token_type_ids'] = np.zeros_like(ids)
+    return {k: v for k, v in feed.items() if k in names}
+
+
+def old_mean_pool(hidden, attention_mask):
+    """The pooling embedding_utils did before (a full-size masked copy); normalized here so outputs compare."""
+    mask = attention_mask.astype('float32')
+    summed = (hidden * mask[:, :, None]).sum(axis=1)
+    emb = (summed / mask.sum(axis=1)[:, None]).astype('float32')
+    return emb / np.linalg.norm(emb, axis=1, keepdims=True)
+
+
+def _run(sess, feeds, pool):
+    """`pool` is None for the fused model; the peak counts the session output plus NumPy temporaries."""
+    times, peaks, out_bytes, outs = [], [], 0, []
+    for feed in feeds:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        if pool is None:
+            emb = sess.run([POOLED_OUTPUT], feed)[0]
+            out_bytes = emb.nbytes
+        else:
+            hidden = sess.run([HIDDEN_OUTPUT], feed)[0]
+            out_bytes = hidden.nbytes
+            emb = pool(hidden, feed['attention_mask'])
+            del hidden
+        times.append(time.perf_counter() - t0)
+        # ONNX Runtime allocates its outputs outside tracemalloc's view
+        peaks.append(tracemalloc.get_traced_memory()[1] + out_bytes)
+        tracemalloc.stop()
+        outs.append(emb)
+    return {'ms': 1000 * float(np.median(times)), 'peak_mb': max(peaks) / 1e6, 'out_mb': out_bytes / 1e6,
+            'emb': np.concatenate(outs)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--model', default=os.getenv('ONNX_MODEL_PATH', DEFAULT_MODEL_PATH))
+    ap.add_argument('--batch', type=int, default=32)
+    ap.add_argument('--seq', type=int, default=256)
+    ap.add_argument('--runs', type=int, default=20)
+    ap.add_argument('--layers', type=int, default=2, help='dense layers of the stand-in model')
+    args = ap.parse_args()
+
+    if os.path.exists(args.model):
+        plain = onnx.load(args.model)
+        if any(o.name == POOLED_OUTPUT for o in plain.graph.output):
+            sys.exit(f'{args.model} is already fused; point --model at a plain export')
+        source = args.model
+    else:
+        plain = stand_in_model(layers=args.layers)
+        source = f'stand-in ({args.layers} dense layers; {args.model} not found)'
+    fused = fuse_pooling(onnx.load_from_string(plain.SerializeToString()))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sessions = {}
+        for name, model in (('numpy pooling', plain), ('fused pooling', fused)):
+            path = os.path.join(tmp, name.replace(' ', '_') + '.onnx')
+            onnx.save(model, path)
+            sessions[name] = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+        rng = np.random.default_rng(1)
+        feeds = [_inputs(sessions['fused pooling'], args.batch, args.seq, rng) for _ in range(args.runs)]
+        modes = [('numpy, before', sessions['numpy pooling'], old_mean_pool),
+                 ('numpy pooling', sessions['numpy pooling'], mean_pool),
+                 ('fused pooling', sessions['fused pooling'], None)]
+        for _, sess, pool in modes:
+            _run(sess, feeds[:1], pool)  # warm-up
+        results = {name: _run(sess, feeds, pool) for name, sess, pool in modes}
+
+    print(f'model: {source}; batch {args.batch} x seq {args.seq}, {args.runs} runs')
+    print(f'{"":<15} {"ms/batch":>9} {"output MB":>10} {"peak MB":>8}')
+    for name, r in results.items():
+        print(f'{name:<15} {r["ms"]:>9.2f} {r["out_mb"]:>10.2f} {r["peak_mb"]:>8.2f}')
+    a, b = results['numpy pooling']['emb'], results['fused pooling']['emb']
+    print(f'max |difference| between outputs: {float(np.abs(a - b).max()):.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Compare the fp32, int8 and fp16 embedding models on a sample corpus.
+
+For each variant that exists on disk (see service/utils/quantize.py) this
+reports embedding throughput (chunks/sec), process RSS after loading and
+running the model, and cosine agreement of its embeddings with fp32.
+Each variant runs in a fresh interpreter so RSS numbers are not shared.
+
+Usage:
+    python bench/quantization_bench.py [--corpus DIR] [--max-chunks 512] [--batch 32]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VARIANT_PROBE = """
+import json, os, sys, time
+import numpy as np
+from service.embedding import embedding_utils
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+
+chunks = json.load(open(sys.argv[1]))
+batch = int(sys.argv[3])
+embedding_utils._get_model_session_and_tokenizer()
+embedding_utils._embed_batch(chunks[:1])
+t0 = time.perf_counter()
+out = np.concatenate([embedding_utils._embed_batch(chunks[i:i + batch]) for i in range(0, len(chunks), batch)])
+dt = time.perf_counter() - t0
+np.save(sys.argv[2], out)
+print(json.dumps({'seconds': dt, 'rss_mb': rss_mb()}))
+"""
+
+
+def load_corpus(corpus_dir: str, max_chunks: int, chunk_size: int = 2000, overlap: int = 200):
+    chunks = []
+    for dirpath, dirnames, filenames in os.walk(corpus_dir):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.') and d not in ('data', '__pycache__')]
+        for name in sorted(filenames):
+            if not name.endswith(('.py', '.md', '.js', '.ts')):
+                continue
+            with open(os.path.join(dirpath, name), encoding='utf-8', errors='ignore') as f:
+                text = f.read()
+            for i in range(0, len(text), chunk_size - overlap):
+                chunks.append(text[i:i + chunk_size])
+                if len(chunks) >= max_chunks:
+                    return chunks
+    return chunks
+
+
+def run_variant(variant: str, corpus_file: str, out_file: str, batch: int):
+    env = dict(os.environ, EMBEDDING_MODEL_VARIANT=variant)
+    proc = subprocess.run([sys.executable, '-c', VARIANT_PROBE, corpus_file, out_file, str(batch)],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed')
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def cosine_rows(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    from service.embedding.embedding_utils import DEFAULT_MODEL_PATH, MODEL_VARIANTS, variant_model_path
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=ROOT)
+    parser.add_argument('--max-chunks', type=int, default=512)
+    parser.add_argument('--batch', type=int, default=32)
+    args = parser.parse_args()
+
+    base = os.getenv('ONNX_MODEL_PATH', DEFAULT_MODEL_PATH)
+    chunks = load_corpus(args.corpus, args.max_chunks)
+    print(f'corpus: {len(chunks)} chunks from {args.corpus}')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_file = os.path.join(tmp, 'corpus.json')
+        with open(corpus_file, 'w') as f:
+            json.dump(chunks, f)
+
+        results, embeddings = {}, {}
+        for variant in MODEL_VARIANTS:
+            path = os.path.join(ROOT, variant_model_path(base, variant))
+            if not os.path.exists(path):
+                print(f'{variant}: skipped ({path} not found)')
+                continue
+            out_file = os.path.join(tmp, f'{variant}.npy')
+            try:
+                results[variant] = run_variant(variant, corpus_file, out_file, args.batch)
+            except RuntimeError as e:
+                print(f'{variant}: failed ({e})')
+                continue
+            embeddings[variant] = np.load(out_file)
+            results[variant]['model_mb'] = os.path.getsize(path) / 1e6
+
+    if not results:
+        print('no model variants found; export the fp32 model first (see service/utils/codedf.py)')
+        return
+
+    print(f"{'variant':8} {'chunks/s':>10} {'rss MB':>8} {'model MB':>9} {'cos mean':>9} {'cos min':>8}")
+    for variant, r in results.items():
+        cos_mean = cos_min = float('nan')
+        if 'fp32' in embeddings and variant in embeddings:
+            cos = cosine_rows(embeddings['fp32'], embeddings[variant])
+            cos_mean, cos_min = float(cos.mean()), float(cos.min())
+        print(f"{variant:8} {len(chunks) / r['seconds']:10.1f} {r['rss_mb']:8.0f} {r['model_mb']:9.1f} {cos_mean:9.4f} {cos_min:8.4f}")
+
+
+if __name__ == '__main__':
+    main()
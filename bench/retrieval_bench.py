@@ -0,0 +1,86 @@
+"""Flat vs hierarchical retrieval on a synthetic repo, using the local backend.
+
+Each file has a topic vector; its chunks are the topic plus noise. Queries
+are noisy copies of one chunk, and a retrieved chunk counts as relevant when
+it comes from the query's file. Reports rows scored per query, latency and
+precision@k for both modes.
+
+Usage:
+    python bench/retrieval_bench.py [--files 500] [--chunks 40] [--dim 384] [--top-k 6] [--hier-files 8] [--noise 3]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['VECTOR_BACKEND'] = 'local'
+os.environ.pop('LOCAL_VECTOR_PATH', None)
+
+from service.db.filters import path_fields  # noqa: E402
+from service.db.vector_store import get_backend  # noqa: E402
+from service.piplines import rag_pipeline  # noqa: E402
+
+
+def build(store, n_files, n_chunks, dim, rng, noise):
+    for f in range(n_files):
+        path = f'pkg{f % 20}/module_{f}.py'
+        topic = rng.normal(size=dim).astype('float32')
+        embs = topic + rng.normal(scale=noise, size=(n_chunks, dim)).astype('float32')
+        vectors = [(f'repo:{path}:{i}', embs[i], {'path': path, **path_fields(path)}) for i in range(n_chunks)]
+        store.upsert(vectors, namespace='repo')
+        store.upsert([(f'repo:{path}', rag_pipeline.file_vector(embs), {'path': path, **path_fields(path)})],
+                     namespace=rag_pipeline.files_namespace('repo'))
+
+
+def run(mode, queries, top_k, store):
+    store.stats.update(queries=0, rows_scored=0)
+    latencies, precision = [], []
+    for q, path in queries:
+        start = time.perf_counter()
+        res = rag_pipeline.retrieve(['repo'], q, top_k=top_k, mode=mode)
+        latencies.append(time.perf_counter() - start)
+        precision.append(sum(r['metadata']['path'] == path for r in res) / top_k)
+    return {
+        'rows/query': store.stats['rows_scored'] / len(queries),
+        'p50 ms': statistics.median(latencies) * 1000,
+        'precision@k': statistics.mean(precision),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--chunks', type=int, default=40)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--top-k', type=int, default=6)
+    parser.add_argument('--hier-files', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=3.0, help='chunk and query noise relative to the file topic')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    store = get_backend('local')
+    build(store, args.files, args.chunks, args.dim, rng, args.noise)
+    rag_pipeline.RAG_HIER_FILES = args.hier_files
+
+    ids = store.list_ids('', namespace='repo')
+    queries = []
+    for vid, values, meta in store.fetch([ids[i] for i in rng.integers(0, len(ids), args.queries)], namespace='repo'):
+        queries.append((np.asarray(values) + rng.normal(scale=args.noise, size=args.dim).astype('float32'), meta['path']))
+
+    print(f'{args.files} files x {args.chunks} chunks, dim {args.dim}, top_k {args.top_k}, '
+          f'hierarchical over {args.hier_files} files\n')
+    print(f"{'mode':13} {'rows/query':>11} {'p50 ms':>8} {'precision@k':>12}")
+    for mode in ('flat', 'hierarchical'):
+        r = run(mode, queries, args.top_k, store)
+        print(f"{mode:13} {r['rows/query']:11.0f} {r['p50 ms']:8.2f} {r['precision@k']:12.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Startup-time benchmark for the RAG service.
+
+Reports, over a few fresh interpreters:
+- the time to `import main`
+- which heavy modules (if any) were pulled in by that import
+- the time from process spawn to the first successful `GET /rag/health`
+
+Usage:
+    python bench/startup_bench.py [--runs 5] [--port 8931]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('transformers', 'onnxruntime', 'google.generativeai', 'pymongo', 'pinecone')
+
+IMPORT_PROBE = f"""
+import json, sys, time
+t0 = time.perf_counter()
+import main
+dt = time.perf_counter() - t0
+print(json.dumps({{'import_s': dt, 'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+SERVER_PROBE = """
+import os
+import main
+main.app.run(host='127.0.0.1', port=int(os.environ['PORT']), debug=False, use_reloader=False)
+"""
+
+
+def measure_import():
+    out = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure_first_health(port: int, timeout: float = 60.0):
+    env = dict(os.environ, PORT=str(port))
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', SERVER_PROBE], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f'http://127.0.0.1:{port}/rag/health'
+        while time.perf_counter() - t0 < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as r:
+                    if r.status == 200:
+                        return time.perf_counter() - t0
+            except Exception:
+                time.sleep(0.01)
+        raise TimeoutError(f'/rag/health did not answer within {timeout}s')
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except Exception:
+            proc.kill()
+
+
+def _summary(values):
+    return f'median={statistics.median(values):.3f}s min={min(values):.3f}s max={max(values):.3f}s'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=8931)
+    args = parser.parse_args()
+
+    imports, heavy, health = [], set(), []
+    for i in range(args.runs):
+        probe = measure_import()
+        imports.append(probe['import_s'])
+        heavy.update(probe['heavy'])
+        health.append(measure_first_health(args.port + i))
+
+    print(f'import main:          {_summary(imports)}')
+    print(f'first /rag/health:    {_summary(health)}')
+    print(f'heavy modules loaded: {sorted(heavy) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
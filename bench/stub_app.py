@@ -0,0 +1,117 @@
+"""`main:app` with its external services replaced by latency-injecting stand-ins.
+
+Used by bench/loadtest.py (`gunicorn bench.stub_app:app`); nothing leaves the
+machine, so the load test measures the service itself: admission, caches,
+the event loops and the worker layout.
+
+- Pinecone: the local numpy backend plus STUB_PINECONE_MS per call.
+- Gemini: LLM_PROVIDER=local (LLM_LOCAL_LATENCY / LLM_LOCAL_JITTER).
+- Mongo: query logs and index metadata writes sleep STUB_MONGO_MS; background
+  index jobs are recorded in the local job store.
+- ONNX: hash-derived unit vectors, STUB_EMBED_MS per batch plus
+  STUB_EMBED_MS_PER_TEXT per text.
+
+Every worker seeds the same synthetic repos at import, so queries find data
+whichever worker serves them: STUB_REPOS is a comma-separated list of
+`<repo>:<chunks>` (default "repo-0:200,repo-1:2000").
+"""
+
+import hashlib
+import os
+import time
+
+import numpy as np
+
+os.environ.setdefault('LLM_PROVIDER', 'local')
+os.environ.setdefault('VECTOR_BACKEND', 'pinecone')
+os.environ.setdefault('WARM_START', 'off')
+os.environ.setdefault('JOB_STORE', 'local')
+
+from service.db import database, vector_store  # noqa: E402
+from service.db.filters import path_fields  # noqa: E402
+from service.db.local_store import LocalVectorStore  # noqa: E402
+from service.embedding import embedding_utils  # noqa: E402
+from service.piplines import rag_pipeline  # noqa: E402
+
+DIM = int(os.getenv('EMBEDDING_DIM', '384'))
+
+
+def _ms(name: str, default: str = '0') -> float:
+    return float(os.getenv(name, default)) / 1000.0
+
+
+class LatencyBackend(LocalVectorStore):
+    """Local vector store that sleeps like a network round trip on every call."""
+
+    name = 'pinecone'
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def upsert(self, vectors, namespace=None):
+        self._wait()
+        return super().upsert(vectors, namespace=namespace)
+
+    def query(self, query_vec, top_k=6, namespace=None, filter=None):
+        self._wait()
+        return super().query(query_vec, top_k=top_k, namespace=namespace, filter=filter)
+
+    def list_ids(self, prefix, namespace=None):
+        self._wait()
+        return super().list_ids(prefix, namespace=namespace)
+
+    def fetch(self, ids, namespace=None):
+        self._wait()
+        return super().fetch(ids, namespace=namespace)
+
+    def delete_ids(self, ids, namespace=None):
+        self._wait()
+        return super().delete_ids(ids, namespace=namespace)
+
+
+def stub_vectors(texts):
+    """Deterministic unit vectors derived from the text hash."""
+    out = np.empty((len(texts), DIM), dtype='float32')
+    for i, text in enumerate(texts):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        v = np.random.default_rng(seed).standard_normal(DIM).astype('float32')
+        out[i] = v / np.linalg.norm(v)
+    return out
+
+
+def _stub_embed_batch(texts):
+    time.sleep(_ms('STUB_EMBED_MS', '5') + _ms('STUB_EMBED_MS_PER_TEXT', '1') * len(texts))
+    return stub_vectors(texts)
+
+
+def _stub_mongo(*args, **kwargs):
+    time.sleep(_ms('STUB_MONGO_MS', '2'))
+
+
+def _seed(backend: LatencyBackend):
+    for spec in filter(None, os.getenv('STUB_REPOS', 'repo-0:200,repo-1:2000').split(',')):
+        repo, _, count = spec.partition(':')
+        n = int(count or 200)
+        texts = [f'{repo} chunk {i}: def handler_{i}(request): return process(request, {i})' for i in range(n)]
+        vecs = stub_vectors(texts)
+        rows = [(f'{repo}:src/m{i // 20}.py:{i}', vecs[i],
+                 {'path': f'src/m{i // 20}.py', 'repoId': repo, 'text': texts[i],
+                  **path_fields(f'src/m{i // 20}.py')}) for i in range(n)]
+        backend.namespaces.pop(repo, None)
+        super(LatencyBackend, backend).upsert(rows, namespace=repo)
+
+
+_backend = LatencyBackend(_ms('STUB_PINECONE_MS', '20'))
+vector_store._backends['pinecone'] = _backend
+embedding_utils._embed_batch = _stub_embed_batch
+rag_pipeline.save_query_log = _stub_mongo
+rag_pipeline.save_index_metadata = _stub_mongo
+database.save_index_metadata = _stub_mongo
+_seed(_backend)
+
+from main import app  # noqa: E402,F401
@@ -2,27 +2,80 @@ from flask import Flask
 import os
 import numpy as np
 from dotenv import load_dotenv
-from flask import request, jsonify
-from service.piplines.rag_pipeline import process_rag, index_repo, reset_repo
+from flask import request, jsonify, send_file, after_this_request, g
+from service.piplines.rag_pipeline import process_rag, index_repo, reset_repo, RETRIEVAL_MODES
 from service.worker.worker import IndexWorker
+from service.worker.jobs import FINISHED, get_job_store
 from service.cache.query_cache import TTLCache
+from service.cache import warm_start
 import atexit
 
 # import shutdown helpers (optional)
+# These modules import their heavy dependencies (onnxruntime, transformers,
+# pinecone, pymongo, google.generativeai) lazily; see warmup().
 from service.embedding import embedding_utils
 from service.db import vector_store, database
+from service.db.filters import build_filter
+from service.llm import model_utils
+from service.llm.providers import LLMError
+from service.utils import metrics
+from service.utils.memory import get_governor
+from service.utils import profiling
+from service.utils.admission import AdmissionRejected, get_scheduler
+from service.utils.log import get_logger, log_event
+from service.utils.resilience import CircuitOpenError, DeadlineExceeded, breaker_states
 import hashlib
+import json
+import tempfile
 import traceback
 import asyncio
-from threading import Semaphore
+import time
+from threading import Thread
 
 
 load_dotenv()
 app = Flask(__name__)
+logger = get_logger(__name__)
 
 # Limit concurrent heavy requests to avoid memory spikes. Default 2 concurrent.
+# Queries, indexing and resets get separate slots sized from this (see service/utils/admission.py).
 MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', '2'))
-_semaphore = Semaphore(MAX_CONCURRENCY)
+_admission = get_scheduler()
+
+
+def _rejected(e: AdmissionRejected):
+    return (jsonify({"error": "Too many concurrent requests", "class": e.cls, "reason": e.reason,
+                     "retry_after": e.retry_after}),
+            429, {"Retry-After": str(e.retry_after)})
+
+@app.before_request
+def _start_request_profile():
+    # `X-Profile: 1` plus the admin token captures a cProfile of this request (see service/utils/profiling.py)
+    if request.headers.get(profiling.PROFILE_HEADER) and profiling.enabled() \
+            and profiling.authorized(request.headers.get(profiling.TOKEN_HEADER)):
+        prof = profiling.RequestProfile(request.path)
+        if prof.start():
+            g.profile = prof
+
+
+@app.after_request
+def _stop_request_profile(response):
+    prof = g.pop('profile', None)
+    if prof is not None:
+        path = prof.stop()
+        if path:
+            response.headers['X-Profile-File'] = os.path.basename(path)
+    return response
+
+
+def _admin_denied():
+    """404 while profiling is off (the endpoints do not exist), 403 for a wrong token."""
+    if not profiling.enabled():
+        return jsonify({"error": "Not found"}), 404
+    if not profiling.authorized(request.headers.get(profiling.TOKEN_HEADER)):
+        return jsonify({"error": "Forbidden"}), 403
+    return None
+
 
 # optional background worker
 _background_index = os.environ.get('BACKGROUND_INDEX', 'false').lower() in ('1', 'true', 'yes')
@@ -39,6 +92,9 @@ def _graceful_shutdown():
             _worker.stop()
     except Exception:
         pass
+    # persist the hot cache entries before embedding_utils.shutdown() clears the LRU
+    if warm_start.enabled():
+        warm_start.save(embedding_utils._cache, _query_cache)
     # try to free heavy resources
     try:
         embedding_utils.shutdown()
@@ -57,8 +113,40 @@ def _graceful_shutdown():
 # Register for process exit
 atexit.register(_graceful_shutdown)
 
+
+def warmup():
+    """Initialize the embedding model and backend clients ahead of the first request.
+
+    Nothing heavy happens at import time, so without this the first request on
+    each worker pays for model loading and client setup. Failures are reported
+    per component and never raise.
+    """
+    report = {}
+    for name, fn in (('embedding', embedding_utils.warmup),
+                     ('vector_store', vector_store.warmup),
+                     ('database', database.warmup),
+                     ('llm', model_utils.warmup)):
+        t0 = time.time()
+        try:
+            ok = fn()
+            report[name] = {'ok': bool(ok), 'seconds': round(time.time() - t0, 3)}
+        except Exception as e:
+            report[name] = {'ok': False, 'seconds': round(time.time() - t0, 3), 'error': str(e)}
+    logger.info(f"Warmup finished: {report}")
+    return report
+
+
+# Optionally warm up in the background so worker boot is not blocked
+if os.environ.get('WARMUP_ON_START', 'false').lower() in ('1', 'true', 'yes'):
+    Thread(target=warmup, daemon=True).start()
+
 # query cache
+# expired answers are kept this long to be served while a backend's breaker is open
+QUERY_CACHE_STALE_SECONDS = int(os.environ.get('QUERY_CACHE_STALE_SECONDS', '3600'))
 _query_cache = TTLCache(ttl_seconds=int(os.environ.get('QUERY_CACHE_TTL', '300')), max_items=int(os.environ.get('QUERY_CACHE_ITEMS', '1024')))
+# reload the hot cache entries saved by the previous process (see service/cache/warm_start.py)
+if warm_start.enabled():
+    warm_start.restore(embedding_utils._cache, _query_cache)
 
 def convert_ndarray_to_list(obj):
     if isinstance(obj, np.ndarray):
@@ -82,62 +170,79 @@ def parse_index_request(data):
     return {
         "repoId": data.get("repoId"),
         "files": [parse_repo_file(f) for f in data.get("files", [])],
-        "metadata": data.get("metadata", {})
+        "metadata": data.get("metadata", {}),
+        "fileFilter": data.get("fileFilter") or None
     }
 
 def parse_query_request(data):
+    # repoId may be a single id or a list; "repoIds" is accepted as an alias for the list form
     return {
-        "repoId": data.get("repoId"),
+        "repoId": data.get("repoIds") or data.get("repoId"),
         "prompt": data.get("prompt"),
         "top_k": data.get("top_k", 6),
-        "metadata": data.get("metadata", {})
+        "metadata": data.get("metadata", {}),
+        "filter": data.get("filter") or None,
+        "retrieval": data.get("retrieval") or None
     }
 
 
 @app.route('/rag/query', methods=['POST'])
 def rag_query():
     try:
-        # try to acquire semaphore quickly (avoid waiting indefinitely)
-        acquired = _semaphore.acquire(timeout=0.5)
-        if not acquired:
-            return jsonify({"error": "Too many concurrent requests"}), 429
         data = request.get_json(force=True)
         req = parse_query_request(data)
-        # Call async function from sync Flask
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
         try:
-            # check query cache
-            cache_key = hashlib.sha256((req["repoId"] + '||' + req["prompt"] + '||' + str(req["top_k"])).encode('utf-8')).hexdigest()
-            cached = _query_cache.get(cache_key)
-            if cached:
-                result = cached
-            else:
-                result = loop.run_until_complete(process_rag(req["repoId"], req["prompt"], req["top_k"], req["metadata"]))
+            vector_filter = build_filter(req["filter"])
+        except ValueError as e:
+            return jsonify({"error": f"invalid filter: {e}"}), 400
+        if req["retrieval"] and str(req["retrieval"]).lower() not in RETRIEVAL_MODES:
+            return jsonify({"error": f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}"}), 400
+        # check query cache before taking a slot: hits cost microseconds and never queue
+        filter_key = json.dumps(vector_filter, sort_keys=True) if vector_filter else ''
+        repo_key = ','.join(req["repoId"]) if isinstance(req["repoId"], list) else req["repoId"]
+        cache_key = hashlib.sha256((repo_key + '||' + req["prompt"] + '||' + str(req["top_k"]) + '||' + filter_key + '||' + str(req["retrieval"] or '')).encode('utf-8')).hexdigest()
+        cached = _query_cache.get(cache_key)
+        if cached:
+            metrics.incr('query_cache.hits')
+            return jsonify(convert_ndarray_to_list(cached))
+        try:
+            with _admission.admit('query'):
+                # Call async function from sync Flask
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
                 try:
-                    _query_cache.set(cache_key, result)
-                except Exception:
-                    pass
-            safe_result = convert_ndarray_to_list(result)
-            return jsonify(safe_result)
-        finally:
-            try:
-                _semaphore.release()
-            except Exception:
-                pass
-            loop.close()
+                    result = loop.run_until_complete(process_rag(req["repoId"], req["prompt"], req["top_k"], req["metadata"], filter=req["filter"], retrieval=req["retrieval"]))
+                finally:
+                    loop.close()
+        except AdmissionRejected as e:
+            return _rejected(e)
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            # a backend is down or too slow: an expired answer beats an error
+            stale = _query_cache.get_stale(cache_key, max_age=QUERY_CACHE_STALE_SECONDS)
+            if stale is not None:
+                metrics.incr('query_cache.stale_served')
+                return jsonify(convert_ndarray_to_list(stale)), 200, {"X-Cache": "stale"}
+            if isinstance(e, CircuitOpenError):
+                retry_after = str(max(1, int(e.retry_in)))
+                return jsonify({"error": str(e), "backend": e.name}), 503, {"Retry-After": retry_after}
+            return jsonify({"error": str(e)}), 504
+        except LLMError as e:
+            # the providers answered with errors (auth, rejected prompt): retrying or a stale answer won't help
+            return jsonify({"error": str(e)}), 502
+        try:
+            _query_cache.set(cache_key, result)
+        except Exception:
+            pass
+        safe_result = convert_ndarray_to_list(result)
+        return jsonify(safe_result)
     except Exception as e:
-        print("Error in /rag/query:", e, flush=True)
-        print(traceback.format_exc(), flush=True)
+        logger.error(f"Error in /rag/query: {e}\n{traceback.format_exc()}")
         return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
 
 
 @app.route('/rag/reset', methods=['POST'])
 def rag_reset():
     try:
-        acquired = _semaphore.acquire(timeout=0.5)
-        if not acquired:
-            return jsonify({"error": "Too many concurrent requests"}), 429
         data = request.get_json(force=True)
         req = parse_index_request(data)
         repo_id = req.get('repoId')
@@ -147,17 +252,17 @@ def rag_reset():
         if not repo_id:
             return jsonify({"error": "repoId required"}), 400
 
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
         try:
-            result = loop.run_until_complete(reset_repo(repo_id, files, metadata)) # type: ignore
-            return jsonify({"status": "reset", "repoId": repo_id, "result": result})
-        finally:
-            try:
-                _semaphore.release()
-            except Exception:
-                pass
-            loop.close()
+            with _admission.admit('reset'):
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                try:
+                    result = loop.run_until_complete(reset_repo(repo_id, files, metadata, file_filter=req["fileFilter"])) # type: ignore
+                finally:
+                    loop.close()
+        except AdmissionRejected as e:
+            return _rejected(e)
+        return jsonify({"status": "reset", "repoId": repo_id, "result": result})
     except Exception as e:
         tb = traceback.format_exc()
         return jsonify({"error": str(e), "traceback": tb}), 500
@@ -184,19 +289,143 @@ def delete_repo_vectors():
         print(traceback.format_exc(), flush=True)
         return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
 
+# Snapshot a namespace into a single compact file (see service/db/snapshot.py)
+@app.route('/rag/export', methods=['GET'])
+def export_repo():
+    try:
+        repo_id = request.args.get('repoId')
+        if not repo_id:
+            return jsonify({"error": "repoId required"}), 400
+        from service.db.snapshot import export_namespace
+        try:
+            with _admission.admit('index'):
+                fd, path = tempfile.mkstemp(suffix='.ragsnap')
+                os.close(fd)
+                try:
+                    header = export_namespace(repo_id, path, backend=vector_store.get_backend(request.args.get('backend')))
+                except Exception:
+                    os.remove(path)
+                    raise
+        except AdmissionRejected as e:
+            return _rejected(e)
+
+        @after_this_request
+        def _cleanup(response):
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+            return response
+
+        resp = send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=f"{repo_id}.ragsnap")
+        resp.headers['X-Snapshot-Count'] = str(header['count'])
+        resp.headers['X-Snapshot-Dim'] = str(header['dim'])
+        return resp
+    except Exception as e:
+        tb = traceback.format_exc()
+        logger.error(f"Error in /rag/export: {e}\n{tb}")
+        return jsonify({"error": str(e), "traceback": tb}), 500
+
+
+# Bulk-load a snapshot (raw body or multipart field "file") into a namespace
+@app.route('/rag/import', methods=['POST'])
+def import_repo():
+    path = None
+    try:
+        from service.db.snapshot import import_snapshot
+        with _admission.admit('index'):
+            fd, path = tempfile.mkstemp(suffix='.ragsnap')
+            with os.fdopen(fd, 'wb') as f:
+                upload = request.files.get('file')
+                if upload is not None:
+                    upload.save(f)
+                else:
+                    # stream the raw body to disk instead of holding it in memory
+                    while True:
+                        block = request.stream.read(1 << 20)
+                        if not block:
+                            break
+                        f.write(block)
+            backend = vector_store.get_backend(request.args.get('backend'))
+            result = import_snapshot(path, namespace=request.args.get('repoId') or None, backend=backend)
+        return jsonify({"status": "imported", "result": result})
+    except AdmissionRejected as e:
+        return _rejected(e)
+    except Exception as e:
+        tb = traceback.format_exc()
+        logger.error(f"Error in /rag/import: {e}\n{tb}")
+        return jsonify({"error": str(e), "traceback": tb}), 500
+    finally:
+        if path:
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+
+
+# Embeddings for other services: JSON, or raw little-endian float32 rows with an X-Shape header
+EMBED_MAX_TEXTS = int(os.environ.get('EMBED_MAX_TEXTS', '512'))
+
+
+@app.route('/rag/embed', methods=['POST'])
+def embed_call():
+    try:
+        data = request.get_json(force=True)
+        texts = data.get("texts")
+        if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+            return jsonify({"error": "texts must be a list of strings"}), 400
+        if len(texts) > EMBED_MAX_TEXTS:
+            return jsonify({"error": f"at most {EMBED_MAX_TEXTS} texts per request"}), 413
+        fmt = (data.get("format") or '').lower()
+        if not fmt:
+            fmt = 'f32' if 'application/octet-stream' in request.headers.get('Accept', '') else 'json'
+        if fmt not in ('json', 'f32'):
+            return jsonify({"error": "format must be 'json' or 'f32'"}), 400
+        try:
+            with _admission.admit('query'):
+                embs = embedding_utils.embed_texts(texts)
+        except AdmissionRejected as e:
+            return _rejected(e)
+        count, dim = (embs.shape if embs.size else (len(texts), 0))
+        if fmt == 'f32':
+            body = np.ascontiguousarray(embs, dtype='<f4').tobytes()
+            return body, 200, {"Content-Type": "application/octet-stream", "X-Shape": f"{count},{dim}",
+                               "X-Dtype": "float32-le", "X-Model": embedding_utils.embedding_version()}
+        return jsonify({"embeddings": embs.tolist(), "count": count, "dim": dim, "model": embedding_utils.embedding_version()})
+    except Exception as e:
+        tb = traceback.format_exc()
+        logger.error(f"Error in /rag/embed: {e}\n{tb}")
+        return jsonify({"error": str(e), "traceback": tb}), 500
+
+
 @app.route('/rag/health', methods=['GET'])
 def health():
-    return jsonify({"status": "ok"})
+    # 'degraded' while any backend circuit breaker is open or probing; the service still answers
+    breakers = breaker_states()
+    degraded = any(b['state'] != 'closed' for b in breakers.values())
+    return jsonify({"status": "degraded" if degraded else "ok", "breakers": breakers})
+
+
+@app.route('/rag/metrics', methods=['GET'])
+def metrics_call():
+    snap = metrics.snapshot()
+    snap['admission'] = _admission.stats()
+    mirror = vector_store.mirror_stats()
+    if mirror is not None:
+        snap['mirror'] = mirror
+    return jsonify(snap)
+
+
+@app.route('/rag/warmup', methods=['POST'])
+def warmup_call():
+    return jsonify({"status": "ok", "warmup": warmup()})
 
 
 @app.route('/rag/index', methods=['POST'])
 def index_repo_call():
     try:
-        acquired = _semaphore.acquire(timeout=0.5)
-        if not acquired:
-            return jsonify({"error": "Too many concurrent requests"}), 429
         data = request.get_json(force=True)
-        print(f"Received data for /rag/index: {data}", flush=True)
         req = parse_index_request(data)
         repo_id = req["repoId"]
         files = req["files"]
@@ -205,36 +434,122 @@ def index_repo_call():
         if not repo_id or not files or not isinstance(files, list):
             raise ValueError("Missing or invalid repoId/files in request.")
 
-        # If background indexing is enabled, enqueue and return job id
+        # If background indexing is enabled, enqueue and return job id (the worker has its own limits)
         if _worker:
-            try:
-                job_id = _worker.submit(repo_id, files, metadata)
-                return jsonify({"success": True, "job_id": job_id, "background": True})
-            finally:
-                try:
-                    _semaphore.release()
-                except Exception:
-                    pass
+            job_id = _worker.submit(repo_id, files, metadata, file_filter=req["fileFilter"])
+            return jsonify({"success": True, "job_id": job_id, "background": True})
 
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
         try:
-            result = loop.run_until_complete(index_repo(repo_id, files, metadata)) 
-            print(f"Indexing result for repoId {repo_id}: {result}", flush=True)
-            return jsonify({"success": True, "result": result})
-        finally:
-            try:
-                _semaphore.release()
-            except Exception:
-                pass
-            loop.close()
+            with _admission.admit('index'):
+                # wait for memory headroom instead of risking an OOM kill mid-index
+                if not get_governor().wait_for_headroom(timeout=float(os.environ.get('INDEX_MEMORY_WAIT', '30'))):
+                    return jsonify({"error": "Server is low on memory, retry later"}), 503, {"Retry-After": "30"}
+
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                try:
+                    result = loop.run_until_complete(index_repo(repo_id, files, metadata, file_filter=req["fileFilter"]))
+                finally:
+                    loop.close()
+        except AdmissionRejected as e:
+            return _rejected(e)
+        # index_repo logs its own summary line; the request body (file contents) is never logged
+        log_event(logger, 'rag.index', repo_id=repo_id, files=len(files),
+                  bytes=sum(len(f.get('content') or '') for f in files), result=result)
+        return jsonify({"success": True, "result": result})
     except Exception as e:
         tb = traceback.format_exc()
-        print(f"Error in /rag/index: {e}\n{tb}", flush=True)
+        logger.error(f"Error in /rag/index: {e}\n{tb}")
         return jsonify({"error": str(e), "traceback": tb}), 500
 
 
 
+def _job_view(job_id: str):
+    if _worker is not None:
+        return _worker.get_status(job_id)
+    # jobs run by another process (BACKGROUND_INDEX off here) are still visible in the job store
+    record = get_job_store().get(job_id)
+    if record is None:
+        return None
+    return {k: record.get(k) for k in ('status', 'repo_id', 'result', 'error', 'created_at', 'total_files',
+                                       'files_done')}
+
+
+@app.route('/rag/jobs', methods=['GET'])
+def jobs_list_call():
+    repo_id = request.args.get('repoId')
+    if not repo_id:
+        return jsonify({"error": "Missing repoId"}), 400
+    try:
+        jobs = get_job_store().recent(repo_id, int(request.args.get('limit', '20')))
+    except Exception as e:
+        logger.error(f"Error listing jobs of {repo_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"repoId": repo_id, "jobs": jobs})
+
+
+@app.route('/rag/jobs/<job_id>', methods=['GET'])
+def job_status_call(job_id):
+    status = _job_view(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify({"job_id": job_id, **status})
+
+
+@app.route('/rag/jobs/<job_id>', methods=['DELETE'])
+def job_cancel_call(job_id):
+    status = _job_view(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if status['status'] in FINISHED:
+        return jsonify({"error": f"Job already {status['status']}", "job_id": job_id, **status}), 409
+    if _worker is not None:
+        status = _worker.cancel(job_id)
+    else:
+        # the owning worker sees the flag at its next checkpoint
+        get_job_store().update(job_id, cancel_requested=True)
+        status = {**status, 'status': 'cancelling'}
+    return jsonify({"job_id": job_id, **status}), 202
+
+
+@app.route('/rag/admin/profile', methods=['POST'])
+def profile_call():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    try:
+        result = profiling.sample(float(request.args.get('seconds', '10')),
+                                  interval=float(request.args.get('interval_ms', '5')) / 1000.0,
+                                  idle=request.args.get('idle', 'false').lower() in ('1', 'true', 'yes'))
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    if request.args.get('format') == 'json':
+        return jsonify(result)
+    return result['collapsed'] + '\n', 200, {'Content-Type': 'text/plain; charset=utf-8',
+                                             'X-Profile-File': os.path.basename(result['path'])}
+
+
+@app.route('/rag/admin/profile/<name>', methods=['GET'])
+def profile_file_call(name):
+    denied = _admin_denied()
+    if denied:
+        return denied
+    path = os.path.join(profiling.profile_dir(), os.path.basename(name))
+    if not os.path.isfile(path):
+        return jsonify({"error": "Unknown profile"}), 404
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+
+
+@app.route('/rag/admin/tracemalloc', methods=['GET', 'DELETE'])
+def tracemalloc_call():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if request.method == 'DELETE':
+        return jsonify({"stopped": profiling.tracemalloc_stop()})
+    return jsonify(profiling.tracemalloc_diff(int(request.args.get('top', '20'))))
+
+
 @app.route('/')
 def home():
     return "Hello, PRODO RAG on Vercel!"
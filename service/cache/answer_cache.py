@@ -0,0 +1,202 @@
+"""Persistent cache of LLM answers keyed on the retrieved context.
+
+The key is a fingerprint of everything that goes into the prompt: the
+template, the model, the question and the id + content hash of every
+retrieved chunk. Identical context and question hit the cache across
+restarts and workers; a changed chunk changes the key, so the entry is
+never served stale. Results without text (vectors indexed before chunk text
+was stored) cannot be fingerprinted, so such answers are not cached.
+
+Backends (ANSWER_CACHE): `disk` (default, one JSON file per entry under
+ANSWER_CACHE_PATH), `mongo` (a capped collection) or `off`. Both are bounded
+by ANSWER_CACHE_MAX_BYTES and evict the oldest entries first; entries older
+than ANSWER_CACHE_TTL seconds (default a week, 0 = never) are not served.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, Optional
+
+from service.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# v2: entries carry their write time; v1 entries may be keyed on ids alone
+ANSWER_CACHE_VERSION = 'v2'
+ANSWER_CACHE_TTL = float(os.environ.get('ANSWER_CACHE_TTL', str(7 * 24 * 3600)))
+
+
+def _expired(stored_at, ttl: float) -> bool:
+    return ttl > 0 and (not isinstance(stored_at, (int, float)) or time.time() - stored_at > ttl)
+
+
+def answer_key(question: str, results: Iterable[Dict[str, Any]], model: str = '',
+               template: str = '') -> Optional[str]:
+    """Fingerprint a prompt from its question and retrieved chunk ids/content hashes.
+
+    Returns None when a result has no text: its id alone does not change when the code does.
+    """
+    h = hashlib.sha256()
+    h.update(f'{ANSWER_CACHE_VERSION}\0{model}\0{template}\0{question}\0'.encode('utf-8'))
+    for r in results:
+        text = r.get('text')
+        if not text:
+            return None
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        h.update(f"{r.get('id')}\0{text_hash}\0".encode('utf-8'))
+    return h.hexdigest()
+
+
+class DiskAnswerCache:
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, ttl=ANSWER_CACHE_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self._bytes = self._scan_size()
+
+    def _path_for_key(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def _entries(self):
+        out = []
+        with os.scandir(self.path) as it:
+            for e in it:
+                if e.name.endswith('.json'):
+                    try:
+                        st = e.stat()
+                        out.append((st.st_mtime, st.st_size, e.path))
+                    except OSError:
+                        pass
+        return out
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def get(self, key):
+        p = self._path_for_key(key)
+        try:
+            with open(p, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            value = entry['value']
+        except Exception:
+            return None
+        if _expired(entry.get('ts'), self.ttl):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+            return None
+        try:
+            # bump mtime so eviction drops least recently used entries first
+            os.utime(p)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        p = self._path_for_key(key)
+        # write to a temp file and rename so concurrent workers never read partial entries
+        tmp = f"{p}.{uuid.uuid4().hex}.tmp"
+        try:
+            data = json.dumps({'ts': time.time(), 'value': value}).encode('utf-8')
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, p)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        with self.lock:
+            self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # other workers write to the same directory, so re-scan instead of trusting the counter
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._bytes = total
+
+
+class MongoAnswerCache:
+    """Answer cache in a capped collection; MongoDB evicts the oldest documents."""
+
+    COLLECTION = 'answer_cache'
+
+    def __init__(self, db, max_bytes=64 * 1024 * 1024, ttl=ANSWER_CACHE_TTL):
+        self.ttl = ttl
+        if self.COLLECTION not in db.list_collection_names():
+            try:
+                db.create_collection(self.COLLECTION, capped=True, size=max_bytes)
+            except Exception:
+                # another worker created it first
+                pass
+        self.coll = db[self.COLLECTION]
+
+    def get(self, key):
+        try:
+            doc = self.coll.find_one({'_id': key}, {'value': 1, 'ts': 1})
+        except Exception:
+            return None
+        # capped collections cannot have a TTL index; expired documents age out with the cap
+        if not doc or _expired(doc.get('ts'), self.ttl):
+            return None
+        return doc.get('value')
+
+    def set(self, key, value):
+        try:
+            self.coll.insert_one({'_id': key, 'ts': time.time(), 'value': value})
+        except Exception:
+            # duplicate key (another worker cached it) or Mongo unavailable
+            pass
+
+
+_answer_cache = None
+_answer_cache_ready = False
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[Any]:
+    """Return the configured answer cache, or None when ANSWER_CACHE=off."""
+    global _answer_cache, _answer_cache_ready
+    if _answer_cache_ready:
+        return _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache_ready:
+            return _answer_cache
+        backend = os.environ.get('ANSWER_CACHE', 'disk').lower()
+        max_bytes = int(os.environ.get('ANSWER_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+        try:
+            if backend == 'mongo':
+                from service.db.database import get_db
+                db = get_db()
+                if db is not None:
+                    _answer_cache = MongoAnswerCache(db, max_bytes=max_bytes)
+                else:
+                    logger.warning('ANSWER_CACHE=mongo but MongoDB is not configured; using disk cache')
+                    backend = 'disk'
+            if backend == 'disk':
+                path = os.environ.get('ANSWER_CACHE_PATH', os.path.join(os.getcwd(), 'data', 'answer_cache'))
+                _answer_cache = DiskAnswerCache(path, max_bytes=max_bytes)
+        except Exception as e:
+            logger.warning(f'Answer cache disabled: {e}')
+            _answer_cache = None
+        _answer_cache_ready = True
+    return _answer_cache
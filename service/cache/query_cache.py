@@ -7,6 +7,7 @@ class TTLCache:
         self.max_items = max_items
         self.lock = threading.Lock()
         self.store = {}  # key -> (value, expires_at)
+        self.stats = {'hits': 0, 'misses': 0}
 
     def _evict_if_needed(self):
         if len(self.store) <= self.max_items:
@@ -21,14 +22,33 @@ class TTLCache:
         with self.lock:
             entry = self.store.get(key)
             if not entry:
+                self.stats['misses'] += 1
                 return None
             value, expires_at = entry
             if time.time() > expires_at:
-                del self.store[key]
+                # expired entries stay (until evicted) so get_stale() can serve them during outages
+                self.stats['misses'] += 1
                 return None
+            self.stats['hits'] += 1
             return value
 
-    def set(self, key, value):
+    def set(self, key, value, expires_at=None):
+        """Store `value`; `expires_at` (epoch seconds) overrides the TTL, e.g. when restoring entries."""
         with self.lock:
-            self.store[key] = (value, time.time() + self.ttl)
+            self.store[key] = (value, expires_at if expires_at is not None else time.time() + self.ttl)
             self._evict_if_needed()
+
+    def get_stale(self, key, max_age=3600):
+        """Return the value even if expired, as long as it expired less than `max_age` seconds ago."""
+        with self.lock:
+            entry = self.store.get(key)
+        if not entry or time.time() > entry[1] + max_age:
+            return None
+        return entry[0]
+
+    def items_recent(self):
+        """Unexpired (key, value, expires_at), most recently set first."""
+        now = time.time()
+        with self.lock:
+            items = [(k, v, exp) for k, (v, exp) in self.store.items() if exp > now]
+        return sorted(items, key=lambda kv: kv[2], reverse=True)
@@ -0,0 +1,183 @@
+"""Warm start for the in-memory caches.
+
+At shutdown the hot working set of the embedding LRU (most recently used
+keys and their vectors) and of the query cache (unexpired answers) is
+written to WARM_START_PATH; at startup every worker loads it back, so the
+first requests after a deploy or worker recycle are not all cold.
+
+Files, each capped at WARM_START_MAX_BYTES (most recent entries first):
+
+    embeddings.npz   sha256 keys as raw bytes (n x 32) + float32 matrix (n x dim)
+    queries.json     [key, expires_at, answer] rows
+
+Writes go to a per-process temporary file and are renamed into place, so
+concurrent workers never see a torn file (the last one to exit wins).
+About WARM_START_REPORT_SECONDS after a restore, the hit rates of both
+caches since startup are logged.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from service.utils import metrics
+from service.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+FORMAT_VERSION = 1
+EMBEDDINGS_FILE = 'embeddings.npz'
+QUERIES_FILE = 'queries.json'
+
+
+def enabled() -> bool:
+    return os.getenv('WARM_START', 'on').lower() not in ('0', 'off', 'false', 'no')
+
+
+def _dir() -> str:
+    return os.getenv('WARM_START_PATH', os.path.join(os.getcwd(), 'data', 'warm_start'))
+
+
+def _max_bytes() -> int:
+    return int(os.getenv('WARM_START_MAX_BYTES', str(64 * 1024 * 1024)))
+
+
+def _atomic_target(path: str) -> str:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    return f'{path}.{os.getpid()}.tmp'
+
+
+def save_embeddings(cache, path: str, max_bytes: int) -> int:
+    """Write the most recently used embeddings of `cache` (an EmbeddingCache); returns the row count."""
+    rows, keys, dim = [], [], None
+    for key, value in cache.mem.items_recent():
+        vec = np.asarray(value, dtype='float32').ravel()
+        if dim is None:
+            dim = vec.shape[0]
+            limit = max(0, max_bytes // (32 + 4 * dim))
+        if vec.shape[0] != dim or len(key) != 64:
+            continue
+        if len(rows) >= limit:
+            break
+        keys.append(bytes.fromhex(key))
+        rows.append(vec)
+    if not rows:
+        return 0
+    tmp = _atomic_target(path)
+    with open(tmp, 'wb') as f:
+        np.savez(f, version=np.array(FORMAT_VERSION), namespace=np.array(cache.namespace),
+                 keys=np.frombuffer(b''.join(keys), dtype=np.uint8).reshape(len(keys), 32),
+                 embeddings=np.stack(rows))
+    os.replace(tmp, path)
+    return len(rows)
+
+
+def load_embeddings(cache, path: str, max_bytes: int) -> int:
+    """Load saved embeddings into `cache.mem`, oldest first so recency is preserved; returns the count."""
+    if not os.path.exists(path):
+        return 0
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['version']) != FORMAT_VERSION or str(data['namespace']) != cache.namespace:
+            logger.info(f"warm start: {path} was written for another model, ignoring it")
+            return 0
+        keys, embs = data['keys'], data['embeddings']
+    n = min(len(keys), max_bytes // max(1, 32 + embs.itemsize * embs.shape[1]), cache.mem.max_size)
+    for i in range(n - 1, -1, -1):
+        cache.mem.set(keys[i].tobytes().hex(), embs[i].tolist())
+    return n
+
+
+def save_queries(cache, path: str, max_bytes: int) -> int:
+    """Write unexpired query-cache answers (a TTLCache), newest first; returns the entry count."""
+    rows, size = [], 2
+    for key, value, expires_at in cache.items_recent():
+        try:
+            row = json.dumps([key, expires_at, value])
+        except (TypeError, ValueError):
+            continue
+        if size + len(row) + 1 > max_bytes:
+            break
+        rows.append(row)
+        size += len(row) + 1
+    if not rows:
+        return 0
+    tmp = _atomic_target(path)
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write('{"version": %d, "entries": [' % FORMAT_VERSION + ','.join(rows) + ']}')
+    os.replace(tmp, path)
+    return len(rows)
+
+
+def load_queries(cache, path: str, max_bytes: int) -> int:
+    if not os.path.exists(path) or os.path.getsize(path) > max_bytes * 2:
+        return 0
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != FORMAT_VERSION:
+        return 0
+    now, loaded = time.time(), 0
+    for key, expires_at, value in reversed(data.get('entries', [])[:cache.max_items]):
+        if expires_at > now:
+            cache.set(key, value, expires_at=expires_at)
+            loaded += 1
+    return loaded
+
+
+def save(embedding_cache=None, query_cache=None, directory: Optional[str] = None):
+    """Persist both caches; never raises (called from shutdown hooks)."""
+    directory = directory or _dir()
+    report = {}
+    for name, cache, fn, filename in (('embeddings', embedding_cache, save_embeddings, EMBEDDINGS_FILE),
+                                      ('queries', query_cache, save_queries, QUERIES_FILE)):
+        if cache is None:
+            continue
+        try:
+            report[name] = fn(cache, os.path.join(directory, filename), _max_bytes())
+        except Exception as e:
+            logger.warning(f"warm start: could not save {name}: {e}")
+    logger.info(f"warm start: saved {report} to {directory}")
+    return report
+
+
+def restore(embedding_cache=None, query_cache=None, directory: Optional[str] = None):
+    """Load both caches and schedule a hit-rate report; never raises."""
+    directory = directory or _dir()
+    t0 = time.time()
+    report = {}
+    for name, cache, fn, filename in (('embeddings', embedding_cache, load_embeddings, EMBEDDINGS_FILE),
+                                      ('queries', query_cache, load_queries, QUERIES_FILE)):
+        if cache is None:
+            continue
+        try:
+            report[name] = fn(cache, os.path.join(directory, filename), _max_bytes())
+            metrics.set_gauge('warm_start.loaded', report[name], cache=name)
+        except Exception as e:
+            logger.warning(f"warm start: could not load {name}: {e}")
+    logger.info(f"warm start: loaded {report} from {directory} in {time.time() - t0:.2f}s")
+    delay = float(os.getenv('WARM_START_REPORT_SECONDS', '300'))
+    if delay > 0 and any(report.values()):
+        timer = threading.Timer(delay, log_hit_rates, args=(embedding_cache, query_cache))
+        timer.daemon = True
+        timer.start()
+    return report
+
+
+def hit_rates(embedding_cache=None, query_cache=None):
+    rates = {}
+    if embedding_cache is not None:
+        s = dict(embedding_cache.stats)
+        total = s['memory_hits'] + s['disk_hits'] + s['misses']
+        rates['embeddings'] = {'lookups': total, 'memory_hit_rate': s['memory_hits'] / total if total else None}
+    if query_cache is not None:
+        s = dict(query_cache.stats)
+        total = s['hits'] + s['misses']
+        rates['queries'] = {'lookups': total, 'hit_rate': s['hits'] / total if total else None}
+    return rates
+
+
+def log_hit_rates(embedding_cache=None, query_cache=None):
+    logger.info(f"warm start: cache hit rates since restart {hit_rates(embedding_cache, query_cache)}")
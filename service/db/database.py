@@ -1,62 +1,406 @@
+"""MongoDB access for the `ragsvc` database.
+
+Collections: `indexes` (per-repo index metadata), `query_logs` (one compact
+document per query), `index_jobs` / `index_job_files` (background index jobs,
+see service/worker/jobs.py) and `answer_cache` (service/cache/answer_cache.py).
+
+Indexes are created once per process on first use (`ensure_indexes`).
+`query_logs` expire after QUERY_LOG_TTL_DAYS (default 30; 0 keeps them), or,
+with QUERY_LOG_CAPPED_MB set, live in a capped collection of that size.
+Query logs keep counts and sizes of the answer, not the answer itself,
+unless QUERY_LOG_RESULTS is true.
+"""
+
 import os
-from pymongo import MongoClient
+import threading
+import time
+from datetime import datetime, timezone
+
+from service.utils.log import get_logger
+from service.utils.resilience import retry
+
+logger = get_logger(__name__)
 
+# pymongo is imported lazily inside get_db() so importing this module stays cheap.
 MONGODB_URI = os.getenv('MONGODB_URI')
+QUERY_LOG_TTL_DAYS = float(os.getenv('QUERY_LOG_TTL_DAYS', '30'))
+QUERY_LOG_CAPPED_MB = int(os.getenv('QUERY_LOG_CAPPED_MB', '0'))
+QUERY_LOG_RESULTS = os.getenv('QUERY_LOG_RESULTS', 'false').lower() in ('1', 'true', 'yes')
+QUERY_LOG_PROMPT_CHARS = int(os.getenv('QUERY_LOG_PROMPT_CHARS', '500'))
+# progress checkpoints of index jobs are coalesced and written in one bulk_write this often
+JOB_UPDATE_FLUSH_SECONDS = float(os.getenv('JOB_UPDATE_FLUSH_SECONDS', '2'))
+# retry index creation after a failure (e.g. Mongo down at startup) at most this often
+_ENSURE_RETRY_SECONDS = 60.0
+
 _client = None
 _db = None
-if MONGODB_URI:
+_init_attempted = False
+_init_lock = threading.Lock()
+_indexes_ensured = False
+_indexes_next_try = 0.0
+_indexes_lock = threading.Lock()
+
+
+def get_db():
+    """Return the `ragsvc` database handle, creating the client on first use.
+
+    Returns None when MONGODB_URI is unset or the client failed to initialize.
+    """
+    global _client, _db, _init_attempted
+    if _db is not None or _init_attempted:
+        return _db
+    with _init_lock:
+        if _init_attempted:
+            return _db
+        _init_attempted = True
+        uri = os.getenv('MONGODB_URI') or MONGODB_URI
+        if not uri:
+            return None
+        try:
+            from pymongo import MongoClient
+            _client = MongoClient(uri)
+            _db = _client.get_database('ragsvc')
+        except Exception:
+            _client = None
+            _db = None
+    if _db is not None and not _indexes_ensured:
+        ensure_indexes(_db)
+    return _db
+
+
+# (collection, keys, options); names are fixed so every worker creates the same index
+_INDEXES = [
+    ('indexes', [('repoId', 1)], {'name': 'repoId_unique', 'unique': True}),
+    ('query_logs', [('repoId', 1), ('ts', -1)], {'name': 'repoId_ts'}),
+    # multikey: finds multi-repo queries under every repo they covered
+    ('query_logs', [('repoIds', 1), ('ts', -1)], {'name': 'repoIds_ts'}),
+    ('index_jobs', [('job_id', 1)], {'name': 'job_id_unique', 'unique': True}),
+    ('index_jobs', [('status', 1), ('heartbeat', 1)], {'name': 'status_heartbeat'}),
+    ('index_jobs', [('repo_id', 1), ('created_at', -1)], {'name': 'repo_id_created_at'}),
+    ('index_job_files', [('job_id', 1), ('i', 1)], {'name': 'job_id_i'}),
+]
+
+
+def ensure_indexes(db=None) -> bool:
+    """Create the indexes (and the query log TTL or capped collection) once per process.
+
+    `create_index` is a no-op for an index that already exists, so every worker may run
+    this. A failure is logged and retried on a later call, at most once a minute.
+    """
+    global _indexes_ensured, _indexes_next_try
+    if _indexes_ensured or time.monotonic() < _indexes_next_try:
+        return _indexes_ensured
+    with _indexes_lock:
+        if _indexes_ensured:
+            return True
+        db = db if db is not None else _db
+        if db is None:
+            return False
+        try:
+            indexes = list(_INDEXES)
+            if QUERY_LOG_CAPPED_MB > 0:
+                _ensure_capped(db, 'query_logs', QUERY_LOG_CAPPED_MB * 1024 * 1024)
+            elif QUERY_LOG_TTL_DAYS > 0:
+                indexes.append(('query_logs', [('ts', 1)],
+                                {'name': 'ts_ttl', 'expireAfterSeconds': int(QUERY_LOG_TTL_DAYS * 86400)}))
+            from pymongo.errors import OperationFailure
+            for collection, keys, options in indexes:
+                try:
+                    db[collection].create_index(keys, **options)
+                except OperationFailure as e:
+                    # the server refused this one index (duplicates left from before a unique
+                    # index, a changed TTL); the others are still worth creating
+                    logger.warning(f"Could not create index {options['name']} on {collection}: {e}")
+            _indexes_ensured = True
+        except Exception as e:
+            _indexes_next_try = time.monotonic() + _ENSURE_RETRY_SECONDS
+            logger.warning(f"Could not ensure MongoDB indexes, retrying later: {e}")
+    return _indexes_ensured
+
+
+def _ensure_capped(db, name: str, size: int):
+    if name not in db.list_collection_names():
+        try:
+            db.create_collection(name, capped=True, size=size)
+        except Exception:
+            # another worker created it first
+            pass
+    elif not db[name].options().get('capped'):
+        logger.warning(f"{name} exists and is not capped; convert it with the convertToCapped command")
+
+
+def warmup():
+    """Create the client and round-trip a ping so the first request does not pay for it."""
+    db = get_db()
+    if db is None:
+        return False
+    db.command('ping')
+    return True
+
+
+def _mongo_transient(e: BaseException) -> bool:
+    """Whether a failed Mongo operation is worth retrying: network errors and server selection timeouts.
+
+    DuplicateKeyError, OperationFailure and the like fail the same way on every attempt.
+    """
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
     try:
-        _client = MongoClient(MONGODB_URI)
-        _db = _client.get_database('ragsvc')
-    except Exception:
-        _client = None
-        _db = None
+        from pymongo.errors import ConnectionFailure
+    except ImportError:
+        return False
+    # AutoReconnect, NetworkTimeout and ServerSelectionTimeoutError are ConnectionFailures
+    return isinstance(e, ConnectionFailure)
+
+
+@retry((Exception,), tries=2, delay=0.2, backoff=2.0, max_delay=1.0, breaker='mongo', transient=_mongo_transient)
+def _mongo(fn, *args, **kwargs):
+    """Run one collection operation behind the 'mongo' circuit breaker, retrying transient errors."""
+    return fn(*args, **kwargs)
+
+
+def _duplicate_id(details: dict) -> bool:
+    return (details or {}).get('keyPattern') == {'_id': 1} or ' _id_ ' in (details or {}).get('errmsg', '')
+
+
+def _insert(insert, docs, **kwargs):
+    """Run `insert_one`/`insert_many` through `_mongo` so that a retry cannot write twice.
+
+    Every document gets its `_id` before the first attempt. If an attempt commits and then
+    times out, the retry hits a duplicate `_id`, and that counts as success. A duplicate on
+    any other unique index is still raised.
+    """
+    from bson import ObjectId
+    from pymongo.errors import BulkWriteError, DuplicateKeyError
+    for doc in (docs if isinstance(docs, list) else [docs]):
+        doc.setdefault('_id', ObjectId())
+    try:
+        _mongo(insert, docs, **kwargs)
+    except DuplicateKeyError as e:
+        if not _duplicate_id(e.details):
+            raise
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if not errors or not all(err.get('code') == 11000 and _duplicate_id(err) for err in errors):
+            raise
+
 
 def save_index_metadata(repo_id: str, data: dict):
-    if _db is None:
+    db = get_db()
+    if db is None:
         raise RuntimeError("MongoDB is not configured or failed to initialize.")
-    _db.indexes.update_one({'repoId': repo_id}, {'$set': {'repoId': repo_id, 'data': data}}, upsert=True)
+    _mongo(db.indexes.update_one, {'repoId': repo_id}, {'$set': {'repoId': repo_id, 'data': data}}, upsert=True)
+
+def save_query_log(repo_id: str | list, log: dict):
+    """Insert one query log document: `repoId`, a `ts` date (for the TTL index) and the fields of `log`.
+
+    `repo_id` may be a list (a multi-repo query): `repoId` is then the first id and `repoIds`
+    holds all of them; single-repo logs get `repoIds: [repoId]` too, so one lookup covers both.
 
-def save_query_log(repo_id: str, log: dict):
-    if _db is None:
+    The prompt is truncated to QUERY_LOG_PROMPT_CHARS and `result` is dropped unless QUERY_LOG_RESULTS.
+    """
+    db = get_db()
+    if db is None:
         raise RuntimeError("MongoDB is not configured or failed to initialize.")
-    _db.query_logs.insert_one({'repoId': repo_id, 'log': log})
+    repo_ids = [repo_id] if isinstance(repo_id, str) else list(repo_id)
+    doc = {'repoId': repo_ids[0] if repo_ids else None, 'repoIds': repo_ids, 'ts': datetime.now(timezone.utc), **log}
+    if not QUERY_LOG_RESULTS:
+        doc.pop('result', None)
+    if isinstance(doc.get('prompt'), str) and len(doc['prompt']) > QUERY_LOG_PROMPT_CHARS:
+        doc['prompt'] = doc['prompt'][:QUERY_LOG_PROMPT_CHARS]
+    _insert(db.query_logs.insert_one, doc)
+
+
+def get_index_metadata(repo_id: str):
+    """The `data` saved by `save_index_metadata` for a repo, or None."""
+    doc = _mongo(_require_db().indexes.find_one, {'repoId': repo_id}, {'_id': 0, 'data': 1})
+    return doc.get('data') if doc else None
 
 
 def save_index_job(job_id: str, repo_id: str, meta: dict):
-    if _db is None:
-        return  # Skip operation if DB is not initialized
     """Persist an index job record. Non-fatal on errors."""
+    db = get_db()
+    if db is None:
+        return  # Skip operation if DB is not initialized
     try:
-        _db.index_jobs.update_one({'job_id': job_id}, {'$set': {'job_id': job_id, 'repo_id': repo_id, 'meta': meta, 'status': 'queued'}}, upsert=True)
+        _mongo(db.index_jobs.update_one, {'job_id': job_id}, {'$set': {'job_id': job_id, 'repo_id': repo_id, 'meta': meta, 'status': 'queued'}}, upsert=True)
     except Exception:
         pass
 
 
 def update_index_job_result(job_id: str, result: dict):
-    if _db is None:
+    db = get_db()
+    if db is None:
         return  # Skip operation if DB is not initialized
     try:
-        _db.index_jobs.update_one({'job_id': job_id}, {'$set': {'status': 'completed', 'result': result}})
+        _mongo(db.index_jobs.update_one, {'job_id': job_id}, {'$set': {'status': 'completed', 'result': result}})
     except Exception:
         pass
 
 
 def update_index_job_error(job_id: str, error: str):
-    if _db is None:
+    db = get_db()
+    if db is None:
         return  # Skip operation if DB is not initialized
     try:
-        _db.index_jobs.update_one({'job_id': job_id}, {'$set': {'status': 'failed', 'error': error}})
+        _mongo(db.index_jobs.update_one, {'job_id': job_id}, {'$set': {'status': 'failed', 'error': error}})
     except Exception:
         pass
 
 
+def _require_db():
+    db = get_db()
+    if db is None:
+        raise RuntimeError("MongoDB is not configured or failed to initialize.")
+    return db
+
+
+# job_id -> fields of deferred updates not yet written, merged per job
+_job_updates = {}
+_job_updates_since = 0.0
+_job_updates_timer = None
+_job_updates_lock = threading.Lock()
+
+# what job listings return; results, metadata and leases are left on the server
+JOB_SUMMARY_FIELDS = {'_id': 0, 'job_id': 1, 'repo_id': 1, 'status': 1, 'created_at': 1, 'updated_at': 1,
+                      'finished_at': 1, 'files_done': 1, 'total_files': 1, 'error': 1}
+
+
+def create_index_job(record: dict):
+    _insert(_require_db().index_jobs.insert_one, dict(record))
+
+
+def update_index_job(job_id: str, fields: dict, defer: bool = False):
+    """Set `fields` on an index job record (status, progress checkpoint, lease).
+
+    With `defer=True` the update is merged with other pending updates and written with
+    them in one `bulk_write`, by a timer JOB_UPDATE_FLUSH_SECONDS after the first of them
+    or with the next immediate update, whichever comes first.
+    """
+    global _job_updates_since
+    with _job_updates_lock:
+        if not _job_updates:
+            _job_updates_since = time.monotonic()
+        _job_updates.setdefault(job_id, {}).update(fields)
+        if defer and time.monotonic() - _job_updates_since < JOB_UPDATE_FLUSH_SECONDS:
+            _schedule_job_updates_flush()
+            return
+        pending = _take_job_updates()
+    _write_job_updates(pending)
+
+
+def _schedule_job_updates_flush():
+    """Start the timer that writes deferred updates; called with _job_updates_lock held."""
+    global _job_updates_timer
+    if _job_updates_timer is None:
+        delay = max(0.0, _job_updates_since + JOB_UPDATE_FLUSH_SECONDS - time.monotonic())
+        _job_updates_timer = threading.Timer(delay, _flush_job_updates_on_timer)
+        _job_updates_timer.daemon = True
+        _job_updates_timer.start()
+
+
+def _take_job_updates() -> dict:
+    """Swap out the pending updates and cancel their timer; called with _job_updates_lock held."""
+    global _job_updates, _job_updates_timer
+    pending, _job_updates = _job_updates, {}
+    if _job_updates_timer is not None:
+        _job_updates_timer.cancel()
+        _job_updates_timer = None
+    return pending
+
+
+def _flush_job_updates_on_timer():
+    global _job_updates, _job_updates_since, _job_updates_timer
+    with _job_updates_lock:
+        _job_updates_timer = None
+        pending, _job_updates = _job_updates, {}
+    if not pending:
+        return
+    try:
+        _write_job_updates(pending)
+    except Exception as e:
+        logger.warning(f"Could not write {len(pending)} deferred index job updates, retrying: {e}")
+        with _job_updates_lock:
+            # updates queued meanwhile are newer than the ones that failed
+            for job_id, fields in _job_updates.items():
+                pending.setdefault(job_id, {}).update(fields)
+            _job_updates = pending
+            _job_updates_since = time.monotonic()
+            _schedule_job_updates_flush()
+
+
+def flush_index_job_updates():
+    with _job_updates_lock:
+        pending = _take_job_updates()
+    if pending:
+        _write_job_updates(pending)
+
+
+def _write_job_updates(pending: dict):
+    from pymongo import UpdateOne
+    ops = [UpdateOne({'job_id': job_id}, {'$set': fields}) for job_id, fields in pending.items()]
+    _mongo(_require_db().index_jobs.bulk_write, ops, ordered=False)
+
+
+def get_index_job(job_id: str, projection: dict | None = None):
+    doc = _mongo(_require_db().index_jobs.find_one, {'job_id': job_id}, projection or {'_id': 0})
+    with _job_updates_lock:
+        pending = _job_updates.get(job_id)
+    if doc is not None and pending:
+        # read our own deferred writes
+        doc.update({k: v for k, v in pending.items() if projection is None or k in projection})
+    return doc
+
+
+def find_index_jobs(statuses):
+    return list(_mongo(_require_db().index_jobs.find, {'status': {'$in': list(statuses)}}, {'_id': 0, 'result': 0}))
+
+
+def recent_index_jobs(repo_id: str, limit: int = 20) -> list:
+    """The newest jobs of a repo, newest first, as JOB_SUMMARY_FIELDS."""
+    cursor = _mongo(_require_db().index_jobs.find, {'repo_id': repo_id}, JOB_SUMMARY_FIELDS)
+    return list(cursor.sort('created_at', -1).limit(max(1, limit)))
+
+
+def claim_index_job(job_id: str, owner: str, now: float, stale_before: float) -> bool:
+    """Take the lease on a job unless another live owner holds it (heartbeat newer than `stale_before`)."""
+    res = _mongo(_require_db().index_jobs.update_one,
+                 {'job_id': job_id, '$or': [{'owner': None}, {'owner': owner}, {'heartbeat': {'$lt': stale_before}}]},
+                 {'$set': {'owner': owner, 'heartbeat': now}})
+    return res.modified_count == 1 or res.matched_count == 1
+
+
+def save_index_job_files(job_id: str, files: list):
+    """Store a job's input files, one document per file (each stays under the 16 MB document limit)."""
+    docs = [{'job_id': job_id, 'i': i, 'filename': f.get('filename'), 'content': f.get('content')}
+            for i, f in enumerate(files)]
+    if docs:
+        _insert(_require_db().index_job_files.insert_many, docs, ordered=False)
+
+
+def load_index_job_files(job_id: str) -> list:
+    cursor = _mongo(_require_db().index_job_files.find, {'job_id': job_id}, {'_id': 0, 'filename': 1, 'content': 1, 'i': 1})
+    return [{'filename': d['filename'], 'content': d['content']} for d in sorted(cursor, key=lambda d: d['i'])]
+
+
+def delete_index_job_files(job_id: str):
+    _mongo(_require_db().index_job_files.delete_many, {'job_id': job_id})
+
+
 def shutdown():
     """Close MongoDB client if open to release sockets and resources."""
-    global _client
+    global _client, _db, _init_attempted, _indexes_ensured
+    try:
+        if _client is not None:
+            flush_index_job_updates()
+    except Exception:
+        pass
     try:
         if _client is not None:
             _client.close()
     except Exception:
         pass
-    _client = None
\ No newline at end of file
+    _client = None
+    _db = None
+    _init_attempted = False
+    _indexes_ensured = False
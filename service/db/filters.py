@@ -0,0 +1,151 @@
+"""Retrieval filters.
+
+Callers describe a filter with a small spec (the `filter` field of
+`/rag/query`):
+
+    {
+        "path_prefix": "src/api/",          # directory or file path (str or list)
+        "ext": [".py", ".pyi"],             # file extension(s)
+        "where": {"provider": "github",     # equality on any metadata field
+                  "title": {"$in": ["numpy", "scipy"]}}
+    }
+
+Top-level keys other than these are treated as `where` fields. `build_filter`
+turns the spec into a Pinecone-style metadata filter ($eq/$ne/$in/$nin,
+$and/$or), which Pinecone evaluates natively and the local backend evaluates
+with per-field bitmap indexes before scoring. Path and extension filters
+rely on the `dirs`/`ext` fields that `index_repo` stores with every chunk
+(see `path_fields`).
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+OPERATORS = ('$eq', '$ne', '$in', '$nin')
+
+
+def path_fields(path: str) -> Dict[str, Any]:
+    """Indexable fields derived from a file path: its extension and ancestor directories."""
+    norm = path.replace('\\', '/')
+    norm = norm[2:] if norm.startswith('./') else norm
+    parts = [p for p in norm.split('/') if p][:-1]
+    dirs = ['/'.join(parts[:i + 1]) for i in range(len(parts))]
+    return {'ext': os.path.splitext(norm)[1].lower(), 'dirs': dirs}
+
+
+def _as_list(value) -> List[Any]:
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def _scalar(value):
+    # index_repo stores metadata values as strings
+    return value if isinstance(value, str) else str(value)
+
+
+def _field_condition(value) -> Dict[str, Any]:
+    if isinstance(value, dict):
+        cond = {}
+        for op, v in value.items():
+            if op not in OPERATORS:
+                raise ValueError(f'unsupported filter operator {op!r} (expected one of {OPERATORS})')
+            cond[op] = [_scalar(x) for x in _as_list(v)] if op in ('$in', '$nin') else _scalar(v)
+        return cond
+    if isinstance(value, (list, tuple, set)):
+        return {'$in': [_scalar(x) for x in value]}
+    return {'$eq': _scalar(value)}
+
+
+def build_filter(spec: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Translate a filter spec into a Pinecone-style filter (None for no filter)."""
+    if not spec:
+        return None
+    if not isinstance(spec, dict):
+        raise ValueError('filter must be an object')
+    clauses = []
+    spec = dict(spec)
+    prefixes = spec.pop('path_prefix', None)
+    if prefixes:
+        alternatives = []
+        for prefix in _as_list(prefixes):
+            p = str(prefix).replace('\\', '/')
+            p = p[2:] if p.startswith('./') else p
+            alternatives.append({'dirs': {'$in': [p.strip('/')]}})
+            if not p.endswith('/'):
+                # without a trailing slash the prefix may also name a single file
+                alternatives.append({'path': {'$eq': p}})
+        clauses.append(alternatives[0] if len(alternatives) == 1 else {'$or': alternatives})
+    exts = spec.pop('ext', None)
+    if exts:
+        norm = [e.lower() if str(e).startswith('.') else '.' + str(e).lower() for e in _as_list(exts)]
+        clauses.append({'ext': {'$in': norm}})
+    where = spec.pop('where', None) or {}
+    if not isinstance(where, dict):
+        raise ValueError('filter.where must be an object')
+    for field, value in {**spec, **where}.items():
+        if field.startswith('$'):
+            raise ValueError(f'unsupported filter key {field!r}')
+        clauses.append({field: _field_condition(value)})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+def field_bitmaps(metas: List[Optional[Dict[str, Any]]], n: int, field: str):
+    """Per-value row masks for `field` over the first `n` metadata dicts, plus the mask of rows having it.
+
+    List-valued fields set the row in the mask of every element.
+    """
+    by_value: Dict[Any, np.ndarray] = {}
+    present = np.zeros(n, dtype=bool)
+    for row in range(n):
+        meta = metas[row]
+        if meta is None or field not in meta:
+            continue
+        present[row] = True
+        value = meta[field]
+        for v in (value if isinstance(value, (list, tuple)) else (value,)):
+            try:
+                mask = by_value.get(v)
+            except TypeError:  # unhashable metadata values never match a filter
+                continue
+            if mask is None:
+                mask = by_value[v] = np.zeros(n, dtype=bool)
+            mask[row] = True
+    return by_value, present
+
+
+def evaluate(flt: Dict[str, Any], bitmap, n: int) -> np.ndarray:
+    """Evaluate a Pinecone-style filter to a boolean row mask.
+
+    `bitmap(field, value)` returns the mask of rows whose `field` equals (or,
+    for list fields, contains) `value`; `bitmap(field, None)` returns the mask
+    of rows that have the field at all.
+    """
+    mask = np.ones(n, dtype=bool)
+    for key, cond in flt.items():
+        if key == '$and':
+            for sub in cond:
+                mask &= evaluate(sub, bitmap, n)
+        elif key == '$or':
+            any_mask = np.zeros(n, dtype=bool)
+            for sub in cond:
+                any_mask |= evaluate(sub, bitmap, n)
+            mask &= any_mask
+        else:
+            if not isinstance(cond, dict):
+                cond = {'$eq': cond}
+            for op, value in cond.items():
+                if op == '$eq':
+                    mask &= bitmap(key, value)
+                elif op == '$ne':
+                    mask &= bitmap(key, None) & ~bitmap(key, value)
+                elif op in ('$in', '$nin'):
+                    hit = np.zeros(n, dtype=bool)
+                    for v in value:
+                        hit |= bitmap(key, v)
+                    mask &= hit if op == '$in' else bitmap(key, None) & ~hit
+                else:
+                    raise ValueError(f'unsupported filter operator {op!r}')
+    return mask
@@ -0,0 +1,226 @@
+"""In-process vector store with the same interface as the Pinecone backend.
+
+Each namespace is a float32 matrix plus parallel id/metadata lists, scored
+with cosine similarity (Pinecone's default metric) using numpy. Select it
+with VECTOR_BACKEND=local. With LOCAL_VECTOR_PATH set, namespaces are
+loaded lazily from `<path>/<namespace>.ragsnap` snapshots and written back
+by `save()` (called from vector_store.shutdown()).
+
+Metadata filters (service/db/filters.py) are evaluated against per-field
+bitmap indexes -- one boolean row mask per distinct value -- that are built
+on first use of a field and rebuilt after the namespace changes, so only the
+matching rows are scored.
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+import numpy as np
+
+from service.db.filters import evaluate, field_bitmaps
+from service.db.snapshot import Snapshot, write_snapshot
+
+
+class _Namespace:
+    def __init__(self):
+        self.dim: Optional[int] = None
+        self.n = 0  # rows in use, including deleted ones
+        self.vecs = np.zeros((0, 0), dtype='float32')
+        self.norms = np.zeros(0, dtype='float32')
+        self.ids: List[Optional[str]] = []
+        self.metas: List[Optional[Dict[str, Any]]] = []
+        self.rows: Dict[str, int] = {}
+        self.version = 0  # bumped on every change; invalidates the bitmap indexes
+        self._bitmaps: Dict[str, tuple] = {}
+
+    def _grow(self, needed: int):
+        cap = self.vecs.shape[0]
+        if needed <= cap:
+            return
+        new_cap = max(needed, cap * 2, 64)
+        vecs = np.zeros((new_cap, self.dim), dtype='float32')
+        vecs[:self.n] = self.vecs[:self.n]
+        norms = np.zeros(new_cap, dtype='float32')
+        norms[:self.n] = self.norms[:self.n]
+        self.vecs, self.norms = vecs, norms
+
+    def upsert(self, vectors):
+        for vid, emb, meta in vectors:
+            emb = np.asarray(emb, dtype='float32').ravel()
+            if self.dim is None:
+                self.dim = emb.shape[0]
+                self.vecs = np.zeros((0, self.dim), dtype='float32')
+            if emb.shape[0] != self.dim:
+                raise ValueError(f'vector {vid} has dimension {emb.shape[0]}, namespace expects {self.dim}')
+            row = self.rows.get(vid)
+            if row is None:
+                self._grow(self.n + 1)
+                row = self.n
+                self.n += 1
+                self.ids.append(vid)
+                self.metas.append(None)
+                self.rows[vid] = row
+            self.vecs[row] = emb
+            self.norms[row] = np.linalg.norm(emb)
+            self.metas[row] = dict(meta or {})
+        self.version += 1
+
+    def delete(self, ids):
+        deleted = 0
+        for vid in ids:
+            row = self.rows.pop(vid, None)
+            if row is not None:
+                self.ids[row] = None
+                self.metas[row] = None
+                self.norms[row] = 0.0
+                deleted += 1
+        self.version += 1
+        if self.n and len(self.rows) < self.n // 2:
+            self._compact()
+        return deleted
+
+    def _compact(self):
+        keep = [r for r in range(self.n) if self.ids[r] is not None]
+        self.vecs = self.vecs[keep].copy() if keep else np.zeros((0, self.dim or 0), dtype='float32')
+        self.norms = self.norms[keep].copy()
+        self.ids = [self.ids[r] for r in keep]
+        self.metas = [self.metas[r] for r in keep]
+        self.n = len(keep)
+        self.rows = {vid: i for i, vid in enumerate(self.ids)}
+        self.version += 1
+
+    def alive(self) -> np.ndarray:
+        return np.fromiter((vid is not None for vid in self.ids[:self.n]), dtype=bool, count=self.n)
+
+    def _field_index(self, field: str):
+        cached = self._bitmaps.get(field)
+        if cached is not None and cached[0] == self.version:
+            return cached[1], cached[2]
+        by_value, present = field_bitmaps(self.metas, self.n, field)
+        self._bitmaps[field] = (self.version, by_value, present)
+        return by_value, present
+
+    def bitmap(self, field: str, value) -> np.ndarray:
+        """Rows where `field` equals/contains `value`; rows having `field` when `value` is None."""
+        by_value, present = self._field_index(field)
+        if value is None:
+            return present
+        mask = by_value.get(value)
+        return mask if mask is not None else np.zeros(self.n, dtype=bool)
+
+    def filter_rows(self, flt) -> np.ndarray:
+        return np.flatnonzero(evaluate(flt, self.bitmap, self.n) & self.alive())
+
+    def score(self, query, rows: Optional[np.ndarray] = None):
+        """Cosine scores of `query` against `rows` (default: every live row)."""
+        q = np.asarray(query, dtype='float32').ravel()
+        qn = float(np.linalg.norm(q)) or 1.0
+        if rows is None:
+            rows = np.flatnonzero(self.alive())
+        denom = self.norms[rows] * qn
+        denom[denom == 0] = 1.0
+        return rows, (self.vecs[rows] @ q) / denom
+
+
+class LocalVectorStore:
+    name = 'local'
+    dim = None  # any dimension; fixed per namespace by its first vector
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.lock = threading.RLock()
+        self.namespaces: Dict[str, _Namespace] = {}
+        self.stats = {'queries': 0, 'rows_scored': 0}
+
+    def _file_for(self, namespace: str) -> str:
+        return os.path.join(self.path, quote(namespace or '', safe='') + '.ragsnap')  # type: ignore[arg-type]
+
+    def _ns(self, namespace: Optional[str], create: bool = False) -> Optional[_Namespace]:
+        key = namespace or ''
+        ns = self.namespaces.get(key)
+        if ns is None and self.path and os.path.exists(self._file_for(key)):
+            ns = _Namespace()
+            snap = Snapshot(self._file_for(key), mmap=False)
+            for batch in snap.iter_batches(1000):
+                ns.upsert(batch)
+            self.namespaces[key] = ns
+        if ns is None and create:
+            ns = self.namespaces[key] = _Namespace()
+        return ns
+
+    def upsert(self, vectors: List[tuple], namespace: Optional[str] = None):
+        with self.lock:
+            self._ns(namespace, create=True).upsert(vectors)  # type: ignore[union-attr]
+
+    def query(self, query_vec, top_k=6, namespace: Optional[str] = None, filter: Optional[Dict[str, Any]] = None):
+        with self.lock:
+            ns = self._ns(namespace)
+            if ns is None or not ns.rows:
+                return []
+            rows, scores = ns.score(query_vec, ns.filter_rows(filter) if filter else None)
+            self.stats['queries'] += 1
+            self.stats['rows_scored'] += len(rows)
+            k = min(top_k, len(rows))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            out = []
+            for i in top:
+                row = rows[i]
+                meta = dict(ns.metas[row] or {})
+                entry = {"id": ns.ids[row], "score": float(scores[i]), "metadata": meta}
+                if "text" in meta:
+                    entry["text"] = meta["text"]
+                out.append(entry)
+            return out
+
+    def list_ids(self, prefix: str, namespace: Optional[str] = None) -> List[str]:
+        with self.lock:
+            ns = self._ns(namespace)
+            if ns is None:
+                return []
+            return [vid for vid in ns.rows if vid.startswith(prefix)]
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None) -> List[tuple]:
+        with self.lock:
+            ns = self._ns(namespace)
+            if ns is None:
+                return []
+            out = []
+            for vid in ids:
+                row = ns.rows.get(vid)
+                if row is not None:
+                    out.append((vid, ns.vecs[row].tolist(), dict(ns.metas[row] or {})))
+            return out
+
+    def delete_ids(self, ids: List[str], namespace: Optional[str] = None):
+        with self.lock:
+            ns = self._ns(namespace)
+            return ns.delete(ids) if ns is not None else 0
+
+    def delete_namespace(self, namespace: str):
+        with self.lock:
+            self.namespaces.pop(namespace or '', None)
+            if self.path:
+                try:
+                    os.remove(self._file_for(namespace))
+                except OSError:
+                    pass
+        return {"deleted": True, "namespace": namespace}
+
+    def save(self):
+        """Write every loaded namespace to LOCAL_VECTOR_PATH (no-op without a path)."""
+        if not self.path:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock:
+            for key, ns in self.namespaces.items():
+                rows = [r for r in range(ns.n) if ns.ids[r] is not None]
+                tmp = self._file_for(key) + '.tmp'
+                write_snapshot(tmp, [ns.ids[r] for r in rows],
+                               ns.vecs[rows] if rows else np.zeros((0, ns.dim or 0), dtype='float32'),
+                               [ns.metas[r] for r in rows], namespace=key, info={'source': self.name})
+                os.replace(tmp, self._file_for(key))
@@ -0,0 +1,318 @@
+"""Read-through local mirror of hot vector namespaces.
+
+A few repos get most of the queries, and each of those queries is a round
+trip to Pinecone. With VECTOR_MIRROR=on, `vector_store.get_backend()` wraps
+the Pinecone backend in a `MirroredBackend`:
+
+- A namespace queried MIRROR_MIN_QUERIES times is copied in the background
+  (list + fetch) into memory as an int8 matrix: unit vectors quantized with
+  one scale per row. Until the copy is ready, queries keep going to Pinecone.
+- Resident namespaces are scored locally: an int8 scan over every row (or
+  the rows matching the metadata filter, via the same bitmap indexes as the
+  local backend) picks a shortlist of MIRROR_RESCORE x top_k candidates, which
+  are rescored exactly against full-precision vectors memory-mapped from
+  MIRROR_PATH, so the returned scores are Pinecone's cosine scores.
+- Writes (`upsert`, `delete_ids`, `delete_namespace`) go to Pinecone, then
+  drop the namespace from the mirror; a copy that was loading during a write
+  is discarded. Other workers cannot see this worker's writes, so resident
+  copies are also reloaded after MIRROR_TTL seconds.
+- Residency is LRU under MIRROR_MAX_BYTES (int8 codes plus metadata); a
+  namespace larger than the whole budget is not mirrored.
+
+Hits, misses, loads and evictions appear in `snapshot()` (the `mirror` section
+of /rag/metrics) and as `mirror.*` metrics.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from service.db.filters import evaluate, field_bitmaps
+from service.utils import metrics
+from service.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+FETCH_BATCH = 100
+SCAN_BLOCK = 8192  # rows dequantized at a time, bounds the float32 scratch space
+
+
+def _meta_bytes(meta: Dict[str, Any]) -> int:
+    return 64 + sum(48 + len(str(k)) + len(str(v)) for k, v in meta.items())
+
+
+class _MirrorNamespace:
+    """Immutable int8 copy of one namespace; rebuilt rather than updated."""
+
+    def __init__(self, ids: List[str], vecs: np.ndarray, metas: List[Dict[str, Any]], full_path: str):
+        self.ids = ids
+        self.metas = metas
+        self.n = len(ids)
+        norms = np.linalg.norm(vecs, axis=1)
+        norms[norms == 0] = 1.0
+        unit = vecs / norms[:, None]
+        self.scales = (np.abs(unit).max(axis=1) / 127.0).astype('float32')
+        self.scales[self.scales == 0] = 1.0
+        self.codes = np.round(unit / self.scales[:, None]).astype('int8')
+        # full precision stays on disk; only the shortlist rows are read back
+        full = np.lib.format.open_memmap(full_path, mode='w+', dtype='float32', shape=unit.shape)
+        full[:] = unit
+        full.flush()
+        del full
+        self.full_path = full_path
+        self.full = np.load(full_path, mmap_mode='r')
+        self.nbytes = self.codes.nbytes + self.scales.nbytes + sum(_meta_bytes(m) for m in metas)
+        self.loaded_at = time.monotonic()
+        self._bitmaps: Dict[str, tuple] = {}
+
+    def bitmap(self, field: str, value) -> np.ndarray:
+        if field not in self._bitmaps:
+            self._bitmaps[field] = field_bitmaps(self.metas, self.n, field)
+        by_value, present = self._bitmaps[field]
+        if value is None:
+            return present
+        mask = by_value.get(value)
+        return mask if mask is not None else np.zeros(self.n, dtype=bool)
+
+    def _approx(self, q: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        total = self.n if rows is None else len(rows)
+        out = np.empty(total, dtype='float32')
+        for start in range(0, total, SCAN_BLOCK):
+            sel = slice(start, start + SCAN_BLOCK) if rows is None else rows[start:start + SCAN_BLOCK]
+            out[start:start + SCAN_BLOCK] = (self.codes[sel].astype('float32') @ q) * self.scales[sel]
+        return out
+
+    def query(self, query_vec, top_k: int, flt: Optional[Dict[str, Any]], rescore: int):
+        q = np.asarray(query_vec, dtype='float32').ravel()
+        q = q / (float(np.linalg.norm(q)) or 1.0)
+        rows = np.flatnonzero(evaluate(flt, self.bitmap, self.n)) if flt else None
+        total = self.n if rows is None else len(rows)
+        k = min(top_k, total)
+        if k <= 0:
+            return [], 0
+        approx = self._approx(q, rows)
+        m = min(total, max(k * rescore, k))
+        cand = np.argpartition(-approx, m - 1)[:m] if m < total else np.arange(total)
+        cand_rows = np.sort(cand if rows is None else rows[cand])  # ascending rows read the memmap in order
+        exact = np.asarray(self.full[cand_rows]) @ q
+        best = np.argsort(-exact)[:k]
+        out = []
+        for i in best:
+            row = int(cand_rows[i])
+            meta = dict(self.metas[row])
+            entry = {"id": self.ids[row], "score": float(exact[i]), "metadata": meta}
+            if "text" in meta:
+                entry["text"] = meta["text"]
+            out.append(entry)
+        return out, total
+
+    def close(self):
+        # queries that looked this namespace up before it was dropped may still be running: keep
+        # the mapping (an unlinked file stays readable while mapped); it goes with the last reference
+        try:
+            os.remove(self.full_path)
+        except OSError:
+            pass
+
+
+class MirroredBackend:
+    """Wraps a vector-store backend and serves hot namespaces from a local int8 copy."""
+
+    def __init__(self, inner, max_bytes: int = 256 * 1024 * 1024, min_queries: int = 3, rescore: int = 4,
+                 ttl: float = 300.0, path: Optional[str] = None, background: bool = True):
+        self.inner = inner
+        self.name = inner.name
+        self.dim = inner.dim
+        self.max_bytes = max_bytes
+        self.min_queries = max(1, min_queries)
+        self.rescore = max(1, rescore)
+        self.ttl = ttl
+        self.path = path
+        self.background = background
+        self.lock = threading.Lock()
+        self.resident: 'OrderedDict[str, _MirrorNamespace]' = OrderedDict()
+        self.query_counts: Dict[str, int] = {}
+        self.generation: Dict[str, int] = {}  # bumped by writes; loads started under an older one are dropped
+        self.loading: set = set()
+        self.skip_until: Dict[str, float] = {}  # too large or failed to load: retry after the TTL
+        self.stats = {'hits': 0, 'misses': 0, 'loads': 0, 'load_failures': 0, 'evictions': 0,
+                      'invalidations': 0, 'rows_scanned': 0}
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    # ---- residency ---------------------------------------------------------
+
+    def _dir(self) -> str:
+        if self.path is None:
+            self.path = tempfile.mkdtemp(prefix='ragsvc-mirror-')
+        os.makedirs(self.path, exist_ok=True)
+        return self.path
+
+    def _drop(self, key: str, reason: str):
+        ns = self.resident.pop(key, None)
+        if ns is not None:
+            ns.close()
+            self.stats[reason] += 1
+            metrics.incr(f'mirror.{reason}')
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge('mirror.namespaces', len(self.resident))
+        metrics.set_gauge('mirror.resident_bytes', sum(ns.nbytes for ns in self.resident.values()))
+
+    def _lookup(self, key: str) -> Optional[_MirrorNamespace]:
+        with self.lock:
+            ns = self.resident.get(key)
+            if ns is not None and self.ttl > 0 and time.monotonic() - ns.loaded_at > self.ttl:
+                self._drop(key, 'evictions')
+                ns = None
+            if ns is not None:
+                self.resident.move_to_end(key)
+                self.stats['hits'] += 1
+                metrics.incr('mirror.hits')
+                return ns
+            self.stats['misses'] += 1
+            metrics.incr('mirror.misses')
+            count = self.query_counts[key] = self.query_counts.get(key, 0) + 1
+            load = (count >= self.min_queries and key not in self.loading
+                    and self.skip_until.get(key, 0.0) <= time.monotonic())
+            if load:
+                self.loading.add(key)
+                gen = self.generation.get(key, 0)
+        if load:
+            if self.background:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mirror')
+                self._pool.submit(self._load, key, gen)
+            else:
+                self._load(key, gen)
+                return self._lookup_resident(key)
+        return None
+
+    def _lookup_resident(self, key: str) -> Optional[_MirrorNamespace]:
+        with self.lock:
+            return self.resident.get(key)
+
+    def _load(self, key: str, gen: int):
+        t0 = time.perf_counter()
+        ns = None
+        try:
+            ids = self.inner.list_ids('', namespace=key or None)
+            rows, metas, out_ids, size = [], [], [], 0
+            for i in range(0, len(ids), FETCH_BATCH):
+                for vid, values, meta in self.inner.fetch(ids[i:i + FETCH_BATCH], namespace=key or None):
+                    out_ids.append(vid)
+                    rows.append(np.asarray(values, dtype='float32'))
+                    metas.append(meta or {})
+                    size += len(rows[-1]) + _meta_bytes(metas[-1])
+                if size > self.max_bytes:
+                    raise MemoryError(f'namespace {key!r} exceeds MIRROR_MAX_BYTES ({self.max_bytes})')
+            if out_ids:
+                fname = f'{abs(hash(key)):x}-{gen}-{time.monotonic_ns()}.npy'
+                ns = _MirrorNamespace(out_ids, np.stack(rows), metas, os.path.join(self._dir(), fname))
+        except Exception as e:
+            logger.warning(f"mirror: could not load namespace {key!r}: {e}")
+            metrics.incr('mirror.load_failures')
+            with self.lock:
+                self.loading.discard(key)
+                self.stats['load_failures'] += 1
+                self.skip_until[key] = time.monotonic() + max(self.ttl, 60.0)
+            return
+        with self.lock:
+            self.loading.discard(key)
+            self.query_counts.pop(key, None)
+            if ns is None:
+                return
+            if self.generation.get(key, 0) != gen:
+                ns.close()  # written to while loading
+                return
+            self.resident[key] = ns
+            self.stats['loads'] += 1
+            while sum(r.nbytes for r in self.resident.values()) > self.max_bytes and len(self.resident) > 1:
+                self._drop(next(iter(self.resident)), 'evictions')
+            self._publish()
+        metrics.incr('mirror.loads')
+        metrics.observe('mirror.load_seconds', time.perf_counter() - t0)
+        logger.info(f"mirror: loaded namespace {key!r} ({ns.n} rows, {ns.nbytes} bytes) "
+                    f"in {time.perf_counter() - t0:.2f}s")
+
+    def invalidate(self, namespace: Optional[str]):
+        key = namespace or ''
+        with self.lock:
+            self.generation[key] = self.generation.get(key, 0) + 1
+            self.skip_until.pop(key, None)
+            self._drop(key, 'invalidations')
+
+    # ---- backend interface -------------------------------------------------
+
+    def query(self, query_vec, top_k=6, namespace: Optional[str] = None, filter: Optional[Dict[str, Any]] = None):
+        ns = self._lookup(namespace or '')
+        if ns is None:
+            return self.inner.query(query_vec, top_k=top_k, namespace=namespace, filter=filter)
+        t0 = time.perf_counter()
+        results, scanned = ns.query(query_vec, top_k, filter, self.rescore)
+        metrics.observe('mirror.query_seconds', time.perf_counter() - t0)
+        with self.lock:
+            self.stats['rows_scanned'] += scanned
+        return results
+
+    def upsert(self, vectors: List[tuple], namespace: Optional[str] = None):
+        try:
+            return self.inner.upsert(vectors, namespace=namespace)
+        finally:
+            self.invalidate(namespace)
+
+    def delete_ids(self, ids: List[str], namespace: Optional[str] = None):
+        try:
+            return self.inner.delete_ids(ids, namespace=namespace)
+        finally:
+            self.invalidate(namespace)
+
+    def delete_namespace(self, namespace: str):
+        try:
+            return self.inner.delete_namespace(namespace)
+        finally:
+            self.invalidate(namespace)
+
+    def list_ids(self, prefix: str, namespace: Optional[str] = None) -> List[str]:
+        return self.inner.list_ids(prefix, namespace=namespace)
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None) -> List[tuple]:
+        return self.inner.fetch(ids, namespace=namespace)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else None,
+                'resident': {k or '': {'rows': ns.n, 'bytes': ns.nbytes} for k, ns in self.resident.items()},
+                'resident_bytes': sum(ns.nbytes for ns in self.resident.values()),
+                'max_bytes': self.max_bytes,
+                'loading': sorted(self.loading),
+            }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        with self.lock:
+            for key in list(self.resident):
+                self.resident.pop(key).close()
+            self._publish()
+
+
+def from_env(inner) -> MirroredBackend:
+    return MirroredBackend(
+        inner,
+        max_bytes=int(os.getenv('MIRROR_MAX_BYTES', str(256 * 1024 * 1024))),
+        min_queries=int(os.getenv('MIRROR_MIN_QUERIES', '3')),
+        rescore=int(os.getenv('MIRROR_RESCORE', '4')),
+        ttl=float(os.getenv('MIRROR_TTL', '300')),
+        path=os.getenv('MIRROR_PATH') or None,
+    )
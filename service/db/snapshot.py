@@ -0,0 +1,247 @@
+"""Compact single-file snapshots of a vector namespace.
+
+Layout (all integers little-endian):
+
+    [0:8)      magic b'RAGSNAP1'
+    [8:16)     header length (u64)
+    [16:...)   header JSON, zero-padded to HEADER_RESERVED bytes
+    [HEADER_RESERVED:...)  float32 embedding matrix, row-major (count x dim)
+    [columns_offset:...)   zlib-compressed JSON columns: ids, texts and one
+                           list per metadata key
+
+The matrix sits at a fixed, aligned offset so readers memory-map it instead
+of loading it; ids, text and metadata are stored column-wise so repeated
+metadata keys cost nothing. Export streams from any vector-store backend,
+import bulk-loads into any backend in batches:
+
+    python -m service.db.snapshot export --repo my-repo --out my-repo.ragsnap
+    python -m service.db.snapshot import --file my-repo.ragsnap --repo my-repo --backend local
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+MAGIC = b'RAGSNAP1'
+HEADER_RESERVED = 4096
+FORMAT_VERSION = 1
+
+
+class SnapshotWriter:
+    """Streams rows into a snapshot file; the row count may be unknown up front."""
+
+    def __init__(self, path: str, dim: int, namespace: str = '', info: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.dim = dim
+        self.namespace = namespace
+        self.info = info or {}
+        self.count = 0
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metas: List[Dict[str, Any]] = []
+        self.f = open(path, 'wb')
+        self.f.write(b'\0' * HEADER_RESERVED)
+
+    def write(self, ids: List[str], embeddings, metadatas: List[Dict[str, Any]]):
+        mat = np.ascontiguousarray(np.asarray(embeddings, dtype='<f4').reshape(len(ids), self.dim))
+        self.f.write(mat.tobytes())
+        for vid, meta in zip(ids, metadatas):
+            meta = dict(meta or {})
+            self.ids.append(vid)
+            self.texts.append(meta.pop('text', '') or '')
+            self.metas.append(meta)
+        self.count += len(ids)
+
+    def close(self):
+        keys = sorted({k for m in self.metas for k in m})
+        columns = {
+            'ids': self.ids,
+            'texts': self.texts,
+            'metadata': {k: [m.get(k) for m in self.metas] for k in keys},
+        }
+        blob = zlib.compress(json.dumps(columns).encode('utf-8'), 6)
+        columns_offset = self.f.tell()
+        self.f.write(blob)
+        header = {
+            'version': FORMAT_VERSION,
+            'namespace': self.namespace,
+            'count': self.count,
+            'dim': self.dim,
+            'dtype': '<f4',
+            'matrix_offset': HEADER_RESERVED,
+            'columns_offset': columns_offset,
+            'columns_length': len(blob),
+            'created_at': time.time(),
+            **self.info,
+        }
+        raw = json.dumps(header).encode('utf-8')
+        if len(raw) + 16 > HEADER_RESERVED:
+            raise ValueError('snapshot header too large')
+        self.f.seek(0)
+        self.f.write(MAGIC + struct.pack('<Q', len(raw)) + raw)
+        self.f.close()
+        return header
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+
+
+class Snapshot:
+    """A snapshot opened for reading; `embeddings` is memory-mapped."""
+
+    def __init__(self, path: str, mmap: bool = True):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(8) != MAGIC:
+                raise ValueError(f'{path} is not a RAG snapshot')
+            (length,) = struct.unpack('<Q', f.read(8))
+            self.header = json.loads(f.read(length).decode('utf-8'))
+            f.seek(self.header['columns_offset'])
+            blob = f.read(self.header['columns_length'])
+        if self.header.get('version') != FORMAT_VERSION:
+            raise ValueError(f"unsupported snapshot version {self.header.get('version')}")
+        self._blob = blob
+        self._columns = None
+        shape = (self.header['count'], self.header['dim'])
+        if shape[0] == 0:
+            self.embeddings = np.zeros(shape, dtype='<f4')
+        elif mmap:
+            self.embeddings = np.memmap(path, dtype='<f4', mode='r', offset=self.header['matrix_offset'], shape=shape)
+        else:
+            with open(path, 'rb') as f:
+                f.seek(self.header['matrix_offset'])
+                self.embeddings = np.frombuffer(f.read(shape[0] * shape[1] * 4), dtype='<f4').reshape(shape)
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = json.loads(zlib.decompress(self._blob).decode('utf-8'))
+            self._blob = b''
+        return self._columns
+
+    @property
+    def count(self) -> int:
+        return self.header['count']
+
+    @property
+    def dim(self) -> int:
+        return self.header['dim']
+
+    @property
+    def ids(self) -> List[str]:
+        return self.columns['ids']
+
+    @property
+    def texts(self) -> List[str]:
+        return self.columns['texts']
+
+    def metadata(self, i: int, with_text: bool = True) -> Dict[str, Any]:
+        meta = {k: col[i] for k, col in self.columns['metadata'].items() if col[i] is not None}
+        if with_text and self.texts[i]:
+            meta['text'] = self.texts[i]
+        return meta
+
+    def iter_batches(self, batch_size: int = 100):
+        """Yield lists of (id, embedding row, metadata incl. text)."""
+        for start in range(0, self.count, batch_size):
+            end = min(self.count, start + batch_size)
+            rows = np.asarray(self.embeddings[start:end])
+            yield [(self.ids[i], rows[i - start], self.metadata(i)) for i in range(start, end)]
+
+
+def write_snapshot(path: str, ids: List[str], embeddings, metadatas: List[Dict[str, Any]],
+                   namespace: str = '', info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Write an in-memory set of vectors to a snapshot; returns the header."""
+    embeddings = np.asarray(embeddings, dtype='<f4')
+    writer = SnapshotWriter(path, embeddings.shape[1] if embeddings.ndim == 2 else 0, namespace=namespace, info=info)
+    if len(ids):
+        writer.write(ids, embeddings, metadatas)
+    return writer.close()
+
+
+def export_namespace(namespace: str, path: str, backend=None, batch_size: int = 100) -> Dict[str, Any]:
+    """Stream every vector of `namespace` from `backend` into a snapshot at `path`."""
+    from service.db.vector_store import get_backend, iter_vectors
+
+    backend = backend or get_backend()
+    writer = None
+    try:
+        for batch in iter_vectors(namespace, batch_size=batch_size, backend=backend):
+            if not batch:
+                continue
+            if writer is None:
+                writer = SnapshotWriter(path, len(batch[0][1]), namespace=namespace, info={'source': backend.name})
+            writer.write([v[0] for v in batch], [v[1] for v in batch], [v[2] for v in batch])
+        if writer is None:
+            writer = SnapshotWriter(path, 0, namespace=namespace, info={'source': backend.name})
+        return writer.close()
+    except Exception:
+        if writer is not None and not writer.f.closed:
+            writer.f.close()
+        raise
+
+
+def import_snapshot(path: str, namespace: Optional[str] = None, backend=None, batch_size: int = 100) -> Dict[str, Any]:
+    """Bulk-load a snapshot into `namespace` (default: the exported one) of `backend`."""
+    from service.db.vector_store import get_backend
+
+    backend = backend or get_backend()
+    snap = Snapshot(path)
+    namespace = namespace or snap.header.get('namespace')
+    expected_dim = getattr(backend, 'dim', None)
+    if snap.count and expected_dim and snap.dim != expected_dim:
+        raise ValueError(f'snapshot has dimension {snap.dim}, backend {backend.name} expects {expected_dim}')
+    loaded = 0
+    for batch in snap.iter_batches(batch_size):
+        backend.upsert(batch, namespace=namespace)
+        loaded += len(batch)
+    return {'namespace': namespace, 'imported': loaded, 'dim': snap.dim, 'backend': backend.name}
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    from service.db.vector_store import get_backend
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export', help='write a namespace to a snapshot file')
+    exp.add_argument('--repo', required=True, help='namespace (repoId) to export')
+    exp.add_argument('--out', required=True)
+    exp.add_argument('--backend', default=None, help='pinecone or local (default: VECTOR_BACKEND)')
+    imp = sub.add_parser('import', help='bulk-load a snapshot file into a namespace')
+    imp.add_argument('--file', required=True)
+    imp.add_argument('--repo', default=None, help='target namespace (default: the exported one)')
+    imp.add_argument('--backend', default=None, help='pinecone or local (default: VECTOR_BACKEND)')
+    for p in (exp, imp):
+        p.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    backend = get_backend(args.backend)
+    t0 = time.time()
+    if args.command == 'export':
+        header = export_namespace(args.repo, args.out, backend=backend, batch_size=args.batch_size)
+        print(f"exported {header['count']} vectors (dim={header['dim']}) to {args.out} "
+              f"({os.path.getsize(args.out) / 1e6:.1f} MB) in {time.time() - t0:.1f}s")
+    else:
+        res = import_snapshot(args.file, namespace=args.repo, backend=backend, batch_size=args.batch_size)
+        print(f"imported {res['imported']} vectors into {res['namespace']} ({res['backend']}) in {time.time() - t0:.1f}s")
+        # persist local namespaces when the local backend has a storage path
+        if hasattr(backend, 'save'):
+            backend.save()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
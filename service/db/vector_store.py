@@ -1,46 +1,85 @@
 """Pinecone vector store wrapper with defensive checks for uninitialized clients.
 
-This module lazily initializes the Pinecone client on import when environment
-variables are present. All public functions verify the index is available and
-return structured errors or raise informative RuntimeError when called while
-the client is not configured.
+The module-level functions (`upsert_vectors`, `query_vectors`, ...) dispatch
+to the backend selected by VECTOR_BACKEND: `pinecone` (default) or `local`.
+
+The Pinecone client is created lazily by `get_index()` on first use (or by an
+explicit `warmup()`), so importing this module never touches the network.
+All public functions verify the index is available and return structured
+errors or raise informative RuntimeError when called while the client is not
+configured.
 """
 
 import os
+import threading
 from typing import List, Any, Optional
 from dotenv import load_dotenv
-from pinecone import Pinecone, ServerlessSpec
 import numpy as np
 
+from service.embedding.projection import get_projection, projected_dim
+from service.utils.memory import get_governor
+from service.utils.resilience import retry
+
 # Load environment variables (works both locally and on Vercel)
 load_dotenv()
 # Load env variables
 PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
-INDEX_NAME = os.getenv('PINECONE_INDEX', 'repo-code-index')
-EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', '384'))
+# a projected embedding mode gets its own index (see service/embedding/projection.py)
+_projection = get_projection()
+INDEX_NAME = os.getenv('PINECONE_INDEX', 'repo-code-index') + (f'-{_projection.version}' if _projection else '')
+EMBEDDING_DIM = projected_dim(int(os.getenv('EMBEDDING_DIM', '384')))
 CLOUD = os.getenv('PINECONE_CLOUD', 'aws')
 REGION = os.getenv('PINECONE_REGION', 'us-east-1')
+# vectors per upsert request (Pinecone caps requests at ~2MB); shrunk under memory pressure
+UPSERT_BATCH_SIZE = int(os.getenv('UPSERT_BATCH_SIZE', '100'))
+# attempts per Pinecone call (jittered backoff, bounded by the request deadline)
+PINECONE_RETRIES = int(os.getenv('PINECONE_RETRIES', '3'))
 
-# Initialize Pinecone client if API key provided; be defensive otherwise
+# Pinecone client and index handle, populated by get_index()
 pc: Optional[Any] = None
 _index: Optional[Any] = None
-try:
-    if PINECONE_API_KEY:
-        pc = Pinecone(api_key=PINECONE_API_KEY)
-        # create index if missing (best-effort)
-        try:
-            if not pc.has_index(INDEX_NAME):
-                pc.create_index(name=INDEX_NAME, dimension=EMBEDDING_DIM, spec=ServerlessSpec(cloud=CLOUD, region=REGION))
-        except Exception:
-            # ignore index creation errors at import time
-            pass
+_init_attempted = False
+_init_lock = threading.Lock()
+
+
+def get_index():
+    """Return the Pinecone index handle, creating the client on first use.
+
+    Returns None when PINECONE_API_KEY is unset or initialization failed.
+    Initialization is attempted once per process (until `shutdown()`).
+    """
+    global pc, _index, _init_attempted
+    if _index is not None or _init_attempted:
+        return _index
+    with _init_lock:
+        if _init_attempted:
+            return _index
+        _init_attempted = True
+        if not PINECONE_API_KEY:
+            return None
         try:
-            _index = pc.Index(INDEX_NAME)
+            from pinecone import Pinecone, ServerlessSpec
+            pc = Pinecone(api_key=PINECONE_API_KEY)
+            # create index if missing (best-effort)
+            try:
+                if not pc.has_index(INDEX_NAME):
+                    pc.create_index(name=INDEX_NAME, dimension=EMBEDDING_DIM, spec=ServerlessSpec(cloud=CLOUD, region=REGION))
+            except Exception:
+                # ignore index creation errors, the Index() call below decides availability
+                pass
+            try:
+                _index = pc.Index(INDEX_NAME)
+            except Exception:
+                _index = None
         except Exception:
+            pc = None
             _index = None
-except Exception:
-    pc = None
-    _index = None
+    return _index
+
+
+def warmup():
+    """Initialize the client and index handle ahead of the first request."""
+    return get_index() is not None
 
 
 # Utility to recursively convert ndarrays to lists
@@ -55,56 +94,191 @@ def convert_ndarray_to_list(obj):
     else:
         return obj
 
+def _pinecone_transient(e: BaseException) -> bool:
+    """Whether a failed Pinecone call is worth retrying: 429/5xx, timeouts and dropped connections.
+
+    Other API errors (a malformed filter, a dimension mismatch) fail the same way on every attempt.
+    """
+    status = getattr(e, 'status', None) or getattr(e, 'status_code', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
+    # urllib3 connection, protocol and timeout errors, raised before any HTTP status
+    return type(e).__module__.split('.')[0] == 'urllib3' or type(e).__name__ == 'PineconeProtocolError'
+
+
+@retry((Exception,), tries=PINECONE_RETRIES, delay=0.2, backoff=2.0, max_delay=2.0, breaker='pinecone',
+       transient=_pinecone_transient)
+def _pinecone_call(fn, *args, **kwargs):
+    """Run one Pinecone client call behind the 'pinecone' circuit breaker, retrying transient errors."""
+    return fn(*args, **kwargs)
+
+
+def _entry(match_id, score, metadata):
+    entry = {"id": match_id, "score": score, "metadata": metadata or {}}
+    if "text" in entry["metadata"]:
+        entry["text"] = entry["metadata"]["text"]
+    return entry
+
+
+class PineconeBackend:
+    """Vector-store operations against the Pinecone index."""
+
+    name = 'pinecone'
+    dim = EMBEDDING_DIM
+
+    def _index(self):
+        index = get_index()
+        if index is None:
+            raise RuntimeError('Pinecone index not initialized: set PINECONE_API_KEY and ensure index is available')
+        return index
+
+    def upsert(self, vectors: List[tuple], namespace: str | None = None):
+        # vectors: list of (id, emb, metadata)
+        index = self._index()
+        governor = get_governor()
+        start = 0
+        while start < len(vectors):
+            batch = vectors[start:start + governor.scale(UPSERT_BATCH_SIZE, what='upsert_batch')]
+            start += len(batch)
+            safe_vectors = []
+            for vid, emb, meta in batch:
+                if isinstance(emb, np.ndarray):
+                    emb = emb.tolist()
+                safe_meta = convert_ndarray_to_list(meta)
+                safe_vectors.append((vid, emb, safe_meta))
+            # type: ignore[attr-defined]
+            _pinecone_call(index.upsert, vectors=safe_vectors, namespace=namespace)
+
+    def query(self, query_vec, top_k=6, namespace: str | None = None, filter: dict | None = None):
+        index = self._index()
+        kwargs = {'filter': filter} if filter else {}
+        # type: ignore[attr-defined]
+        res = _pinecone_call(
+            index.query,
+            vector=query_vec,
+            top_k=top_k,
+            namespace=namespace,
+            include_metadata=True,
+            **kwargs
+        )
+        matches = res.get("matches", []) if isinstance(res, dict) else getattr(res, "matches", None) or [] # type: ignore
+        return [_entry(m.get("id"), m.get("score"), m.get("metadata", {})) for m in matches]
+
+    def list_ids(self, prefix: str, namespace: str | None = None) -> List[str]:
+        """Return all ids in `namespace` starting with `prefix` (serverless indexes only)."""
+        index = self._index()
+        # type: ignore[attr-defined]
+        return _pinecone_call(lambda: [vid for page in index.list(prefix=prefix, namespace=namespace) for vid in page])
+
+    def fetch(self, ids: List[str], namespace: str | None = None) -> List[tuple]:
+        """Return (id, values, metadata) for the ids that exist, in request order."""
+        index = self._index()
+        # type: ignore[attr-defined]
+        res = _pinecone_call(index.fetch, ids=ids, namespace=namespace)
+        found = res.get("vectors", {}) if isinstance(res, dict) else getattr(res, "vectors", None) or {}
+        out = []
+        for vid in ids:
+            v = found.get(vid)
+            if v is None:
+                continue
+            values = v.get("values") if isinstance(v, dict) else getattr(v, "values", None)
+            meta = v.get("metadata") if isinstance(v, dict) else getattr(v, "metadata", None)
+            out.append((vid, values, dict(meta or {})))
+        return out
+
+    def delete_ids(self, ids: List[str], namespace: str | None = None):
+        index = self._index()
+        # Pinecone accepts at most 1000 ids per delete request
+        for i in range(0, len(ids), 1000):
+            # type: ignore[attr-defined]
+            _pinecone_call(index.delete, ids=ids[i:i + 1000], namespace=namespace)
+        return len(ids)
+
+    def delete_namespace(self, namespace: str):
+        try:
+            index = get_index()
+            if index is None:
+                # return structured info (don't raise) so callers can handle gracefully
+                return {"deleted": False, "namespace": namespace, "error": 'pinecone not configured'}
+            # type: ignore[attr-defined]
+            _pinecone_call(index.delete, delete_all=True, namespace=namespace)
+            return {"deleted": True, "namespace": namespace}
+        except Exception as e:
+            # Don't raise - return structured info so callers can handle non-existent namespaces gracefully
+            return {"deleted": False, "namespace": namespace, "error": str(e)}
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: str | None = None):
+    """Return the vector-store backend `name` (default: VECTOR_BACKEND, 'pinecone').
+
+    'local' is an in-process numpy store (service/db/local_store.py), useful for
+    development, tests, benchmarks and as an import target for snapshots.
+    With VECTOR_MIRROR=on, 'pinecone' is wrapped in a read-through local mirror.
+    """
+    name = (name or os.getenv('VECTOR_BACKEND', 'pinecone')).lower()
+    backend = _backends.get(name)
+    if backend is not None:
+        return backend
+    with _backends_lock:
+        if name not in _backends:
+            if name == 'pinecone':
+                backend = PineconeBackend()
+                if os.getenv('VECTOR_MIRROR', 'off').lower() in ('1', 'on', 'true', 'yes'):
+                    # serve hot namespaces from a local int8 copy (service/db/mirror.py)
+                    from service.db.mirror import from_env
+                    backend = from_env(backend)
+                _backends[name] = backend
+            elif name == 'local':
+                from service.db.local_store import LocalVectorStore
+                _backends[name] = LocalVectorStore(path=os.getenv('LOCAL_VECTOR_PATH') or None)
+            else:
+                raise ValueError(f"Unknown vector backend {name!r} (expected 'pinecone' or 'local')")
+        return _backends[name]
+
+
 # Upsert vectors
 def upsert_vectors(vectors: List[tuple], namespace: str | None = None):
-    # vectors: list of (id, emb, metadata)
-    if _index is None:
-        raise RuntimeError('Pinecone index not initialized: set PINECONE_API_KEY and ensure index is available')
-    safe_vectors = []
-    for vid, emb, meta in vectors:
-        if isinstance(emb, np.ndarray):
-            emb = emb.tolist()
-        safe_meta = convert_ndarray_to_list(meta)
-        safe_vectors.append((vid, emb, safe_meta))
-    # type: ignore[attr-defined]
-    _index.upsert(vectors=safe_vectors, namespace=namespace)
-
-# Query vectors
-def query_vectors(query_vec, top_k=6, namespace: str | None = None):
-    if _index is None:
-        raise RuntimeError('Pinecone index not initialized: set PINECONE_API_KEY and ensure index is available')
-    # type: ignore[attr-defined]
-    res = _index.query(
-        vector=query_vec,
-        top_k=top_k,
-        namespace=namespace,
-        include_metadata=True
-    )
-    matches = res.get("matches", []) if isinstance(res, dict) else getattr(res, "matches", None) or [] # type: ignore
-    out = []
-    for match in matches:
-        entry = {
-            "id": match.get("id"),
-            "score": match.get("score"),
-            "metadata": match.get("metadata", {})
-        }
-        if "text" in entry["metadata"]:
-            entry["text"] = entry["metadata"]["text"]
-        out.append(entry)
-    return out
+    return get_backend().upsert(vectors, namespace=namespace)
+
+# Query vectors; `filter` is a Pinecone-style metadata filter (see service/db/filters.py)
+def query_vectors(query_vec, top_k=6, namespace: str | None = None, filter: dict | None = None):
+    return get_backend().query(query_vec, top_k=top_k, namespace=namespace, filter=filter)
+
+# List vector ids by prefix
+def list_ids(prefix: str, namespace: str | None = None) -> List[str]:
+    return get_backend().list_ids(prefix, namespace=namespace)
+
+# Fetch stored vectors as (id, values, metadata)
+def fetch_vectors(ids: List[str], namespace: str | None = None) -> List[tuple]:
+    return get_backend().fetch(ids, namespace=namespace)
+
+# Delete specific vectors
+def delete_ids(ids: List[str], namespace: str | None = None):
+    return get_backend().delete_ids(ids, namespace=namespace)
 
 # Delete all vectors in a namespace
 def delete_namespace(namespace: str):
-    try:
-        if _index is None:
-            # return structured info (don't raise) so callers can handle gracefully
-            return {"deleted": False, "namespace": namespace, "error": 'pinecone not configured'}
-        # type: ignore[attr-defined]
-        _index.delete(delete_all=True, namespace=namespace)
-        return {"deleted": True, "namespace": namespace}
-    except Exception as e:
-        # Don't raise - return structured info so callers can handle non-existent namespaces gracefully
-        return {"deleted": False, "namespace": namespace, "error": str(e)}
+    return get_backend().delete_namespace(namespace)
+
+
+def mirror_stats():
+    """Hit rates and residency of the Pinecone mirror, or None when it is off or unused."""
+    backend = _backends.get('pinecone')
+    return backend.snapshot() if hasattr(backend, 'snapshot') else None
+
+
+def iter_vectors(namespace: str, batch_size: int = 100, backend=None):
+    """Yield every vector of `namespace` as lists of (id, values, metadata)."""
+    backend = backend or get_backend()
+    ids = backend.list_ids('', namespace=namespace)
+    for i in range(0, len(ids), batch_size):
+        yield backend.fetch(ids[i:i + batch_size], namespace=namespace)
 
 
 def shutdown():
@@ -114,7 +288,20 @@ def shutdown():
     may not be available on older versions, so this function defensively
     clears module-level references and allows GC to reclaim memory.
     """
-    global pc, _index
+    global pc, _index, _init_attempted
+    # persist local namespaces, if the local backend is in use and has a storage path
+    local = _backends.get('local')
+    if local is not None:
+        try:
+            local.save()
+        except Exception:
+            pass
+    mirror = _backends.get('pinecone')
+    if hasattr(mirror, 'close'):
+        try:
+            mirror.close()
+        except Exception:
+            pass
     try:
         # Some Pinecone client variants expose close/flush, call if present
         if pc is not None:
@@ -133,3 +320,4 @@ def shutdown():
         pc = None
     except Exception:
         pass
+    _init_attempted = False
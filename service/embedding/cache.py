@@ -30,6 +30,11 @@ class LRUCache:
             self.cache.move_to_end(key)
             self._evict_if_needed()
 
+    def items_recent(self):
+        """(key, value) pairs, most recently used first."""
+        with self.lock:
+            return list(reversed(self.cache.items()))
+
 
 class DiskCache:
     def __init__(self, path):
@@ -61,12 +66,17 @@ class DiskCache:
 
 # Simple cache manager combining LRU in-memory with disk fallback
 class EmbeddingCache:
-    def __init__(self, max_memory_items=4096, disk_path=None):
+    def __init__(self, max_memory_items=4096, disk_path=None, namespace=''):
+        """`namespace` separates entries produced by different models (e.g. 'int8')."""
         self.mem = LRUCache(max_size=max_memory_items)
         self.disk = DiskCache(disk_path) if disk_path else None
+        self.namespace = namespace or ''
+        # lookups served from memory / disk and misses; used to report warm-start hit rates
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
 
-    @staticmethod
-    def _key_for_text(text: str):
+    def _key_for_text(self, text: str):
+        if self.namespace:
+            text = self.namespace + '\0' + text
         h = hashlib.sha256(text.encode('utf-8')).hexdigest()
         return h
 
@@ -74,13 +84,16 @@ class EmbeddingCache:
         key = self._key_for_text(text)
         v = self.mem.get(key)
         if v is not None:
+            self.stats['memory_hits'] += 1
             return v
         if self.disk:
             v = self.disk.get(key)
             if v is not None:
                 # warm memory cache
                 self.mem.set(key, v)
-            return v
+                self.stats['disk_hits'] += 1
+                return v
+        self.stats['misses'] += 1
         return None
 
     def set(self, text: str, embedding):
@@ -1,46 +1,417 @@
 import os
 import time
 import gc
-from typing import List
+import asyncio
+import queue
+import threading
+from typing import Callable, List, Optional
 
-import onnxruntime as ort
-from transformers import AutoTokenizer
+import numpy as np
 
+# onnxruntime and transformers are imported lazily in _get_model_session_and_tokenizer()
+# so that importing this module (and main.py) stays cheap.
 from service.utils.log import get_logger
 from service.embedding.cache import EmbeddingCache
+from service.embedding.projection import get_projection
 from service.utils.retry import retry
+from service.utils.resilience import DeadlineExceeded, check_deadline, remaining
+from service.utils.memory import get_governor
+from service.utils import metrics
 
 logger = get_logger(__name__)
 
 _session = None
 _tokenizer = None
+# whether _session outputs pooled, normalized vectors (see service/utils/export_onnx.py)
+_session_pooled = False
 
-# simple in-memory + disk cache for embeddings
-_cache = EmbeddingCache(max_memory_items=int(os.environ.get('EMBEDDING_CACHE_ITEMS', '4096')), disk_path=os.path.join(os.getcwd(), 'data', 'embed_cache'))
+# texts per ONNX run; the memory governor shrinks this under pressure
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '32'))
+# how long the batcher holds the first request of a batch open for concurrent callers
+EMBED_BATCH_WAIT_MS = float(os.environ.get('EMBED_BATCH_WAIT_MS', '5'))
+# small get_embeddings() calls (query prompts) share model runs through the batcher
+EMBED_QUERY_BATCHING = os.environ.get('EMBED_QUERY_BATCHING', 'on').strip().lower() not in ('0', 'off', 'false', 'no')
+
+DEFAULT_MODEL_PATH = 'service/embedding/model.onnx'
+# fp32 is the exported model; int8/fp16 are produced by service/utils/quantize.py
+MODEL_VARIANTS = ('fp32', 'int8', 'fp16')
+# output of models exported with pooling and normalization fused into the graph
+POOLED_OUTPUT = 'sentence_embedding'
+
+
+def _model_variant() -> str:
+    variant = os.getenv('EMBEDDING_MODEL_VARIANT', 'fp32').strip().lower()
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f'EMBEDDING_MODEL_VARIANT must be one of {MODEL_VARIANTS}, got {variant!r}')
+    return variant
+
+
+def variant_model_path(base_path: str, variant: str) -> str:
+    """Path of the `variant` model derived from the fp32 model at `base_path`."""
+    if variant == 'fp32':
+        return base_path
+    root, ext = os.path.splitext(base_path)
+    return f'{root}.{variant}{ext or ".onnx"}'
+
+
+def _model_path() -> str:
+    return variant_model_path(os.getenv('ONNX_MODEL_PATH', DEFAULT_MODEL_PATH), _model_variant())
+
+
+def model_tag() -> str:
+    """Identifies the model producing embeddings."""
+    return _model_variant()
+
+
+def embedding_version() -> str:
+    """Identifies the vectors get_embeddings() returns: the model, plus the projection if one is enabled."""
+    proj = get_projection()
+    return model_tag() if proj is None else f'{model_tag()}+{proj.version}'
+
+
+# simple in-memory + disk cache for embeddings, namespaced per embedding version; the '-l2'
+# suffix keeps the unnormalized vectors cached before embeddings were L2-normalized apart
+_cache = EmbeddingCache(max_memory_items=int(os.environ.get('EMBEDDING_CACHE_ITEMS', '4096')),
+                        disk_path=os.path.join(os.getcwd(), 'data', 'embed_cache'),
+                        namespace=f'{embedding_version()}-l2')
+
+
+def _optimized_model_path(model_path: str):
+    """Where the pre-optimized copy of `model_path` is cached, or None when disabled.
+
+    Set ONNX_OPTIMIZED_MODEL_PATH to choose the location, or to 'off' to disable.
+    """
+    opt_path = os.getenv('ONNX_OPTIMIZED_MODEL_PATH')
+    if opt_path is not None and opt_path.strip().lower() in ('', '0', 'off', 'false', 'no'):
+        return None
+    if opt_path:
+        return opt_path
+    root, ext = os.path.splitext(model_path)
+    return f'{root}.opt{ext or ".onnx"}'
+
+
+def _create_session(model_path: str):
+    """Create the ONNX Runtime session, reusing a cached optimized graph when fresh.
+
+    The first load runs graph optimizations and saves the result next to the
+    model; later loads (other workers, restarts) read the saved graph with
+    optimizations disabled, which makes session creation much faster.
+    """
+    import onnxruntime as ort
+
+    providers = ['CPUExecutionProvider']
+    opt_path = _optimized_model_path(model_path)
+    if opt_path and os.path.exists(opt_path) and os.path.getmtime(opt_path) >= os.path.getmtime(model_path):
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            return ort.InferenceSession(opt_path, sess_options=so, providers=providers)
+        except Exception as e:
+            logger.warning(f'Ignoring unreadable optimized model {opt_path}: {e}')
+
+    so = ort.SessionOptions()
+    # EXTENDED (not ALL) keeps the saved graph portable across CPU types
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    if opt_path:
+        so.optimized_model_filepath = opt_path
+        try:
+            return ort.InferenceSession(model_path, sess_options=so, providers=providers)
+        except Exception as e:
+            # most likely the cache location is not writable; load without saving
+            logger.warning(f'Could not save optimized model to {opt_path}: {e}')
+            so = ort.SessionOptions()
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    return ort.InferenceSession(model_path, sess_options=so, providers=providers)
 
 
 def _get_model_session_and_tokenizer():
-    global _session, _tokenizer
+    global _session, _tokenizer, _session_pooled
     if _session is None:
-        model_path = os.getenv('ONNX_MODEL_PATH', 'service/embedding/model.onnx')
+        model_path = _model_path()
         if not os.path.exists(model_path):
+            if _model_variant() != 'fp32':
+                raise FileNotFoundError(f'ONNX model not found at {model_path} '
+                                        f'(create it with: python -m service.utils.quantize --{_model_variant()})')
             raise FileNotFoundError(f'ONNX model not found at {model_path}')
-        _session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        _session = _create_session(model_path)
+        _session_pooled = any(o.name == POOLED_OUTPUT for o in _session.get_outputs())
+        logger.info(f"Loaded {model_path} ({'fused pooling' if _session_pooled else 'pooling in numpy'})")
 
     if _tokenizer is None:
+        from transformers import AutoTokenizer
         model_name = os.getenv('MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2')
         _tokenizer = AutoTokenizer.from_pretrained(model_name)
 
     return _session, _tokenizer
 
 
+@retry((Exception,), tries=2, delay=0.5, backoff=2.0, breaker='onnx')
+def _run_session(session, ort_inputs, output_names=None):
+    return session.run(output_names, ort_inputs)
+
+
+def _embed_batch(texts: List[str]):
+    """Run `texts` through the model without touching the cache.
+
+    Returns a float32 numpy array of shape (len(texts), dim) holding the
+    L2-normalized, attention-masked mean of the last hidden state. Fused
+    models compute it in the graph; older exports are pooled here.
+    """
+    sess, tokenizer = _get_model_session_and_tokenizer()
+    enc = tokenizer(texts, padding=True, truncation=True, return_tensors='np')
+
+    # Filter out unsupported inputs (e.g., token_type_ids)
+    supported_inputs = set(i.name for i in sess.get_inputs())
+    ort_inputs = {k: v for k, v in enc.items() if k in supported_inputs}
+    if _session_pooled:
+        return _run_session(sess, ort_inputs, [POOLED_OUTPUT])[0].astype('float32', copy=False)
+    outputs = _run_session(sess, ort_inputs)
+    return mean_pool(outputs[0], enc.get('attention_mask'))
+
+
+def mean_pool(hidden: np.ndarray, attention_mask: Optional[np.ndarray]) -> np.ndarray:
+    """Masked mean over the sequence axis, L2-normalized, as float32 (batch x dim)."""
+    # fp16 models may emit half precision; pool in float32
+    hidden = hidden.astype('float32', copy=False)
+    if attention_mask is not None:
+        mask = attention_mask.astype('float32')
+        # batched mask @ hidden: no batch x seq x dim temporary
+        embeddings = np.matmul(mask[:, None, :], hidden)[:, 0, :]
+        embeddings /= np.maximum(mask.sum(axis=1, keepdims=True), 1e-9)
+    else:
+        embeddings = hidden.mean(axis=1)
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    return embeddings
+
+
+def _encode(texts: List[str]) -> np.ndarray:
+    """Model embeddings of `texts`, projected when EMBEDDING_PROJECTION is enabled."""
+    embeddings = _embed_batch(texts)
+    proj = get_projection()
+    return embeddings if proj is None else proj.apply(embeddings)
+
+
+class _Pending:
+    __slots__ = ('texts', 'result', 'error', 'done', 'enqueued', 'on_done')
+
+    def __init__(self, texts: List[str], on_done: Optional[Callable[[], None]] = None):
+        self.texts = texts
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+        self.enqueued = time.monotonic()
+        # called on the dispatcher thread once result/error is set (async callers)
+        self.on_done = on_done
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent embedding calls into shared model runs.
+
+    A dispatcher thread takes the first waiting request, keeps the batch open
+    for up to `max_wait` seconds (or until `max_batch` texts are collected),
+    embeds the distinct texts in one run and hands every caller its rows.
+    Requests larger than `max_batch` are split across runs. `embed` blocks the
+    calling thread; `embed_async` awaits the same batch from an event loop.
+    """
+
+    def __init__(self, embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None,
+                 max_batch: int = EMBED_BATCH_SIZE, max_wait: float = EMBED_BATCH_WAIT_MS / 1000.0,
+                 name: str = 'embed-batcher'):
+        self.embed_fn = embed_fn or (lambda texts: _encode(texts))
+        self.name = name
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        self.q: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def embed(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        """Embed `texts` (no cache), sharing model runs with concurrent callers."""
+        if not texts:
+            return np.zeros((0, 0), dtype='float32')
+        self._ensure_thread()
+        pending = _Pending(list(texts))
+        self.q.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError(f'embedding {len(texts)} texts timed out after {timeout}s')
+        if pending.error is not None:
+            raise pending.error
+        return pending.result  # type: ignore[return-value]
+
+    async def embed_async(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        """`embed` for coroutines: the event loop keeps running while the batch is open."""
+        if not texts:
+            return np.zeros((0, 0), dtype='float32')
+        self._ensure_thread()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve():
+            if future.done():  # the caller timed out or was cancelled
+                return
+            if pending.error is not None:
+                future.set_exception(pending.error)
+            else:
+                future.set_result(pending.result)
+
+        def on_done():
+            try:
+                loop.call_soon_threadsafe(resolve)
+            except RuntimeError:
+                pass  # loop already closed
+
+        pending = _Pending(list(texts), on_done)
+        self.q.put(pending)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'embedding {len(texts)} texts timed out after {timeout}s') from None
+
+    def _collect(self, first: _Pending, max_batch: int) -> List[_Pending]:
+        metrics.set_gauge('embed_batcher.queued', self.q.qsize() + 1, batcher=self.name)
+        batch, n = [first], len(first.texts)
+        deadline = first.enqueued + self.max_wait
+        while n < max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                nxt = self.q.get(timeout=remaining) if remaining > 0 else self.q.get_nowait()
+            except queue.Empty:
+                break
+            if nxt is None:
+                self.q.put(None)
+                break
+            batch.append(nxt)
+            n += len(nxt.texts)
+        return batch
+
+    def _loop(self):
+        while True:
+            first = self.q.get()
+            if first is None:
+                return
+            # smaller runs under memory pressure, as in get_embeddings()
+            max_batch = get_governor().scale(self.max_batch, what='embed_batch')
+            batch = self._collect(first, max_batch)
+            try:
+                # one row per distinct text across every caller in the batch
+                unique = list(dict.fromkeys(t for p in batch for t in p.texts))
+                rows = {}
+                for start in range(0, len(unique), max_batch):
+                    part = unique[start:start + max_batch]
+                    embs = np.asarray(self.embed_fn(part), dtype='float32')
+                    rows.update(zip(part, embs))
+                    metrics.observe('embed_batcher.run_size', len(part))
+                now = time.monotonic()
+                for p in batch:
+                    p.result = np.stack([rows[t] for t in p.texts])
+                    metrics.observe('embed_batcher.wait', now - p.enqueued)
+                metrics.observe('embed_batcher.callers', len(batch))
+            except BaseException as e:
+                for p in batch:
+                    p.error = e
+            finally:
+                for p in batch:
+                    p.done.set()
+                    if p.on_done is not None:
+                        p.on_done()
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self.q.put(None)
+            self._thread.join(timeout=5)
+        self._thread = None
+
+
+_batcher: Optional[EmbeddingBatcher] = None
+# query prompts get their own dispatcher so they never queue behind a large /rag/embed request
+_query_batcher: Optional[EmbeddingBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> EmbeddingBatcher:
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = EmbeddingBatcher()
+    return _batcher
+
+
+def get_query_batcher() -> EmbeddingBatcher:
+    global _query_batcher
+    if _query_batcher is None:
+        with _batcher_lock:
+            if _query_batcher is None:
+                _query_batcher = EmbeddingBatcher(name='query-batcher')
+    return _query_batcher
+
+
+def _cache_lookup(texts: List[str]):
+    """(cached values or None per text, distinct uncached texts)."""
+    cached = [_cache.get(t) for t in texts]
+    metrics.incr('embed.cache_hits', sum(1 for v in cached if v is not None))
+    return cached, list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+
+
+def _cache_merge(texts: List[str], cached, missing: List[str], embs) -> np.ndarray:
+    """Cache the newly computed `embs` of `missing` and return the rows of `texts` in order."""
+    computed = {}
+    for t, emb in zip(missing, embs):
+        computed[t] = emb
+        try:
+            _cache.set(t, emb.tolist())
+        except Exception:
+            pass
+    rows = [np.asarray(v, dtype='float32') if v is not None else computed[t] for t, v in zip(texts, cached)]
+    return np.stack(rows) if rows else np.zeros((0, 0), dtype='float32')
+
+
+def embed_texts(texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+    """Synchronous embeddings for `texts` as a float32 (n, dim) array.
+
+    Cached texts are answered from the embedding cache; the rest go through the
+    shared batcher, so concurrent callers (e.g. /rag/embed requests) share model
+    runs, and are cached afterwards.
+    """
+    cached, missing = _cache_lookup(texts)
+    embs = get_batcher().embed(missing, timeout=timeout) if missing else []
+    return _cache_merge(texts, cached, missing, embs)
+
+
+async def embed_texts_async(texts: List[str], timeout: Optional[float] = None,
+                            batcher: Optional[EmbeddingBatcher] = None) -> np.ndarray:
+    """`embed_texts` for coroutines (the batch is awaited, not blocked on); `batcher` defaults to get_batcher()."""
+    cached, missing = _cache_lookup(texts)
+    embs = await (batcher or get_batcher()).embed_async(missing, timeout=timeout) if missing else []
+    return _cache_merge(texts, cached, missing, embs)
+
+
 async def get_embeddings(texts: List[str]) -> List[List[float]]:
     """Compute embeddings for a list of texts.
 
     Uses an in-memory LRU + disk cache. Returns a list of float lists, one per input text.
+    Calls smaller than one batch (query prompts) go through the query batcher so that
+    concurrent requests share model runs; indexing batches run directly.
     """
     if not isinstance(texts, list):
         raise ValueError('texts must be a list of strings')
+    if EMBED_QUERY_BATCHING and 0 < len(texts) < EMBED_BATCH_SIZE:
+        metrics.incr('embed.batched_calls')
+        # a queued prompt gives up with its request
+        check_deadline('embedding')
+        try:
+            return (await embed_texts_async(texts, timeout=remaining(), batcher=get_query_batcher())).tolist()
+        except DeadlineExceeded:
+            raise
+        except TimeoutError as e:
+            raise DeadlineExceeded(f'deadline exceeded waiting for embeddings: {e}') from None
 
     t0 = time.time()
     results: List[List[float]] = [None] * len(texts)  # type: ignore
@@ -55,46 +426,24 @@ async def get_embeddings(texts: List[str]) -> List[List[float]]:
             to_compute.append((i, txt))
 
     if to_compute:
-        sess, tokenizer = _get_model_session_and_tokenizer()
-        batch_texts = [t for _, t in to_compute]
-        enc = tokenizer(batch_texts, padding=True, truncation=True, return_tensors='np')
-
-        # Filter out unsupported inputs (e.g., token_type_ids)
-        supported_inputs = set(sess.get_inputs()[i].name for i in range(len(sess.get_inputs())))
-        ort_inputs = {k: v for k, v in enc.items() if k in supported_inputs}
-
-        @retry((Exception,), tries=2, delay=0.5, backoff=2.0)
-        def run_session(session, ort_inputs):
-            return session.run(None, ort_inputs)
-
-        ort_inputs = {k: v for k, v in enc.items() if k in supported_inputs}
-        outputs = run_session(sess, ort_inputs)
-        seq_emb = outputs[0]
-
-        attention_mask = enc.get('attention_mask')
-        if attention_mask is not None:
-            mask = attention_mask.astype('float32')
-            summed = (seq_emb * mask[:, :, None]).sum(axis=1)
-            denom = mask.sum(axis=1)[:, None]
-            embeddings = (summed / denom).astype('float32')
-        else:
-            embeddings = seq_emb.mean(axis=1).astype('float32')
-
-        emb_lists = embeddings.tolist()
+        governor = get_governor()
+        start = 0
+        while start < len(to_compute):
+            batch = to_compute[start:start + governor.scale(EMBED_BATCH_SIZE, what='embed_batch')]
+            start += len(batch)
+            embeddings = _encode([t for _, t in batch])
+            emb_lists = embeddings.tolist()
 
-        for (idx, _), emb in zip(to_compute, emb_lists):
-            results[idx] = emb
-            try:
-                _cache.set(texts[idx], emb)
-            except Exception:
-                pass
+            for (idx, _), emb in zip(batch, emb_lists):
+                results[idx] = emb
+                try:
+                    _cache.set(texts[idx], emb)
+                except Exception:
+                    pass
 
-        # free big temporaries
-        try:
-            del outputs, seq_emb, enc, ort_inputs, embeddings, emb_lists
-        except Exception:
-            pass
-        gc.collect()
+            # free big temporaries; collect only when memory is tight
+            del embeddings, emb_lists
+            governor.maybe_collect()
 
     # ensure all entries are filled (should be), coerce to lists
     for i in range(len(results)):
@@ -102,10 +451,20 @@ async def get_embeddings(texts: List[str]) -> List[List[float]]:
             results[i] = []
 
     d = time.time() - t0
-    logger.debug(f'get_embeddings time={d:.3f}s for {len(texts)} texts (computed={len(to_compute)})')
+    logger.debug('get_embeddings time=%.3fs for %d texts (computed=%d)', d, len(texts), len(to_compute))
     return results
 
 
+def warmup():
+    """Load the ONNX session and tokenizer and run one tiny inference.
+
+    Bypasses the embedding cache so the session is exercised even when the
+    warmup text was embedded before.
+    """
+    _embed_batch(['warmup'])
+    return True
+
+
 def shutdown():
     """Release references to heavy objects used by the embedding pipeline.
 
@@ -114,6 +473,12 @@ def shutdown():
     want to free up memory after large indexing runs.
     """
     global _session, _tokenizer, _cache
+    try:
+        for b in (_batcher, _query_batcher):
+            if b is not None:
+                b.stop()
+    except Exception:
+        pass
     try:
         _session = None
     except Exception:
@@ -0,0 +1,253 @@
+"""Optional projection of embeddings to fewer dimensions.
+
+A projection maps the model's EMBEDDING_DIM-dimensional vectors to `dim`
+dimensions before they are cached, stored or used as queries, and L2-normalizes
+the result (every backend scores by cosine). Two kinds:
+
+- `pca`: the top principal components of a sample of real embeddings (a repo
+  snapshot or a corpus); keeps the most recall for a given size.
+- `random`: a random orthogonal basis; needs no sample, keeps distances only
+  approximately (Johnson-Lindenstrauss), so it needs more dimensions.
+
+Enable one with EMBEDDING_PROJECTION=on (PROJECTION_PATH, default
+projection.npz next to the ONNX model) or EMBEDDING_PROJECTION=<path>.
+Its `version` (e.g. "pca128-1f2e3d4c") is part of the embedding cache
+namespace, is stored with every vector (`emb_ver`) and in the repo's index
+metadata, filters every query, and suffixes the Pinecone index name, so
+vectors of different projections, or none, never meet. Changing it means
+re-indexing.
+
+    python -m service.embedding.projection fit --kind pca --dim 128 --snapshot repo.ragsnap
+    python -m service.embedding.projection eval --snapshot repo.ragsnap --k 10
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from service.utils.log import get_logger
+
+# read before the first get_projection(), which runs at import of embedding_utils
+load_dotenv()
+logger = get_logger(__name__)
+
+KINDS = ('pca', 'random')
+
+
+class Projection:
+    """`apply(x)` = normalize((x - mean) @ matrix); matrix is (in_dim, dim)."""
+
+    def __init__(self, matrix: np.ndarray, mean: Optional[np.ndarray] = None, kind: str = 'pca'):
+        self.matrix = np.ascontiguousarray(matrix, dtype='float32')
+        self.mean = None if mean is None else np.asarray(mean, dtype='float32')
+        self.kind = kind
+        digest = hashlib.sha256(self.matrix.tobytes())
+        if self.mean is not None:
+            digest.update(self.mean.tobytes())
+        self.version = f'{kind}{self.dim}-{digest.hexdigest()[:8]}'
+
+    @property
+    def in_dim(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def apply(self, x) -> np.ndarray:
+        x = np.asarray(x, dtype='float32')
+        single = x.ndim == 1
+        x = x.reshape(-1, self.in_dim)
+        if self.mean is not None:
+            x = x - self.mean
+        out = x @ self.matrix
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out[0] if single else out
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        arrays = {'matrix': self.matrix, 'kind': np.array(self.kind)}
+        if self.mean is not None:
+            arrays['mean'] = self.mean
+        tmp = f'{path}.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'Projection':
+        with np.load(path) as data:
+            return cls(data['matrix'], data['mean'] if 'mean' in data else None, str(data['kind']))
+
+
+def fit_pca(sample, dim: int) -> Projection:
+    """Principal components of `sample` (n x in_dim); n should be well above `dim`."""
+    x = np.asarray(sample, dtype='float64')
+    # fitted on unit vectors, which is what the model emits and apply() is given
+    x = x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+    if x.shape[0] < dim:
+        raise ValueError(f'need at least {dim} sample vectors for {dim} components, got {x.shape[0]}')
+    mean = x.mean(axis=0)
+    # eigenvectors of the in_dim x in_dim covariance; cheaper than an SVD of the sample
+    evals, evecs = np.linalg.eigh(np.cov(x - mean, rowvar=False))
+    top = evecs[:, np.argsort(evals)[::-1][:dim]]
+    return Projection(top, mean, kind='pca')
+
+
+def random_orthogonal(in_dim: int, dim: int, seed: int = 0) -> Projection:
+    q, r = np.linalg.qr(np.random.default_rng(seed).standard_normal((in_dim, dim)))
+    # fix column signs so the basis is uniformly distributed
+    return Projection(q * np.sign(np.diag(r)), None, kind='random')
+
+
+def default_path() -> str:
+    model = os.getenv('ONNX_MODEL_PATH', 'service/embedding/model.onnx')
+    return os.getenv('PROJECTION_PATH') or os.path.join(os.path.dirname(model) or '.', 'projection.npz')
+
+
+def configured_path() -> Optional[str]:
+    value = os.getenv('EMBEDDING_PROJECTION', 'off').strip()
+    if value.lower() in ('', '0', 'off', 'false', 'no', 'none'):
+        return None
+    return default_path() if value.lower() in ('1', 'on', 'true', 'yes') else value
+
+
+_projection = None
+_loaded = False
+_lock = threading.Lock()
+
+
+def get_projection() -> Optional[Projection]:
+    """The configured projection, or None. A configured but missing file raises, rather than index unprojected."""
+    global _projection, _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                path = configured_path()
+                if path is not None:
+                    if not os.path.exists(path):
+                        raise FileNotFoundError(f'EMBEDDING_PROJECTION is set but {path} does not exist '
+                                                f'(create it with: python -m service.embedding.projection fit)')
+                    _projection = Projection.load(path)
+                    logger.info(f"Embedding projection {_projection.version}: {_projection.in_dim} -> {_projection.dim}")
+                _loaded = True
+    return _projection
+
+
+def projected_dim(full_dim: int) -> int:
+    proj = get_projection()
+    return proj.dim if proj is not None else full_dim
+
+
+def version_filter(vector_filter):
+    """`vector_filter` restricted to vectors of the active projection (unchanged without one)."""
+    proj = get_projection()
+    if proj is None:
+        return vector_filter
+    cond = {'emb_ver': {'$eq': proj.version}}
+    return cond if not vector_filter else {'$and': [vector_filter, cond]}
+
+
+def _load_sample(args):
+    """Full-dimension vectors (and texts, if known) from a snapshot or a corpus directory."""
+    if args.snapshot:
+        from service.db.snapshot import Snapshot
+        snap = Snapshot(args.snapshot)
+        n = min(snap.count, args.sample)
+        idx = np.sort(np.random.default_rng(0).choice(snap.count, n, replace=False))
+        return np.asarray(snap.embeddings[idx], dtype='float32')
+    from service.embedding import embedding_utils
+    from service.piplines.chunking import chunk_file
+    texts = []
+    for root, _, names in os.walk(args.corpus):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    content = f.read()
+            except (OSError, UnicodeDecodeError):
+                continue
+            texts.extend(t for _, _, _, t in chunk_file('corpus', os.path.relpath(path, args.corpus), content))
+            if len(texts) >= args.sample:
+                break
+    texts = texts[:args.sample]
+    # the raw model output: the projection, if any, is what is being fitted or evaluated
+    return np.concatenate([embedding_utils._embed_batch(texts[i:i + 32]) for i in range(0, len(texts), 32)])
+
+
+def evaluate(vectors: np.ndarray, proj: Projection, queries: int = 200, k: int = 10, seed: int = 1):
+    """Recall@k of projected retrieval against full-dimension retrieval, plus size and scoring time."""
+    full = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    reduced = proj.apply(full)
+    rng = np.random.default_rng(seed)
+    q_idx = rng.choice(len(full), min(queries, len(full)), replace=False)
+    # perturbed copies of stored vectors stand in for queries about the same code
+    noise = rng.standard_normal((len(q_idx), full.shape[1])).astype('float32') * 0.02
+    q_full = full[q_idx] + noise
+    q_full /= np.linalg.norm(q_full, axis=1, keepdims=True)
+    q_red = proj.apply(q_full)
+
+    def top_k(matrix, q):
+        scores = q @ matrix.T
+        return np.argpartition(-scores, k, axis=1)[:, :k]
+
+    t0 = time.perf_counter()
+    truth = top_k(full, q_full)
+    t_full = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    approx = top_k(reduced, q_red)
+    t_red = time.perf_counter() - t0
+    recall = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(truth, approx)]))
+    return {
+        'version': proj.version, 'vectors': len(full), 'queries': len(q_idx), 'k': k,
+        f'recall@{k}': round(recall, 4),
+        'bytes_per_vector': {'full': full.shape[1] * 4, 'projected': proj.dim * 4},
+        'storage_saving': round(1 - proj.dim / full.shape[1], 4),
+        'scoring_ms_per_query': {'full': round(1000 * t_full / len(q_idx), 4),
+                                 'projected': round(1000 * t_red / len(q_idx), 4)},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    for name in ('fit', 'eval'):
+        p = sub.add_parser(name)
+        src = p.add_mutually_exclusive_group(required=True)
+        src.add_argument('--snapshot', help='a full-dimension namespace snapshot (python -m service.db.snapshot export)')
+        src.add_argument('--corpus', help='a directory of source files, embedded with the local model')
+        p.add_argument('--sample', type=int, default=20000, help='vectors to use at most')
+        p.add_argument('--path', default=None, help='projection file (default: PROJECTION_PATH or next to the model)')
+    fit = sub.choices['fit']
+    fit.add_argument('--kind', choices=KINDS, default='pca')
+    fit.add_argument('--dim', type=int, default=128)
+    fit.add_argument('--seed', type=int, default=0)
+    ev = sub.choices['eval']
+    ev.add_argument('--queries', type=int, default=200)
+    ev.add_argument('--k', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    path = args.path or default_path()
+    vectors = _load_sample(args)
+    if args.cmd == 'fit':
+        if args.kind == 'pca':
+            proj = fit_pca(vectors, args.dim)
+        else:
+            proj = random_orthogonal(vectors.shape[1], args.dim, seed=args.seed)
+        proj.save(path)
+        print(f'{proj.version} ({proj.in_dim} -> {proj.dim}, fitted on {len(vectors)} vectors) written to {path}')
+        print('enable it with EMBEDDING_PROJECTION=on (or =<path>) and re-index every repo')
+        return 0
+    import json
+    print(json.dumps(evaluate(vectors, Projection.load(path), queries=args.queries, k=args.k), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
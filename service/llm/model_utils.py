@@ -1,19 +1,58 @@
 import os
 import json
-import google.generativeai as genai
+import threading
 
+# google.generativeai is imported lazily in _get_genai(); it is one of the
+# slowest imports in the service.
 
 api_key = os.getenv('GEMINI_API_KEY')
 MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-pro')
 
-def generate_from_gemini(prompt: str) -> dict:
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def _get_genai():
+    """Import and configure the Gemini SDK once per process."""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=api_key or os.getenv('GEMINI_API_KEY'))  # type: ignore
+                _genai = genai
+    return _genai
+
+
+def warmup():
+    """Import and configure the Gemini SDK ahead of the first query."""
+    _get_genai()
+    return True
+
+
+def parse_llm_output(raw: str):
+    """Return the JSON object embedded in an LLM response, or None."""
+    try:
+        start = raw.index('{')
+        candidate = raw[start:]
+        return json.loads(candidate)
+    except Exception:
+        return None
+
+
+def generate_from_gemini(prompt: str, model: str | None = None, timeout: float | None = None) -> dict:
     """
     Generate content using Gemini API.
     Only uses the required packages for this functionality.
+
+    `model` defaults to GEMINI_MODEL; `timeout` (seconds) bounds the HTTP call.
     """
-    genai.configure(api_key=api_key) # type: ignore
-    model = genai.GenerativeModel(MODEL) # type: ignore
-    resp = model.generate_content(prompt)
+    genai = _get_genai()
+    gen_model = genai.GenerativeModel(model or MODEL) # type: ignore
+    if timeout is not None:
+        resp = gen_model.generate_content(prompt, request_options={'timeout': timeout})
+    else:
+        resp = gen_model.generate_content(prompt)
     raw = ''
     try:
         if hasattr(resp, 'candidates'):
@@ -25,12 +64,4 @@ def generate_from_gemini(prompt: str) -> dict:
     except Exception:
         raw = str(resp)
 
-    parsed = None
-    try:
-        start = raw.index('{')
-        candidate = raw[start:]
-        parsed = json.loads(candidate)
-    except Exception:
-        parsed = None
-
-    return {'raw': raw, 'json': parsed}
\ No newline at end of file
+    return {'raw': raw, 'json': parse_llm_output(raw)}
@@ -0,0 +1,240 @@
+"""LLM providers with per-request deadlines, hedging and a fallback chain.
+
+A provider turns a prompt into `{'raw': str, 'json': dict | None}` (the shape
+returned by `generate_from_gemini`). `HedgedLLM` wraps a primary provider:
+
+- every call gets a deadline (LLM_DEADLINE seconds, or the caller's)
+- if the primary has not answered after the LLM_HEDGE_PERCENTILE latency
+  observed for it so far, a backup request goes to the hedge provider
+  (GEMINI_HEDGE_MODEL, a faster tier) and the first success wins
+- if everything in flight fails, the LLM_FALLBACK_MODELS are tried in order
+
+`LocalProvider` is a deterministic stand-in used by tests and benchmarks
+(LLM_PROVIDER=local). Latencies and the winning provider are logged and
+recorded in service.utils.metrics.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Optional
+
+from service.llm import model_utils
+from service.utils import metrics
+from service.utils.log import get_logger
+from service.utils.resilience import CircuitOpenError, DeadlineExceeded, get_breaker
+
+logger = get_logger(__name__)
+
+
+class LLMError(RuntimeError):
+    """Raised when every provider failed (bad key, rejected prompt, ...) with time left on the deadline."""
+
+
+class LLMDeadlineExceeded(LLMError, DeadlineExceeded):
+    """Raised when no provider answered before the deadline ran out.
+
+    A DeadlineExceeded, so callers serve a stale answer or a 504 as for any other exhausted budget.
+    """
+
+
+class LLMProvider:
+    name = 'base'
+
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> dict:
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    def __init__(self, model: str):
+        self.model = model
+        self.name = f'gemini:{model}'
+
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> dict:
+        # one breaker per model: an unhealthy model fails fast and the hedge/fallbacks take over
+        return get_breaker(self.name).call(model_utils.generate_from_gemini, prompt, model=self.model, timeout=timeout)
+
+
+class LocalProvider(LLMProvider):
+    """Deterministic stand-in: the answer and latency depend only on the prompt.
+
+    `latency` is the base delay in seconds, `jitter` adds up to that much more
+    (derived from the prompt hash), and `fail` makes every call raise.
+    """
+
+    def __init__(self, name: str = 'local', latency: float = 0.0, jitter: float = 0.0, fail: bool = False):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.fail = fail
+
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> dict:
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        delay = self.latency + self.jitter * (int(digest[:8], 16) / 0xFFFFFFFF)
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f'{self.name} timed out after {timeout:.2f}s')
+        if delay:
+            time.sleep(delay)
+        if self.fail:
+            raise RuntimeError(f'{self.name} failed')
+        answer = {
+            'suggestions': [f'suggestion-{digest[:8]}'],
+            'insights': [f'insight-{digest[8:16]}'],
+            'guidance': f'guidance from {self.name}',
+        }
+        raw = json.dumps(answer)
+        return {'raw': raw, 'json': model_utils.parse_llm_output(raw)}
+
+
+class HedgedLLM:
+    def __init__(self, primary: LLMProvider, hedge: Optional[LLMProvider] = None,
+                 fallbacks: Optional[List[LLMProvider]] = None, deadline: float = 60.0,
+                 hedge_percentile: float = 95.0, hedge_default_delay: float = 10.0,
+                 hedge_min_delay: float = 0.5, min_samples: int = 20, max_workers: int = 8):
+        self.primary = primary
+        self.hedge = hedge
+        self.fallbacks = list(fallbacks or [])
+        self.deadline = deadline
+        self.hedge_percentile = hedge_percentile
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.min_samples = min_samples
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+
+    @property
+    def name(self) -> str:
+        return self.primary.name
+
+    def hedge_delay(self) -> float:
+        """Primary latency percentile observed so far, or the default until enough samples."""
+        observed = metrics.samples('llm.latency', provider=self.primary.name)
+        if len(observed) < self.min_samples:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, metrics.percentile(observed, self.hedge_percentile))
+
+    def _call(self, provider: LLMProvider, prompt: str, timeout: float):
+        t0 = time.monotonic()
+        try:
+            out = provider.generate(prompt, timeout=timeout)
+        except Exception:
+            metrics.incr('llm.errors', provider=provider.name)
+            raise
+        metrics.observe('llm.latency', time.monotonic() - t0, provider=provider.name)
+        return out
+
+    def generate(self, prompt: str, deadline: Optional[float] = None) -> dict:
+        """Answer `prompt` within `deadline` seconds, capped at the configured deadline.
+
+        The answer carries the name of the provider that produced it under 'provider'.
+        """
+        t0 = time.monotonic()
+        deadline_at = t0 + (self.deadline if deadline is None else min(deadline, self.deadline))
+        tried = []
+        errors = []
+        failures = []
+
+        def remaining():
+            return deadline_at - time.monotonic()
+
+        def submit(provider):
+            tried.append(provider.name)
+            fut = self._pool.submit(self._call, provider, prompt, max(0.0, remaining()))
+            pending[fut] = provider
+            return fut
+
+        def finish(provider, out, hedged):
+            dt = time.monotonic() - t0
+            metrics.incr('llm.wins', provider=provider.name)
+            metrics.observe('llm.request_latency', dt)
+            logger.info(f'LLM answered by {provider.name} in {dt:.2f}s (hedged={hedged}, tried={tried})')
+            return {**out, 'provider': provider.name}
+
+        pending = {}
+        submit(self.primary)
+        hedged = False
+        hedge_at = t0 + self.hedge_delay()
+        while pending and remaining() > 0:
+            timeout = remaining()
+            if self.hedge is not None and not hedged:
+                timeout = min(timeout, max(0.0, hedge_at - time.monotonic()))
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                provider = pending.pop(fut)
+                try:
+                    return finish(provider, fut.result(), hedged)
+                except Exception as e:
+                    errors.append(f'{provider.name}: {e}')
+                    failures.append(e)
+            # fire the hedge once the primary is slower than usual (or already failed)
+            if self.hedge is not None and not hedged and (time.monotonic() >= hedge_at or not pending):
+                hedged = True
+                metrics.incr('llm.hedges')
+                submit(self.hedge)
+
+        # everything in flight failed: walk the fallback chain with what is left of the deadline
+        for provider in self.fallbacks:
+            if provider.name in tried or remaining() <= 0:
+                continue
+            metrics.incr('llm.fallbacks', provider=provider.name)
+            tried.append(provider.name)
+            fut = self._pool.submit(self._call, provider, prompt, max(0.0, remaining()))
+            try:
+                return finish(provider, fut.result(timeout=max(0.0, remaining())), hedged)
+            except Exception as e:
+                errors.append(f'{provider.name}: {e}')
+                failures.append(e)
+
+        metrics.incr('llm.failures')
+        if failures and all(isinstance(e, CircuitOpenError) for e in failures):
+            # nothing was attempted: report the outage and when the first breaker half-opens
+            first = min(failures, key=lambda e: e.retry_in)
+            raise CircuitOpenError(first.name, first.retry_in)
+        reason = '; '.join(errors) or 'deadline exceeded'
+        if remaining() <= 0 or any(isinstance(e, TimeoutError) for e in failures):
+            raise LLMDeadlineExceeded(f'No LLM provider answered within the deadline ({reason})')
+        raise LLMError(f'Every LLM provider failed ({reason})')
+
+
+def _models_from_env(name: str, default: str) -> List[str]:
+    value = os.getenv(name, default)
+    return [m.strip() for m in value.split(',') if m.strip() and m.strip().lower() != 'off']
+
+
+def build_llm_from_env() -> HedgedLLM:
+    kind = os.getenv('LLM_PROVIDER', 'gemini').lower()
+    if kind == 'local':
+        latency = float(os.getenv('LLM_LOCAL_LATENCY', '0'))
+        jitter = float(os.getenv('LLM_LOCAL_JITTER', '0'))
+        primary: LLMProvider = LocalProvider('local', latency=latency, jitter=jitter)
+        hedge = LocalProvider('local-fast', latency=latency / 4) if os.getenv('LLM_LOCAL_HEDGE') else None
+        fallbacks: List[LLMProvider] = []
+    else:
+        primary = GeminiProvider(model_utils.MODEL)
+        hedge_models = _models_from_env('GEMINI_HEDGE_MODEL', 'gemini-2.5-flash')
+        hedge = GeminiProvider(hedge_models[0]) if hedge_models else None
+        fallbacks = [GeminiProvider(m) for m in _models_from_env('LLM_FALLBACK_MODELS', 'gemini-2.5-flash')]
+    return HedgedLLM(
+        primary, hedge=hedge, fallbacks=fallbacks,
+        deadline=float(os.getenv('LLM_DEADLINE', '60')),
+        hedge_percentile=float(os.getenv('LLM_HEDGE_PERCENTILE', '95')),
+        hedge_default_delay=float(os.getenv('LLM_HEDGE_DELAY', '10')),
+        hedge_min_delay=float(os.getenv('LLM_HEDGE_MIN_DELAY', '0.5')),
+    )
+
+
+_llm: Optional[HedgedLLM] = None
+_llm_lock = threading.Lock()
+
+
+def get_llm() -> HedgedLLM:
+    """Return the process-wide LLM client configured from the environment."""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = build_llm_from_env()
+    return _llm
@@ -0,0 +1,126 @@
+"""Chunking strategies for index_repo.
+
+`fixed` (the original behaviour) slides a 2000-character window with 200
+characters of overlap and ids chunks by character offset, so inserting one
+line near the top of a file changes every chunk id after it.
+
+`cdc` (content-defined chunking) only cuts at line ends, and decides where
+to cut from a rolling hash over the last few lines, preferring cuts right
+before top-level syntax (a `def`/`class`/`function` ... at column 0). Because
+a cut depends only on nearby content, an edit moves at most the one or two
+chunks around it, and the chunk id is derived from the chunk text, so
+unchanged chunks keep their ids, cache keys and stored vectors.
+"""
+
+import hashlib
+import os
+import re
+import zlib
+from typing import List, Tuple
+
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 200
+
+CDC_MIN_CHARS = int(os.getenv('CDC_MIN_CHARS', '400'))
+CDC_MAX_CHARS = int(os.getenv('CDC_MAX_CHARS', '2000'))
+# expected number of lines between hash-selected cuts (after CDC_MIN_CHARS)
+CDC_AVG_LINES = int(os.getenv('CDC_AVG_LINES', '24'))
+CDC_WINDOW_LINES = 3
+
+# a line at column 0 that starts a new definition/block in common languages
+_SYNTAX_ANCHOR = re.compile(
+    r'^(?:@|def |async def |class |function |export |const |let |var |func |fn |pub |impl |struct |enum |'
+    r'interface |type |public |private |protected |static |module |package |#{1,6} |\w[\w.]*\s*[:=(])'
+)
+
+Chunk = Tuple[int, int, str]  # (start_char, end_char, text)
+
+
+def fixed_chunks(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Chunk]:
+    # naive chunking by characters
+    out = []
+    i = 0
+    while i < len(text):
+        chunk_text = text[i:i + chunk_size]
+        out.append((i, i + len(chunk_text), chunk_text))
+        i = i + chunk_size - overlap
+    return out
+
+
+def _line_hash(line: str) -> int:
+    # ignore trailing whitespace/newline style so reformatting line endings does not move cuts
+    return zlib.crc32(line.rstrip().encode('utf-8'))
+
+
+def cdc_chunks(text: str, min_chars: int = CDC_MIN_CHARS, max_chars: int = CDC_MAX_CHARS,
+               avg_lines: int = CDC_AVG_LINES) -> List[Chunk]:
+    """Split `text` at content-defined line boundaries.
+
+    Chunks are contiguous and cover `text` exactly. A cut after line i is
+    taken once the chunk holds at least `min_chars` when the hash of the
+    last CDC_WINDOW_LINES lines hits 1-in-`avg_lines` (1-in-`avg_lines`/4
+    when line i+1 is a syntax anchor). Chunks never exceed `max_chars`; a
+    single longer line is split into `max_chars` pieces.
+    """
+    lines = text.splitlines(keepends=True)
+    anchor_div = max(1, avg_lines // 4)
+    out: List[Chunk] = []
+    window: List[int] = []
+    start = pos = 0
+
+    def emit(end):
+        nonlocal start
+        if end > start:
+            out.append((start, end, text[start:end]))
+        start = end
+
+    for i, line in enumerate(lines):
+        if len(line) > max_chars:
+            # pathological line (minified code, data): cut around it in fixed pieces
+            emit(pos)
+            for j in range(0, len(line), max_chars):
+                emit(pos + min(j + max_chars, len(line)))
+            pos += len(line)
+            window = []
+            continue
+        if pos + len(line) - start > max_chars:
+            emit(pos)
+        pos += len(line)
+        window.append(_line_hash(line))
+        if len(window) > CDC_WINDOW_LINES:
+            window.pop(0)
+        if pos - start < min_chars:
+            continue
+        h = zlib.crc32(b''.join(x.to_bytes(4, 'little') for x in window))
+        nxt = lines[i + 1] if i + 1 < len(lines) else ''
+        div = anchor_div if _SYNTAX_ANCHOR.match(nxt) else avg_lines
+        if h % div == 0:
+            emit(pos)
+    emit(len(text))
+    return out
+
+
+def content_chunk_ids(prefix: str, chunks: List[Chunk]) -> List[str]:
+    """Ids derived from chunk text: `<prefix>:<sha256[:16]>`, with `~n` for repeats."""
+    seen = {}
+    ids = []
+    for _, _, chunk_text in chunks:
+        digest = hashlib.sha256(chunk_text.encode('utf-8')).hexdigest()[:16]
+        n = seen.get(digest, 0)
+        seen[digest] = n + 1
+        ids.append(f"{prefix}:{digest}" if n == 0 else f"{prefix}:{digest}~{n}")
+    return ids
+
+
+def chunk_file(repo_id: str, filename: str, text: str, mode: str = 'fixed'):
+    """Chunk one file; returns a list of (chunk_id, start_char, end_char, text)."""
+    prefix = f"{repo_id}:{filename}"
+    if mode == 'cdc':
+        chunks = cdc_chunks(text)
+        ids = content_chunk_ids(prefix, chunks)
+    elif mode == 'fixed':
+        chunks = fixed_chunks(text)
+        ids = [f"{prefix}:{start}" for start, _, _ in chunks]
+    else:
+        raise ValueError(f"Unknown chunking mode {mode!r} (expected 'fixed' or 'cdc')")
+    return [(cid, start, end, t) for cid, (start, end, t) in zip(ids, chunks)]
@@ -0,0 +1,246 @@
+"""Pre-index file filter.
+
+Drops files that would only produce useless chunks before they are chunked
+and embedded: vendored and generated paths and lockfiles (gitignore-style
+patterns), files over a size cap, binary content, minified bundles, base64
+and other high-entropy blobs, and exact duplicates of a file already kept.
+
+`FileFilter.apply(files)` returns the kept files plus a report of what was
+skipped, why, and roughly how many bytes and chunks that saved. Defaults come
+from the environment and can be overridden per request with the `fileFilter`
+object of `/rag/index`:
+
+    {"enabled": true, "exclude": ["docs/generated/"], "include": ["vendor/ours/"],
+     "maxFileBytes": 500000, "dedupe": true}
+
+Environment:
+    FILE_FILTER=on|off               (default on)
+    FILE_FILTER_EXCLUDE              extra comma-separated patterns
+    FILE_FILTER_MAX_BYTES            per-file cap in bytes (default 1 MB)
+    FILE_FILTER_MAX_LINE_LENGTH      longest line a non-minified file may have (default 1000)
+    FILE_FILTER_MAX_ENTROPY          bits per character (default 5.5; source code is ~4.5)
+"""
+
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from service.piplines.chunking import CHUNK_OVERLAP, CHUNK_SIZE
+
+DEFAULT_EXCLUDES = [
+    # vendored and tool-managed trees, wherever they are
+    'node_modules/', 'bower_components/', '.git/', '.svn/', '.hg/', '__pycache__/', '.venv/', '.tox/',
+    '.mypy_cache/', '.next/',
+    # build output and vendored code only at the repo root: `tools/build/` or a Java `out` package is source
+    '/vendor/', '/third_party/', '/dist/', '/build/', '/out/', '/target/', '/venv/', '/coverage/',
+    # lockfiles
+    'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'poetry.lock', 'Pipfile.lock', 'Cargo.lock',
+    'composer.lock', 'Gemfile.lock', 'go.sum', 'uv.lock',
+    # minified, compiled and source-map output
+    '*.min.js', '*.min.css', '*.map', '*.bundle.js', '*.pyc', '*.pyo', '*.class', '*.o', '*.so', '*.dll',
+    '*.dylib', '*.exe', '*.jar', '*.wasm',
+    # media, archives and documents
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.bmp', '*.ico', '*.webp', '*.svgz', '*.mp3', '*.mp4', '*.mov',
+    '*.avi', '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot', '*.zip', '*.gz', '*.tgz', '*.bz2', '*.xz',
+    '*.7z', '*.rar', '*.pdf', '*.onnx', '*.pt', '*.npy', '*.parquet', '*.sqlite',
+]
+# `*.db`, `*.bin` and similar names are also used for text (SQL dumps, fixtures); binary content is
+# dropped by the content check instead
+
+# how much of a file the content heuristics look at
+SAMPLE_CHARS = 16384
+# skipped files listed individually in a report (counts and totals always cover all of them)
+REPORT_FILE_LIMIT = 200
+
+
+def _pattern_regex(pattern: str) -> Tuple[re.Pattern, bool]:
+    """Compile one gitignore-style pattern; returns (regex, directory_only)."""
+    dir_only = pattern.endswith('/')
+    # like git: a slash at the start or in the middle anchors the pattern to the repo root
+    anchored = '/' in pattern.rstrip('/')
+    pattern = pattern.strip('/')
+    out, i = '', 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            out += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            out += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            out += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            out += '[^/]'
+            i += 1
+        else:
+            out += re.escape(pattern[i])
+            i += 1
+    prefix = '' if anchored else '(?:.*/)?'
+    # directory patterns match everything below the directory; others the path itself or below it
+    return re.compile('^' + prefix + out + ('/.*$' if dir_only else '(?:/.*)?$')), dir_only
+
+
+class PathMatcher:
+    """Ordered gitignore-style patterns: the last matching pattern wins, `!pattern` re-includes."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.rules = []
+        for raw in patterns:
+            raw = (raw or '').strip()
+            if not raw or raw.startswith('#'):
+                continue
+            negate = raw.startswith('!')
+            regex, _ = _pattern_regex(raw[1:] if negate else raw)
+            self.rules.append((regex, negate, raw))
+
+    def match(self, path: str) -> Optional[str]:
+        """Return the excluding pattern for `path`, or None when the path is kept."""
+        path = path.replace('\\', '/').lstrip('/')
+        path = path[2:] if path.startswith('./') else path
+        excluded_by = None
+        for regex, negate, raw in self.rules:
+            if regex.match(path):
+                excluded_by = None if negate else raw
+        return excluded_by
+
+
+def shannon_entropy(text: str) -> float:
+    """Bits per character of `text`."""
+    if not text:
+        return 0.0
+    n = len(text)
+    return -sum(c / n * math.log2(c / n) for c in Counter(text).values())
+
+
+def nonprintable_ratio(text: str) -> float:
+    if not text:
+        return 0.0
+    bad = sum(1 for ch in text if (ord(ch) < 32 and ch not in '\t\n\r\f\v') or ch == '\ufffd')
+    return bad / len(text)
+
+
+def decode_bytes(data: bytes) -> Optional[str]:
+    """Decode file bytes as UTF-8, or UTF-16 when a byte-order mark says so; None when not text."""
+    try:
+        if data.startswith((b'\xff\xfe', b'\xfe\xff')):
+            return data.decode('utf-16')
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return None
+
+
+def estimate_chunks(n_chars: int) -> int:
+    """Chunks the fixed chunker would produce for a text of `n_chars` characters."""
+    if n_chars <= 0:
+        return 0
+    step = CHUNK_SIZE - CHUNK_OVERLAP
+    return max(1, math.ceil(max(0, n_chars - CHUNK_OVERLAP) / step))
+
+
+class FileFilter:
+    """Decide which `{filename, content}` files are worth indexing."""
+
+    def __init__(self, exclude: Optional[List[str]] = None, include: Optional[List[str]] = None,
+                 max_file_bytes: int = 1_000_000, max_line_length: int = 1000, max_avg_line_length: int = 200,
+                 max_entropy: float = 5.5, max_nonprintable_ratio: float = 0.05, dedupe: bool = True):
+        patterns = list(DEFAULT_EXCLUDES) + list(exclude or []) + ['!' + p.lstrip('!') for p in (include or [])]
+        self.matcher = PathMatcher(patterns)
+        self.max_file_bytes = max_file_bytes
+        self.max_line_length = max_line_length
+        self.max_avg_line_length = max_avg_line_length
+        self.max_entropy = max_entropy
+        self.max_nonprintable_ratio = max_nonprintable_ratio
+        self.dedupe = dedupe
+
+    @classmethod
+    def from_env(cls, overrides: Optional[Dict[str, Any]] = None) -> Optional['FileFilter']:
+        """Filter configured from FILE_FILTER_* plus a request's `fileFilter`; None when disabled."""
+        overrides = overrides or {}
+        enabled = overrides.get('enabled')
+        if enabled is None:
+            enabled = os.getenv('FILE_FILTER', 'on').lower() not in ('0', 'off', 'false', 'no')
+        if not enabled:
+            return None
+        env_excludes = [p for p in os.getenv('FILE_FILTER_EXCLUDE', '').split(',') if p.strip()]
+        return cls(
+            exclude=env_excludes + list(overrides.get('exclude') or []),
+            include=list(overrides.get('include') or []),
+            max_file_bytes=int(overrides.get('maxFileBytes') or os.getenv('FILE_FILTER_MAX_BYTES', '1000000')),
+            max_line_length=int(overrides.get('maxLineLength') or os.getenv('FILE_FILTER_MAX_LINE_LENGTH', '1000')),
+            max_entropy=float(overrides.get('maxEntropy') or os.getenv('FILE_FILTER_MAX_ENTROPY', '5.5')),
+            dedupe=bool(overrides.get('dedupe', True)),
+        )
+
+    def check_content(self, text: str) -> Optional[str]:
+        """Return the reason to skip this content, or None to keep it."""
+        if not text.strip():
+            return 'empty'
+        if len(text.encode('utf-8', errors='replace')) > self.max_file_bytes:
+            return 'too-large'
+        sample = text[:SAMPLE_CHARS]
+        if '\x00' in sample or nonprintable_ratio(sample) > self.max_nonprintable_ratio:
+            return 'binary'
+        lines = sample.splitlines() or ['']
+        longest = max(len(line) for line in lines)
+        if longest > self.max_line_length and len(sample) / len(lines) > self.max_avg_line_length:
+            return 'minified'
+        if len(sample) >= 256 and shannon_entropy(sample) > self.max_entropy:
+            return 'high-entropy'
+        return None
+
+    def apply(self, files: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Return (files to index, report)."""
+        kept, skipped, seen = [], [], {}
+        for f in files:
+            name = f.get('filename') or ''
+            content = f.get('content')
+            reason, extra = None, {}
+            if isinstance(content, bytes):
+                decoded = decode_bytes(content)
+                if decoded is None:
+                    reason = 'binary'
+                else:
+                    content = decoded
+            elif not isinstance(content, str):
+                reason = 'not-text'
+            if isinstance(content, str):
+                size = len(content.encode('utf-8', errors='replace'))
+            else:
+                size = len(content) if isinstance(content, bytes) else 0
+            if reason is None:
+                pattern = self.matcher.match(name)
+                if pattern is not None:
+                    reason, extra = 'excluded', {'pattern': pattern}
+            if reason is None:
+                reason = self.check_content(content)
+            if reason is None and self.dedupe:
+                digest = hashlib.sha256(content.encode('utf-8', errors='replace')).hexdigest()
+                if digest in seen:
+                    reason, extra = 'duplicate', {'duplicate_of': seen[digest]}
+                else:
+                    seen[digest] = name
+            if reason is None:
+                kept.append({**f, 'content': content})
+            else:
+                chars = len(content) if isinstance(content, str) else size
+                skipped.append({'filename': name, 'reason': reason, 'bytes': size,
+                                'chunks': estimate_chunks(chars), **extra})
+        by_reason: Dict[str, int] = {}
+        for s in skipped:
+            by_reason[s['reason']] = by_reason.get(s['reason'], 0) + 1
+        report = {
+            'received': len(files),
+            'kept': len(kept),
+            'skipped': len(skipped),
+            'skipped_by_reason': by_reason,
+            'bytes_saved': sum(s['bytes'] for s in skipped),
+            'chunks_saved': sum(s['chunks'] for s in skipped),
+            'skipped_files': skipped[:REPORT_FILE_LIMIT],
+        }
+        if len(skipped) > REPORT_FILE_LIMIT:
+            report['skipped_files_truncated'] = True
+        return kept, report
@@ -1,21 +1,102 @@
+import contextvars
+import heapq
+import logging
 import os
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
-from service.embedding.embedding_utils import get_embeddings
-from service.db.vector_store import upsert_vectors, query_vectors, delete_namespace
-from service.llm.model_utils import generate_from_gemini
+
+import numpy as np
+from service.embedding.embedding_utils import embedding_version, get_embeddings
+from service.embedding.projection import projected_dim, version_filter
+from service.db.vector_store import upsert_vectors, query_vectors, delete_namespace, list_ids, delete_ids, fetch_vectors
+from service.db.filters import build_filter, path_fields
+from service.piplines.chunking import chunk_file
+from service.piplines.file_filter import FileFilter
+from service.llm.providers import get_llm
+from service.cache.answer_cache import answer_key, get_answer_cache
 from service.db.database import save_index_metadata, save_query_log
-from service.utils.log import get_logger
+from service.utils.log import JobSummary, Sampler, get_logger
+from service.utils.memory import get_governor
+from service.utils import metrics
+from service.utils.resilience import check_deadline, deadline_scope, remaining
 
 # Initialize logger
 logger = get_logger(__name__)
+# per-query events are high volume: log a sample of them, /rag/metrics has the exact counts
+_sampler = Sampler()
+
+EMBEDDING_DIM = projected_dim(int(os.getenv('EMBEDDING_DIM', '384')))
+# 'fixed' (offset-based ids) or 'cdc' (content-defined chunks with content ids)
+CHUNKING_MODE = os.getenv('CHUNKING_MODE', 'fixed').lower()
+# multi-repo queries: namespaces queried in parallel, and how scores are made comparable before merging
+RAG_FANOUT_WORKERS = int(os.getenv('RAG_FANOUT_WORKERS', '4'))
+RAG_FANOUT_SCORE_NORM = os.getenv('RAG_FANOUT_SCORE_NORM', 'none').lower()
+
+# file-level vectors (mean of a file's chunk embeddings) kept in '<repo>__files' for hierarchical retrieval
+FILE_VECTORS = os.getenv('FILE_VECTORS', 'true').lower() in ('1', 'true', 'yes')
+FILES_NAMESPACE_SUFFIX = '__files'
+# 'flat' searches every chunk; 'hierarchical' picks the best RAG_HIER_FILES files first
+RETRIEVAL_MODES = ('flat', 'hierarchical')
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'flat').lower()
+RAG_HIER_FILES = int(os.getenv('RAG_HIER_FILES', '8'))
+# per-request time budgets in seconds shared by every backend call below (0 = none)
+RAG_DEADLINE = float(os.getenv('RAG_DEADLINE', '30'))
+INDEX_DEADLINE = float(os.getenv('INDEX_DEADLINE', '0'))
+# chunks embedded and upserted per step by checkpointed (background) index jobs
+INDEX_CHECKPOINT_BATCH = int(os.getenv('INDEX_CHECKPOINT_BATCH', '100'))
+# ids per fetch when reading back the stored vectors of reused chunks
+FETCH_BATCH = 100
+
+_fanout_pool: ThreadPoolExecutor | None = None
+_fanout_lock = threading.Lock()
+
+PROMPT_TEMPLATE = """
+You are a code mentor assistant. Use the CONTEXT below (code chunks) and the QUESTION to produce:
+- a short list of concrete suggestions
+- a few insights about code structure or risk
+- guidance on next steps
+
+CONTEXT:
+{context}
+
+QUESTION:
+{question}
 
-EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', '384'))
+RESPONSE FORMAT:
+JSON with fields: suggestions (list), insights (list), guidance (string)
+"""
+
+async def index_repo(repo_id: str, files: List[Dict[str, str]], metadata: Dict[str, Any],
+                     file_filter: Dict[str, Any] | None = None, deadline: float | None = None, checkpoint=None):
+    """Index `files` into `repo_id`'s namespace within `deadline` seconds (default INDEX_DEADLINE).
+
+    With a `checkpoint` (see service/worker/jobs.py), chunks are embedded and upserted
+    INDEX_CHECKPOINT_BATCH at a time, the first `checkpoint.skip_batches` batches are skipped
+    and `checkpoint.batch_done()` is called after each upsert; it may raise to cancel the job.
+    """
+    with deadline_scope(INDEX_DEADLINE if deadline is None else deadline):
+        return await _index_repo(repo_id, files, metadata, file_filter, checkpoint)
+
+
+async def _index_repo(repo_id: str, files: List[Dict[str, str]], metadata: Dict[str, Any],
+                      file_filter: Dict[str, Any] | None, checkpoint=None):
+    # one summary line per job instead of a line per file or chunk
+    job = JobSummary(logger, 'index_repo', repo_id=repo_id, files_received=len(files), metadata=metadata)
 
-async def index_repo(repo_id: str, files: List[Dict[str, str]], metadata: Dict[str, Any]):
-    logger.info("Starting index_repo function")
-    logger.info(f"Repo ID: {repo_id}")
-    logger.info(f"Metadata: {metadata}")
+    # drop vendored, generated, binary, minified and duplicate files before chunking
+    filter_report = None
+    pre_filter = FileFilter.from_env(file_filter)
+    if pre_filter is not None:
+        received = files
+        files, filter_report = pre_filter.apply(files)
+        metrics.incr('index.files_skipped', filter_report['skipped'])
+        metrics.incr('index.bytes_skipped', filter_report['bytes_saved'])
+        job.set(files_skipped=filter_report['skipped'], bytes_skipped=filter_report['bytes_saved'])
+        delete_excluded_files(repo_id, excluded_paths(received, files))
+    requested_paths = [f['filename'] for f in files]
 
     # files: list of {filename, content}
     chunks = []
@@ -27,87 +108,411 @@ async def index_repo(repo_id: str, files: List[Dict[str, str]], metadata: Dict[s
                 text = str(text)
             except Exception:
                 text = ""
-        logger.info(f"Processing file: {f['filename']} with content length: {len(text)}")
-
-        # naive chunking by characters (replace with token-based later)
-        chunk_size = 2000
-        overlap = 200
-        i = 0
-        while i < len(text):
-            chunk_text = text[i:i+chunk_size]
+        job.add('bytes', len(text))
+
+        for chunk_id, start, end, chunk_text in chunk_file(repo_id, f['filename'], text, CHUNKING_MODE):
             chunks.append({
-                'id': f"{repo_id}:{f['filename']}:{i}",
+                'id': chunk_id,
                 'repoId': repo_id,
                 'path': f['filename'],
-                'start_char': i,
-                'end_char': i+len(chunk_text),
+                'start_char': start,
+                'end_char': end,
                 'text': chunk_text,
                 'metadata': metadata
             })
-            i = i + chunk_size - overlap
 
-    logger.info(f"Total chunks created: {len(chunks)}")
+    job.stage('chunk')
 
     # Ensure chunks are not empty before proceeding
     if not chunks:
-        logger.warning("No chunks were created. Ensure input files are valid.")
-        return {"status": "error", "message": "No chunks created. Check input files."}
+        job.emit(logging.WARNING, status='error', chunks=0)
+        return {"status": "error", "message": "No chunks created. Check input files.", "filter_report": filter_report}
 
-    logger.debug(f"Chunks created: {chunks}")
+    # content-defined ids: keep vectors whose chunk text is unchanged, drop the ones that disappeared
+    existing_ids, stale_ids = set(), []
+    if CHUNKING_MODE == 'cdc':
+        existing_ids, stale_ids = _diff_existing_ids(repo_id, files, chunks)
+    to_embed = [c for c in chunks if c['id'] not in existing_ids]
+    if checkpoint is not None:
+        return await _index_checkpointed(repo_id, files, chunks, to_embed, stale_ids, metadata, checkpoint, job,
+                                         filter_report, requested_paths)
 
     # 2. embed chunks in batches
-    texts = [c['text'] for c in chunks]
-    logger.info(f"Embedding {len(texts)} chunks")
-    embeddings = await get_embeddings(texts)
+    texts = [c['text'] for c in to_embed]
+    check_deadline('embedding')
+    embeddings = await get_embeddings(texts) if texts else []
+    job.stage('embed')
+    check_deadline('upsert')
 
-    vectors = []
-    for c, emb in zip(chunks, embeddings):
-        # Flatten metadata: merge chunk metadata and top-level metadata, stringify all values
-        flat_metadata = {k: str(v) for k, v in {**{k: v for k,v in c.items() if k not in ('text', 'metadata')}, **metadata}.items()}
-        # coerce to plain python list if it's a numpy array or similar
-        if isinstance(emb, list):
-            safe_emb = emb
-        else:
-            try:
-                safe_emb = list(emb)
-            except Exception:
-                safe_emb = emb
-        vectors.append((c['id'], safe_emb, flat_metadata))
-        logger.info(f"Vector created for chunk ID: {c['id']}")
-
-    # --- Merge with existing index ---
-    # Get all existing vectors for this repo
-    existing = query_vectors([0.0]*EMBEDDING_DIM, top_k=10000, namespace=repo_id)  # dummy query to get all
-    # Build a dict of existing vectors by id
-    existing_dict = {v['id']: v for v in existing}
-    num_existing = len(existing_dict)
-    # Replace/merge updated vectors
-    upserts = 0
-    for vid, emb, meta in vectors:
-        if vid in existing_dict:
-            upserts += 1
-        existing_dict[vid] = {'id': vid, 'emb': emb, 'metadata': meta}
-    # Prepare merged vectors for upsert
-    merged_vectors = [(v['id'], v.get('emb', [0.0]*EMBEDDING_DIM), v['metadata']) for v in existing_dict.values()]
-    upsert_vectors(merged_vectors, namespace=repo_id)
-
-    logger.info("Indexing completed")
+    vectors = [_chunk_vector(c, emb, metadata) for c, emb in zip(to_embed, embeddings)]
+    embedded = {c['id']: e for c, e in zip(to_embed, embeddings)}
+    reused_vectors, refreshed = _refresh_reused(repo_id, chunks, existing_ids, metadata)
+
+    file_vectors = 0
+    if FILE_VECTORS:
+        try:
+            file_vectors = _upsert_file_vectors(repo_id, chunks, {**reused_vectors, **embedded}, metadata)
+        except Exception as e:
+            # chunk vectors are still usable; hierarchical queries fall back to flat for this repo
+            logger.warning(f"Could not update file vectors for {repo_id}: {e}")
+        _delete_stale_file_vectors(repo_id, requested_paths, chunks)
+
+    if CHUNKING_MODE == 'cdc':
+        if vectors:
+            upsert_vectors(vectors, namespace=repo_id)
+        if stale_ids:
+            delete_ids(stale_ids, namespace=repo_id)
+        summary = {
+            'upserts': len(vectors),
+            'reused': len(chunks) - len(to_embed),
+            'refreshed': refreshed,
+            'deleted_stale': len(stale_ids),
+        }
+    else:
+        # --- Merge with existing index ---
+        # Get all existing vectors for this repo
+        existing = query_vectors([0.0]*EMBEDDING_DIM, top_k=10000, namespace=repo_id)  # dummy query to get all
+        # Build a dict of existing vectors by id
+        existing_dict = {v['id']: v for v in existing}
+        num_existing = len(existing_dict)
+        # Replace/merge updated vectors
+        upserts = 0
+        for vid, emb, meta in vectors:
+            if vid in existing_dict:
+                upserts += 1
+            existing_dict[vid] = {'id': vid, 'emb': emb, 'metadata': meta}
+        # Prepare merged vectors for upsert
+        merged_vectors = [(v['id'], v.get('emb', [0.0]*EMBEDDING_DIM), v['metadata']) for v in existing_dict.values()]
+        upsert_vectors(merged_vectors, namespace=repo_id)
+        summary = {
+            'upserts': upserts,
+            'merged_total': len(merged_vectors),
+            'existing_before': num_existing
+        }
+        del existing, existing_dict, merged_vectors
+    del vectors, embeddings
+    get_governor().maybe_collect()
+    job.stage('upsert')
 
     # 4. save metadata to MongoDB
-    save_index_metadata(repo_id, {'file_count': len(files), 'chunk_count': len(chunks), 'metadata': metadata})
+    save_index_metadata(repo_id, {'file_count': len(files), 'chunk_count': len(chunks), 'metadata': metadata,
+                                  'embedding_version': embedding_version()})
+    job.emit(status='ok', files=len(files), chunks=len(chunks), embedded=len(texts), file_vectors=file_vectors, **summary)
 
     # Return summary
-  
     return {
         'repo_id': repo_id,
         'file_count': len(files),
         'chunk_count': len(chunks),
-        'upserts': upserts,
-        'merged_total': len(merged_vectors),
-        'existing_before': num_existing
+        'file_vectors': file_vectors,
+        **summary,
+        'filter_report': filter_report
+    }
+
+
+def _chunk_vector(c: Dict[str, Any], emb, metadata: Dict[str, Any]) -> tuple:
+    """(id, embedding, flat metadata) for one chunk."""
+    # Flatten metadata: merge chunk metadata and top-level metadata, stringify all values
+    flat_metadata = {k: str(v) for k, v in {**{k: v for k,v in c.items() if k not in ('text', 'metadata')}, **metadata}.items()}
+    # keep the chunk text with the vector; retrieval returns it as the LLM context
+    flat_metadata['text'] = c['text']
+    # extension and ancestor directories, for path_prefix/ext filters at query time
+    flat_metadata.update(path_fields(c['path']))
+    flat_metadata['emb_ver'] = embedding_version()
+    # coerce to plain python list if it's a numpy array or similar
+    if isinstance(emb, list):
+        safe_emb = emb
+    else:
+        try:
+            safe_emb = list(emb)
+        except Exception:
+            safe_emb = emb
+    return (c['id'], safe_emb, flat_metadata)
+
+
+async def _index_checkpointed(repo_id: str, files: List[Dict[str, str]], chunks: List[Dict[str, Any]],
+                              to_embed: List[Dict[str, Any]], stale_ids: List[str], metadata: Dict[str, Any],
+                              checkpoint, job: JobSummary, filter_report, requested_paths: List[str]):
+    """Embed and upsert `to_embed` batch by batch, reporting each upsert to `checkpoint`.
+
+    Upserts replace vectors by id, so unlike the one-shot path nothing is merged with
+    the rest of the namespace; the job runner saves the repo metadata once at the end.
+    """
+    size = max(1, INDEX_CHECKPOINT_BATCH)
+    batches = [to_embed[i:i + size] for i in range(0, len(to_embed), size)]
+    # with content-defined ids the batches written before a restart already show up as
+    # existing ids (not in `to_embed`), so only fixed-mode ids rely on the batch count
+    skip = checkpoint.skip_batches if CHUNKING_MODE != 'cdc' else 0
+    embedded = {}
+    for n in range(skip, len(batches)):
+        batch = batches[n]
+        check_deadline('embedding')
+        embeddings = await get_embeddings([c['text'] for c in batch])
+        upsert_vectors([_chunk_vector(c, e, metadata) for c, e in zip(batch, embeddings)], namespace=repo_id)
+        embedded.update((c['id'], e) for c, e in zip(batch, embeddings))
+        checkpoint.batch_done(n + 1, len(batch))
+    job.stage('embed_upsert')
+    reused_vectors, refreshed = _refresh_reused(repo_id, chunks, {c['id'] for c in chunks} - {c['id'] for c in to_embed},
+                                                metadata)
+
+    file_vectors = 0
+    if FILE_VECTORS:
+        try:
+            # vectors of batches upserted before a restart are fetched back from the store
+            file_vectors = _upsert_file_vectors(repo_id, chunks, {**reused_vectors, **embedded}, metadata)
+        except Exception as e:
+            logger.warning(f"Could not update file vectors for {repo_id}: {e}")
+        _delete_stale_file_vectors(repo_id, requested_paths, chunks)
+    if stale_ids:
+        delete_ids(stale_ids, namespace=repo_id)
+    summary = {
+        'upserts': len(embedded),
+        'reused': len(chunks) - len(to_embed),
+        'refreshed': refreshed,
+        'deleted_stale': len(stale_ids),
+        'skipped_batches': min(skip, len(batches)),
     }
+    job.emit(status='ok', files=len(files), chunks=len(chunks), file_vectors=file_vectors, **summary)
+    return {
+        'repo_id': repo_id,
+        'file_count': len(files),
+        'chunk_count': len(chunks),
+        'file_vectors': file_vectors,
+        **summary,
+        'filter_report': filter_report
+    }
+
+
+def files_namespace(repo_id: str) -> str:
+    return repo_id + FILES_NAMESPACE_SUFFIX
+
+
+def file_vector(embeddings) -> List[float]:
+    """Summary vector of a file: the normalised mean of its normalised chunk embeddings."""
+    mat = np.asarray(embeddings, dtype='float32')
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    mean = (mat / norms).mean(axis=0)
+    return (mean / (np.linalg.norm(mean) or 1.0)).tolist()
+
+
+def _upsert_file_vectors(repo_id: str, chunks: List[Dict[str, Any]], embedded: Dict[str, Any], metadata: Dict[str, Any]):
+    """Write one vector per indexed file to the repo's files namespace; returns the count."""
+    by_path: Dict[str, List[str]] = {}
+    for c in chunks:
+        by_path.setdefault(c['path'], []).append(c['id'])
+    # chunks reused from an earlier index run were not embedded now; read their stored vectors
+    missing = [cid for ids in by_path.values() for cid in ids if cid not in embedded]
+    stored = {vid: values for vid, values, _ in fetch_vectors(missing, namespace=repo_id)} if missing else {}
+    vectors = []
+    for path, ids in by_path.items():
+        embs = [embedded[cid] if cid in embedded else stored[cid] for cid in ids if cid in embedded or cid in stored]
+        if not embs:
+            continue
+        meta = {k: str(v) for k, v in metadata.items()}
+        meta.update({'repoId': repo_id, 'path': path, 'chunk_count': str(len(ids)), **path_fields(path),
+                     'emb_ver': embedding_version()})
+        vectors.append((f"{repo_id}:{path}", file_vector(embs), meta))
+    if vectors:
+        upsert_vectors(vectors, namespace=files_namespace(repo_id))
+    return len(vectors)
+
+
+def excluded_paths(received: List[Dict[str, Any]], kept: List[Dict[str, Any]]) -> List[str]:
+    """Paths of the `received` files the filter dropped (and that are not also among the `kept`)."""
+    kept_paths = {f['filename'] for f in kept}
+    return sorted({f.get('filename') for f in received if f.get('filename') and f.get('filename') not in kept_paths})
+
+
+def delete_excluded_files(repo_id: str, paths: List[str]):
+    """Delete the chunk and file vectors of `paths`, files an earlier run indexed that the filter now drops.
+
+    With FILE_VECTORS, only paths that have a file vector are listed, so pushes that always
+    carry the same vendored files cost a few fetches rather than one listing per file.
+    Returns the number of chunk vectors deleted; failures are logged, the index run goes on.
+    """
+    if not paths:
+        return 0
+    try:
+        if FILE_VECTORS:
+            file_ids = [f"{repo_id}:{p}" for p in paths]
+            indexed = [vid for i in range(0, len(file_ids), FETCH_BATCH)
+                       for vid, _, _ in fetch_vectors(file_ids[i:i + FETCH_BATCH], namespace=files_namespace(repo_id))]
+            paths = [vid[len(repo_id) + 1:] for vid in indexed]
+            if indexed:
+                delete_ids(indexed, namespace=files_namespace(repo_id))
+        ids = [vid for p in paths for vid in list_ids(f"{repo_id}:{p}:", namespace=repo_id)]
+        if ids:
+            delete_ids(ids, namespace=repo_id)
+    except Exception as e:
+        # listing is only available on serverless indexes
+        logger.warning(f"Could not delete vectors of excluded files for {repo_id}: {e}")
+        return 0
+    return len(ids)
+
+
+def _delete_stale_file_vectors(repo_id: str, requested_paths: List[str], chunks: List[Dict[str, Any]]):
+    """Delete the file vectors of requested files that no longer have chunks (now empty).
+
+    Otherwise hierarchical retrieval spends its RAG_HIER_FILES picks on paths with nothing to search.
+    """
+    indexed = {c['path'] for c in chunks}
+    stale = sorted({f"{repo_id}:{p}" for p in requested_paths if p not in indexed})
+    if not stale:
+        return 0
+    try:
+        delete_ids(stale, namespace=files_namespace(repo_id))
+    except Exception as e:
+        logger.warning(f"Could not delete stale file vectors for {repo_id}: {e}")
+        return 0
+    return len(stale)
+
+
+def _refresh_reused(repo_id: str, chunks: List[Dict[str, Any]], reused_ids, metadata: Dict[str, Any]):
+    """Re-upsert reused chunks whose stored metadata is out of date, keeping their stored vectors.
+
+    A reused chunk's offsets move when earlier lines change, and chunks indexed before a
+    metadata field existed (e.g. `dirs`/`ext`, `emb_ver`) lack it, which hides them from
+    filters. Returns ({id: stored vector} for the reused chunks, number re-upserted).
+    """
+    reused = [c for c in chunks if c['id'] in reused_ids]
+    stored, updates = {}, []
+    try:
+        for start in range(0, len(reused), FETCH_BATCH):
+            part = reused[start:start + FETCH_BATCH]
+            found = {vid: (values, meta) for vid, values, meta in fetch_vectors([c['id'] for c in part],
+                                                                                namespace=repo_id)}
+            for c in part:
+                if c['id'] not in found:
+                    continue
+                values, meta = found[c['id']]
+                stored[c['id']] = values
+                vector = _chunk_vector(c, values, metadata)
+                if vector[2] != meta:
+                    updates.append(vector)
+        if updates:
+            upsert_vectors(updates, namespace=repo_id)
+    except Exception as e:
+        # the vectors themselves are current; only their metadata lags until the next run
+        logger.warning(f"Could not refresh metadata of reused chunks for {repo_id}: {e}")
+        return stored, 0
+    return stored, len(updates)
+
+
+def _diff_existing_ids(repo_id: str, files: List[Dict[str, str]], chunks: List[Dict[str, Any]]):
+    """Return (ids already stored for the chunks, stored ids of these files no longer produced)."""
+    new_ids = {c['id'] for c in chunks}
+    stored = set()
+    for filename in {f['filename'] for f in files}:
+        try:
+            stored.update(list_ids(f"{repo_id}:{filename}:", namespace=repo_id))
+        except Exception as e:
+            # listing is only available on serverless indexes; fall back to a full upsert
+            logger.warning(f"Could not list existing ids for {filename}: {e}")
+    return stored & new_ids, sorted(stored - new_ids)
+
+def _get_fanout_pool() -> ThreadPoolExecutor:
+    global _fanout_pool
+    if _fanout_pool is None:
+        with _fanout_lock:
+            if _fanout_pool is None:
+                _fanout_pool = ThreadPoolExecutor(max_workers=max(1, RAG_FANOUT_WORKERS), thread_name_prefix='rag-fanout')
+    return _fanout_pool
+
+
+def _hierarchical_query(namespace: str, query_emb, top_k: int, vector_filter):
+    """Pick the best RAG_HIER_FILES files by file vector, then search chunks only within them."""
+    files = query_vectors(query_emb, top_k=RAG_HIER_FILES, namespace=files_namespace(namespace), filter=vector_filter)
+    paths = [f['metadata'].get('path') for f in files if f['metadata'].get('path')]
+    if not paths:
+        # repo indexed without file vectors
+        metrics.incr('rag.hierarchical_fallbacks')
+        return query_vectors(query_emb, top_k=top_k, namespace=namespace, filter=vector_filter)
+    in_files = {'path': {'$in': paths}}
+    return query_vectors(query_emb, top_k=top_k, namespace=namespace,
+                         filter={'$and': [vector_filter, in_files]} if vector_filter else in_files)
+
+
+def _query_namespace(namespace: str, query_emb, top_k: int, vector_filter, mode: str = 'flat'):
+    start = time.perf_counter()
+    try:
+        if mode == 'hierarchical':
+            return _hierarchical_query(namespace, query_emb, top_k, vector_filter)
+        return query_vectors(query_emb, top_k=top_k, namespace=namespace, filter=vector_filter)
+    finally:
+        # not labelled by namespace: every repo ever queried would add a series that is never evicted
+        metrics.observe('rag.namespace_latency', time.perf_counter() - start)
+
+
+def _normalize_scores(results: List[Dict[str, Any]]):
+    """Min-max scale one namespace's scores to 0..1, keeping the original as raw_score."""
+    scores = [r.get('score') or 0.0 for r in results]
+    if not scores:
+        return results
+    lo, hi = min(scores), max(scores)
+    span = (hi - lo) or 1.0
+    return [{**r, 'raw_score': r.get('score'), 'score': ((r.get('score') or 0.0) - lo) / span if hi > lo else 1.0}
+            for r in results]
+
+
+def retrieve(repo_ids: List[str], query_emb, top_k: int = 6, vector_filter: Dict[str, Any] | None = None,
+             score_norm: str | None = None, mode: str | None = None) -> List[Dict[str, Any]]:
+    """Top-k chunks across one or more namespaces.
+
+    `mode` is 'flat' or 'hierarchical' (default: RETRIEVAL_MODE).
+
+    Several namespaces are queried concurrently on a bounded pool (RAG_FANOUT_WORKERS),
+    each for its own top_k, and merged into a global top_k with a heap. A namespace
+    that fails is logged and skipped unless every namespace fails.
+    """
+    mode = (mode or RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"unknown retrieval mode {mode!r} (expected 'flat' or 'hierarchical')")
+    if len(repo_ids) == 1:
+        return _query_namespace(repo_ids[0], query_emb, top_k, vector_filter, mode)
+    score_norm = (score_norm or RAG_FANOUT_SCORE_NORM).lower()
+    pool = _get_fanout_pool()
+    # each task runs in a copy of the caller's context so it sees the request deadline
+    futures = {ns: pool.submit(contextvars.copy_context().run, _query_namespace, ns, query_emb, top_k, vector_filter, mode) for ns in repo_ids}
+    merged, errors = [], []
+    for ns, fut in futures.items():
+        try:
+            results = fut.result()
+        except Exception as e:
+            logger.warning(f"Query on namespace {ns} failed: {e}")
+            metrics.incr('rag.namespace_errors')
+            errors.append(e)
+            continue
+        for r in results:
+            r.setdefault('namespace', ns)
+        merged.extend(_normalize_scores(results) if score_norm == 'minmax' else results)
+    if errors and len(errors) == len(repo_ids):
+        raise errors[0]
+    return heapq.nlargest(top_k, merged, key=lambda r: r.get('score') or 0.0)
+
+
+async def process_rag(repo_id: str | List[str], prompt: str, top_k: int = 6, metadata: Dict[str, Any]={},
+                      filter: Dict[str, Any] | None = None, retrieval: str | None = None,
+                      deadline: float | None = None) -> Dict[str, Any]:
+    """Answer `prompt` from the chunks of one repo, or of several (a list of repo ids) with one LLM call.
+
+    The whole answer, LLM call included, must fit in `deadline` seconds (default RAG_DEADLINE);
+    otherwise DeadlineExceeded is raised.
+    """
+    with deadline_scope(RAG_DEADLINE if deadline is None else deadline):
+        return await _process_rag(repo_id, prompt, top_k, filter, retrieval)
+
+
+async def _process_rag(repo_id: str | List[str], prompt: str, top_k: int,
+                       filter: Dict[str, Any] | None, retrieval: str | None) -> Dict[str, Any]:
+    repo_ids = [repo_id] if isinstance(repo_id, str) else list(dict.fromkeys(repo_id))
+    if not repo_ids:
+        raise ValueError('at least one repoId is required')
+    # validate the filter and mode before spending an embedding on the prompt
+    vector_filter = version_filter(build_filter(filter))
+    if retrieval and retrieval.lower() not in RETRIEVAL_MODES:
+        raise ValueError(f"unknown retrieval mode {retrieval!r} (expected one of {RETRIEVAL_MODES})")
 
-async def process_rag(repo_id: str, prompt: str, top_k: int = 6, metadata: Dict[str, Any]={}) -> Dict[str, Any]:
     # 1. embed prompt
     query_emb = (await get_embeddings([prompt]))[0]
     if not isinstance(query_emb, list):
@@ -117,29 +522,30 @@ async def process_rag(repo_id: str, prompt: str, top_k: int = 6, metadata: Dict[
             pass
 
     # 2. retrieve top chunks
-    results = query_vectors(query_emb, top_k=top_k, namespace=repo_id)
+    check_deadline('retrieval')
+    results = retrieve(repo_ids, query_emb, top_k=top_k, vector_filter=vector_filter, mode=retrieval)
     contexts = [r['metadata'].get('path','') + '::' + r['id'] + '\n' + (r.get('text') or '') for r in results]
 
     # 3. prepare LLM prompt
-    prompt_template = """
-You are a code mentor assistant. Use the CONTEXT below (code chunks) and the QUESTION to produce:
-- a short list of concrete suggestions
-- a few insights about code structure or risk
-- guidance on next steps
+    assembled = PROMPT_TEMPLATE.format(context='\n---\n'.join(contexts), question=prompt)
 
-CONTEXT:
-{context}
-
-QUESTION:
-{question}
-
-RESPONSE FORMAT:
-JSON with fields: suggestions (list), insights (list), guidance (string)
-"""
-    assembled = prompt_template.format(context='\n---\n'.join(contexts), question=prompt)
-
-    # 4. call Gemini
-    llm_out = generate_from_gemini(assembled)
+    # 4. call the LLM, unless the same question was already answered over the same chunks
+    llm = get_llm()
+    answer_cache = get_answer_cache()
+    cache_key = answer_key(prompt, results, model=llm.name, template=PROMPT_TEMPLATE)
+    if cache_key is None:
+        answer_cache = None
+    llm_out = answer_cache.get(cache_key) if answer_cache is not None else None
+    cache_hit = llm_out is not None
+    if cache_hit:
+        metrics.incr('answer_cache.hits')
+        _sampler.log(logger, 'answer_cache.hit', repo_ids=repo_ids)
+    else:
+        check_deadline('llm')
+        llm_out = llm.generate(assembled, deadline=remaining())
+        # the key names the primary model: a hedge or fallback answer must not outlive its outage
+        if answer_cache is not None and llm_out.get('raw') and llm_out.get('provider', llm.name) == llm.name:
+            answer_cache.set(cache_key, llm_out)
     raw = llm_out.get('raw', '')
 
     # 5. attempt to parse JSON from response, otherwise simple fallback
@@ -156,8 +562,14 @@ JSON with fields: suggestions (list), insights (list), guidance (string)
         guidance = raw
         suggestions = ["See raw output for details."]
 
-    # save query log
-    save_query_log(repo_id, {'prompt': prompt, 'result': {'suggestions': suggestions, 'insights': insights, 'guidance': guidance}})
+    # save query log; the answer is still returned when Mongo is down
+    try:
+        save_query_log(repo_ids, {
+            'prompt': prompt, 'model': llm.name, 'cached': cache_hit, 'chunks': len(results),
+            'suggestions': len(suggestions), 'insights': len(insights), 'guidance_chars': len(guidance or ''),
+            'result': {'suggestions': suggestions, 'insights': insights, 'guidance': guidance}})
+    except Exception as e:
+        logger.warning(f"Could not save query log: {e}")
 
     return {
         'suggestions': suggestions,
@@ -166,18 +578,25 @@ JSON with fields: suggestions (list), insights (list), guidance (string)
         'raw_llm_output': raw
     }
 
-async def reset_repo(repo_id: str, files: List[Dict[str, str]] | None = None, metadata: Dict[str, Any] | None = None):
+async def reset_repo(repo_id: str, files: List[Dict[str, str]] | None = None, metadata: Dict[str, Any] | None = None,
+                     file_filter: Dict[str, Any] | None = None):
     """Reset (upsert) repository index.
 
     If files are provided, this will upsert/update the existing index for the namespace
-    by calling `index_repo` (which merges new/updated chunks with existing vectors).
+    by calling `index_repo` (which merges new/updated chunks with existing vectors); the
+    file vectors are replaced, so files missing from `files` drop out of hierarchical retrieval.
     If no files are provided, the function is a no-op (keeps existing index intact).
     """
     if metadata is None:
         metadata = {}
     if files:
+        if FILE_VECTORS:
+            try:
+                delete_namespace(files_namespace(repo_id))
+            except Exception as e:
+                logger.warning(f"Could not clear file vectors of {repo_id}: {e}")
         # Delegate to index_repo which handles merging/upserting with existing vectors
-        return await index_repo(repo_id, files, metadata)
+        return await index_repo(repo_id, files, metadata, file_filter=file_filter)
     # nothing to do
     return {'status': 'no-op', 'repo_id': repo_id}
 
@@ -186,6 +605,7 @@ async def delete_repo(repo_id: str):
     """Delete all vectors for the given repo namespace."""
     try:
         res = delete_namespace(repo_id)
+        delete_namespace(files_namespace(repo_id))
     except Exception as e:
         return {'status': 'error', 'repo_id': repo_id, 'error': str(e)}
     # optionally remove metadata from DB (not implemented here)
@@ -0,0 +1,173 @@
+"""Admission control for the Flask routes.
+
+Each request class (query, index, reset) gets its own slots, carved out of
+ADMISSION_SLOTS by ADMISSION_WEIGHTS, so long synchronous index calls can no
+longer starve cheap queries. A request that finds its class busy waits in a
+bounded FIFO queue up to its class deadline; when the queue is full or the
+deadline passes it is rejected with a Retry-After estimated from the queue
+depth and recent service times.
+
+Environment:
+    ADMISSION_SLOTS            total slots (default MAX_CONCURRENCY, the limit of the old global semaphore);
+                               queries always get at least MAX_CONCURRENCY slots, so MAX_CONCURRENCY=2 gives 2/1/1
+    ADMISSION_WEIGHTS          share per class (default "query=2,index=1,reset=1"); each class gets at least 1
+    ADMISSION_QUEUE_<CLASS>    waiting requests per class (defaults: query 32, index 4, reset 4)
+    ADMISSION_TIMEOUT_<CLASS>  seconds a request may wait (defaults: query 5, index 30, reset 10)
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from service.utils import metrics
+
+DEFAULT_WEIGHTS = {'query': 2, 'index': 1, 'reset': 1}
+DEFAULT_QUEUE = {'query': 32, 'index': 4, 'reset': 4}
+DEFAULT_TIMEOUT = {'query': 5.0, 'index': 30.0, 'reset': 10.0}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; `retry_after` is in whole seconds."""
+
+    def __init__(self, cls: str, reason: str, retry_after: int):
+        super().__init__(f'{cls} capacity exhausted ({reason}), retry after {retry_after}s')
+        self.cls = cls
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Class:
+    def __init__(self, name: str, slots: int, queue_limit: int, timeout: float):
+        self.name = name
+        self.slots = slots
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.active = 0
+        self.waiters = deque()  # FIFO of threading.Event, one per waiting request
+        self.service_time = 1.0  # EWMA of seconds a slot is held
+
+
+class AdmissionScheduler:
+
+    def __init__(self, slots: Dict[str, int], queue_limits: Optional[Dict[str, int]] = None,
+                 timeouts: Optional[Dict[str, float]] = None):
+        self.lock = threading.Lock()
+        self.classes = {
+            name: _Class(name, max(1, n), (queue_limits or DEFAULT_QUEUE).get(name, 16),
+                         (timeouts or DEFAULT_TIMEOUT).get(name, 10.0))
+            for name, n in slots.items()
+        }
+
+    def _publish(self, c: _Class):
+        metrics.set_gauge('admission.active', c.active, cls=c.name)
+        metrics.set_gauge('admission.queued', len(c.waiters), cls=c.name)
+
+    def retry_after(self, cls: str) -> int:
+        """Seconds until a new request of `cls` would likely get a slot."""
+        c = self.classes[cls]
+        return max(1, math.ceil((len(c.waiters) + 1) / c.slots * c.service_time))
+
+    def _reject(self, c: _Class, reason: str):
+        metrics.incr('admission.rejected', cls=c.name, reason=reason)
+        raise AdmissionRejected(c.name, reason, self.retry_after(c.name))
+
+    def acquire(self, cls: str, timeout: Optional[float] = None):
+        c = self.classes[cls]
+        start = time.monotonic()
+        deadline = start + (c.timeout if timeout is None else timeout)
+        with self.lock:
+            if c.active < c.slots and not c.waiters:
+                c.active += 1
+                self._publish(c)
+                metrics.incr('admission.admitted', cls=cls)
+                metrics.observe('admission.wait', 0.0, cls=cls)
+                return
+            if len(c.waiters) >= c.queue_limit:
+                self._reject(c, 'queue_full')
+            event = threading.Event()
+            c.waiters.append(event)
+            self._publish(c)
+        # release() hands the slot over directly by setting the event of the oldest waiter
+        granted = event.wait(max(0.0, deadline - time.monotonic()))
+        with self.lock:
+            if not granted and not event.is_set():
+                c.waiters.remove(event)
+                self._publish(c)
+                self._reject(c, 'timeout')
+            self._publish(c)
+        metrics.incr('admission.admitted', cls=cls)
+        metrics.observe('admission.wait', time.monotonic() - start, cls=cls)
+
+    def release(self, cls: str, held: Optional[float] = None):
+        c = self.classes[cls]
+        with self.lock:
+            if held is not None:
+                c.service_time = 0.8 * c.service_time + 0.2 * held
+            if c.waiters:
+                # the slot passes to the next waiter; `active` is unchanged
+                c.waiters.popleft().set()
+            else:
+                c.active -= 1
+            self._publish(c)
+
+    @contextmanager
+    def admit(self, cls: str, timeout: Optional[float] = None):
+        """Hold a slot of `cls` for the duration of the block; raises AdmissionRejected."""
+        self.acquire(cls, timeout=timeout)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - start
+            metrics.observe('admission.service', held, cls=cls)
+            self.release(cls, held)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {name: {'slots': c.slots, 'active': c.active, 'queued': len(c.waiters),
+                           'queue_limit': c.queue_limit, 'timeout': c.timeout,
+                           'service_time': round(c.service_time, 3)}
+                    for name, c in self.classes.items()}
+
+
+def _parse_weights(raw: str) -> Dict[str, float]:
+    weights = dict(DEFAULT_WEIGHTS)
+    for part in raw.split(','):
+        if '=' in part:
+            name, value = part.split('=', 1)
+            weights[name.strip()] = float(value)
+    return weights
+
+
+def slots_from_weights(total: int, weights: Dict[str, float]) -> Dict[str, int]:
+    norm = sum(weights.values()) or 1.0
+    return {name: max(1, int(round(total * w / norm))) for name, w in weights.items()}
+
+
+_scheduler: Optional[AdmissionScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> AdmissionScheduler:
+    """Process-wide scheduler configured from the environment."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                # heavy work (index + reset) must not exceed what the old single semaphore allowed,
+                # and queries must not get fewer slots than it gave them
+                max_concurrency = int(os.getenv('MAX_CONCURRENCY', '2'))
+                total = int(os.getenv('ADMISSION_SLOTS', str(max_concurrency)))
+                weights = _parse_weights(os.getenv('ADMISSION_WEIGHTS', ''))
+                slots = slots_from_weights(total, weights)
+                if 'query' in slots:
+                    slots['query'] = max(slots['query'], max_concurrency)
+                queues = {n: int(os.getenv(f'ADMISSION_QUEUE_{n.upper()}', str(DEFAULT_QUEUE.get(n, 16)))) for n in slots}
+                timeouts = {n: float(os.getenv(f'ADMISSION_TIMEOUT_{n.upper()}', str(DEFAULT_TIMEOUT.get(n, 10.0))))
+                            for n in slots}
+                _scheduler = AdmissionScheduler(slots, queues, timeouts)
+    return _scheduler
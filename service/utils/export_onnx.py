@@ -0,0 +1,166 @@
+"""Export the embedding model to ONNX with pooling and normalization in the graph.
+
+The plain export (`last_hidden_state`, batch x seq x 384) makes ONNX Runtime
+copy the whole hidden-state tensor out of the session and leaves masked mean
+pooling to NumPy. The fused model adds the pooling and an L2 normalization
+to the graph and has one output, `sentence_embedding` (batch x 384, unit
+length), which `service/embedding/embedding_utils.py` detects and uses as is.
+
+    # export from Hugging Face (needs torch and transformers) and fuse
+    python -m service.utils.export_onnx --model-name sentence-transformers/all-MiniLM-L6-v2
+
+    # fuse an already exported model in place (needs only onnx)
+    python -m service.utils.export_onnx --fuse-only
+
+Run service/utils/quantize.py afterwards: the int8/fp16 variants keep the
+fused output.
+"""
+
+import argparse
+import os
+import sys
+
+from service.embedding.embedding_utils import DEFAULT_MODEL_PATH, POOLED_OUTPUT
+
+HIDDEN_OUTPUT = 'last_hidden_state'
+# denominators are clamped so all-padding rows and zero vectors do not divide by zero
+_EPS_COUNT = 1e-9
+_EPS_NORM = 1e-12
+
+
+def export_hf(model_name: str, dst: str, opset: int = 14):
+    """Export the transformer's last hidden state to `dst` (the layout fuse_pooling() expects)."""
+    try:
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+    except ImportError as e:
+        raise RuntimeError('exporting from Hugging Face requires `pip install torch transformers`') from e
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    dummy = tokenizer("print('hello world')", return_tensors='pt')
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy['input_ids'], dummy['attention_mask']),
+            dst,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=[HIDDEN_OUTPUT],
+            dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                          'attention_mask': {0: 'batch', 1: 'sequence'},
+                          HIDDEN_OUTPUT: {0: 'batch', 1: 'sequence'}},
+            opset_version=opset,
+        )
+    return dst
+
+
+def _opset(model) -> int:
+    return next((o.version for o in model.opset_import if o.domain in ('', 'ai.onnx')), 14)
+
+
+def fuse_pooling(model):
+    """Return `model` with masked mean pooling and L2 normalization appended to its hidden-state output.
+
+    The pooled sum is a batched MatMul of the mask (batch x 1 x seq) with the hidden
+    states, so no batch x seq x dim temporary is created.
+    """
+    import onnx
+    from onnx import TensorProto, helper
+
+    graph = model.graph
+    if any(o.name == POOLED_OUTPUT for o in graph.output):
+        return model
+    hidden = next((o for o in graph.output if o.name == HIDDEN_OUTPUT), graph.output[0])
+    if not any(i.name == 'attention_mask' for i in graph.input):
+        raise ValueError('the model has no attention_mask input to pool with')
+    dims = hidden.type.tensor_type.shape.dim
+    dim = dims[2].dim_value if len(dims) == 3 and dims[2].dim_value else None
+    opset = _opset(model)
+
+    nodes = []
+    consts = []
+
+    def node(op, inputs, name, **attrs):
+        nodes.append(helper.make_node(op, inputs, [name], name=f'pool_{name}', **attrs))
+        return name
+
+    def const(name, values, dtype=TensorProto.INT64):
+        consts.append(helper.make_tensor(name, dtype, [len(values)], values))
+        return name
+
+    def reduce_sum(x, axis, name):
+        # axes moved from an attribute to an input in opset 13
+        if opset >= 13:
+            return node('ReduceSum', [x, const(f'{name}_axes', [axis])], name, keepdims=1)
+        return node('ReduceSum', [x], name, axes=[axis], keepdims=1)
+
+    def unsqueeze(x, axis, name):
+        if opset >= 13:
+            return node('Unsqueeze', [x, const(f'{name}_axes', [axis])], name)
+        return node('Unsqueeze', [x], name, axes=[axis])
+
+    def squeeze(x, axis, name):
+        if opset >= 13:
+            return node('Squeeze', [x, const(f'{name}_axes', [axis])], name)
+        return node('Squeeze', [x], name, axes=[axis])
+
+    states = hidden.name
+    if hidden.type.tensor_type.elem_type != TensorProto.FLOAT:
+        states = node('Cast', [states], 'pool_states_f32', to=TensorProto.FLOAT)
+    mask = node('Cast', ['attention_mask'], 'pool_mask', to=TensorProto.FLOAT)
+    summed = squeeze(node('MatMul', [unsqueeze(mask, 1, 'pool_mask_row'), states], 'pool_sum3'), 1, 'pool_sum')
+    consts.append(helper.make_tensor('pool_eps_count', TensorProto.FLOAT, [], [_EPS_COUNT]))
+    consts.append(helper.make_tensor('pool_eps_norm', TensorProto.FLOAT, [], [_EPS_NORM]))
+    count = node('Max', [reduce_sum(mask, 1, 'pool_count_raw'), 'pool_eps_count'], 'pool_count')
+    mean = node('Div', [summed, count], 'pool_mean')
+    sq = reduce_sum(node('Mul', [mean, mean], 'pool_sq'), 1, 'pool_sq_sum')
+    norm = node('Max', [node('Sqrt', [sq], 'pool_norm_raw'), 'pool_eps_norm'], 'pool_norm')
+    node('Div', [mean, norm], POOLED_OUTPUT)
+
+    graph.node.extend(nodes)
+    graph.initializer.extend(consts)
+    # only the pooled vectors leave the session
+    del graph.output[:]
+    graph.output.append(helper.make_tensor_value_info(POOLED_OUTPUT, TensorProto.FLOAT, ['batch', dim]))
+    onnx.checker.check_model(model)
+    return model
+
+
+def fuse_file(src: str, dst: str):
+    try:
+        import onnx
+    except ImportError as e:
+        raise RuntimeError('fusing the pooling requires `pip install onnx`') from e
+    model = onnx.load(src)
+    fuse_pooling(model)
+    tmp = f'{dst}.tmp'
+    onnx.save(model, tmp)
+    os.replace(tmp, dst)
+    return dst
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=os.getenv('ONNX_MODEL_PATH', DEFAULT_MODEL_PATH),
+                        help='model to write (and, with --fuse-only, to read)')
+    parser.add_argument('--model-name', default=os.getenv('MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2'),
+                        help='Hugging Face model to export')
+    parser.add_argument('--fuse-only', action='store_true', help='fuse an existing export instead of exporting')
+    parser.add_argument('--no-fuse', action='store_true', help='export the plain last_hidden_state model')
+    parser.add_argument('--opset', type=int, default=14)
+    args = parser.parse_args(argv)
+
+    if args.fuse_only:
+        if not os.path.exists(args.model):
+            parser.error(f'source model not found: {args.model}')
+    else:
+        export_hf(args.model_name, args.model, opset=args.opset)
+        print(f'{args.model_name} exported to {args.model}')
+    if not args.no_fuse:
+        fuse_file(args.model, args.model)
+        print(f'pooling and normalization fused into {args.model} ({os.path.getsize(args.model) / 1e6:.1f} MB)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,206 @@
+"""Logging for the service.
 
+- `get_logger(name)` returns a stdlib logger. Records are handed to a
+  background thread through a bounded queue (QueueHandler/QueueListener), so
+  request threads never block on stream I/O; when the queue is full records
+  are dropped and counted (`log.dropped`) instead.
+- `log_event(logger, event, **fields)` writes a structured record. Fields are
+  redacted and truncated, and nothing is built when the level is disabled.
+  LOG_FORMAT=json prints one JSON object per line; the default text format
+  appends the fields as key=value.
+- `Sampler` lets through one of every LOG_SAMPLE_EVERY occurrences of a
+  high-volume event; `JobSummary` replaces per-item lines with one line per job.
+- `redact(obj)` masks secret-looking keys, shortens strings longer than
+  LOG_MAX_FIELD_CHARS and lists longer than LOG_MAX_ITEMS.
+
+Environment: LOG_LEVEL (default INFO), LOG_FORMAT (text|json), LOG_QUEUE
+(default on), LOG_QUEUE_SIZE (default 10000).
+"""
+
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from service.utils import metrics
+
+MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', '200'))
+MAX_ITEMS = int(os.getenv('LOG_MAX_ITEMS', '10'))
+SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', '1000'))
+
+_SECRET_KEY = re.compile(r'(pass(word)?|secret|token|api[_-]?key|authorization|credential|cookie)', re.I)
+# fields that carry user payloads (file contents, prompts, chunk text): logged as a size only
+_PAYLOAD_KEYS = {'content', 'text', 'texts', 'files', 'prompt'}
+
+
+def redact(obj: Any, depth: int = 0) -> Any:
+    """Copy of `obj` safe to log: secrets masked, payloads summarised, long values truncated."""
+    if depth > 4:
+        return '...'
+    if isinstance(obj, dict):
+        out = {}
+        for i, (k, v) in enumerate(obj.items()):
+            if i >= MAX_ITEMS * 4:
+                out['...'] = f'+{len(obj) - i} keys'
+                break
+            key = str(k)
+            if _SECRET_KEY.search(key):
+                out[key] = '[REDACTED]'
+            elif key in _PAYLOAD_KEYS and isinstance(v, (str, list, bytes)):
+                out[key] = f'<{len(v)} {"items" if isinstance(v, list) else "chars"}>'
+            else:
+                out[key] = redact(v, depth + 1)
+        return out
+    if isinstance(obj, (list, tuple)):
+        items = [redact(v, depth + 1) for v in obj[:MAX_ITEMS]]
+        if len(obj) > MAX_ITEMS:
+            items.append(f'... +{len(obj) - MAX_ITEMS} items')
+        return items
+    if isinstance(obj, bytes):
+        return f'<{len(obj)} bytes>'
+    if isinstance(obj, str) and len(obj) > MAX_FIELD_CHARS:
+        return obj[:MAX_FIELD_CHARS] + f'...(+{len(obj) - MAX_FIELD_CHARS} chars)'
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    return redact(str(obj), depth + 1)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s - %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f'{k}={json.dumps(v, default=str)}' for k, v in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        doc = {'ts': round(record.created, 3), 'level': record.levelname, 'logger': record.name,
+               'msg': record.getMessage()}
+        fields = getattr(record, 'fields', None)
+        if fields:
+            doc.update(fields)
+        if record.exc_info:
+            doc['exc'] = self.formatException(record.exc_info)
+        return json.dumps(doc, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: drops the record when the queue is full."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr('log.dropped')
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure():
+    """Install the root handler once, unless the root logger already has handlers; called on import."""
+    global _listener, _configured
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+        root = logging.getLogger()
+        if root.handlers:
+            # like logging.basicConfig: an embedding app (gunicorn, pytest) already set up logging
+            return
+        formatter = JsonFormatter() if os.getenv('LOG_FORMAT', 'text').lower() == 'json' else TextFormatter()
+        stream = logging.StreamHandler()
+        stream.setFormatter(formatter)
+        root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+        if os.getenv('LOG_QUEUE', 'on').lower() in ('0', 'off', 'false', 'no'):
+            root.addHandler(stream)
+            return
+        q = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+        root.addHandler(_QueueHandler(q))
+        _listener = logging.handlers.QueueListener(q, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,  # Set to INFO to reduce verbosity
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Simplified format
-)
 
 def get_logger(name: str):
     """Get a logger instance with the specified name."""
-    logger = logging.getLogger(name)
-    return logger
\ No newline at end of file
+    configure()
+    return logging.getLogger(name)
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields):
+    """Log `event` with structured `fields`; the fields are only redacted if the record is emitted."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': redact(fields)})
+
+
+class Sampler:
+    """Let through the first and then every `every`-th occurrence of each key."""
+
+    def __init__(self, every: int = SAMPLE_EVERY):
+        self.every = max(1, every)
+        self.counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def should_log(self, key: str) -> bool:
+        with self.lock:
+            n = self.counts.get(key, 0)
+            self.counts[key] = n + 1
+        return n % self.every == 0
+
+    def log(self, logger: logging.Logger, event: str, level: int = logging.INFO, **fields):
+        if logger.isEnabledFor(level) and self.should_log(event):
+            log_event(logger, event, level, sampled_every=self.every, **fields)
+
+
+class JobSummary:
+    """Counters and stage timings for one job, logged as a single line by `emit()`."""
+
+    def __init__(self, logger: logging.Logger, event: str, **fields):
+        self.logger = logger
+        self.event = event
+        self.fields: Dict[str, Any] = dict(fields)
+        self.stages: Dict[str, float] = {}
+        self.t0 = time.perf_counter()
+        self._mark = self.t0
+
+    def add(self, key: str, value=1):
+        self.fields[key] = self.fields.get(key, 0) + value
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def stage(self, name: str):
+        """Close the current stage: the time since the previous mark is recorded under `name`."""
+        now = time.perf_counter()
+        self.stages[name] = round(now - self._mark, 4)
+        self._mark = now
+
+    def emit(self, level: int = logging.INFO, **fields):
+        self.fields.update(fields)
+        log_event(self.logger, self.event, level, **self.fields, stages=self.stages,
+                  seconds=round(time.perf_counter() - self.t0, 4))
+
+
+configure()
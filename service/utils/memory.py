@@ -0,0 +1,208 @@
+"""Memory-budget governor.
+
+Compares current memory use with the container limit and tells the hot
+paths how hard to push:
+
+- `scale(n)` shrinks batch sizes (embedding micro-batches, upsert batches)
+  and `allowed_concurrency(n)` shrinks IndexWorker parallelism as usage
+  climbs from the high watermark towards the critical one
+- `maybe_collect()` runs `gc.collect()` only when usage is above the high
+  watermark (instead of after every batch)
+- `wait_for_headroom()` blocks new index jobs while usage is critical
+
+Usage is the cgroup working set (usage minus inactive file cache, which
+is what the OOM killer and the Render dashboard see) shared by all
+gunicorn workers; outside a container it falls back to this process' RSS.
+The limit is MEMORY_LIMIT_MB, else the cgroup limit, else physical RAM.
+Decisions are published to service.utils.metrics under `memory.*`.
+"""
+
+import gc
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from service.utils import metrics
+from service.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+_CGROUP_V2 = '/sys/fs/cgroup'
+_CGROUP_V1 = '/sys/fs/cgroup/memory'
+# cgroup v1 reports "no limit" as a huge page-aligned number
+_UNLIMITED = 1 << 60
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    if value == 'max':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _read_stat(path: str, key: str) -> int:
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, value = line.partition(' ')
+                if name == key:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def process_rss() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss is a peak, in KiB on Linux; better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def container_limit() -> Optional[int]:
+    env = os.environ.get('MEMORY_LIMIT_MB')
+    if env:
+        return int(float(env) * 1024 * 1024)
+    for path in (os.path.join(_CGROUP_V2, 'memory.max'), os.path.join(_CGROUP_V1, 'memory.limit_in_bytes')):
+        limit = _read_int(path)
+        if limit and limit < _UNLIMITED:
+            return limit
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def container_usage() -> int:
+    """Working set of the container, or this process' RSS outside a cgroup."""
+    usage = _read_int(os.path.join(_CGROUP_V2, 'memory.current'))
+    if usage is not None:
+        return max(0, usage - _read_stat(os.path.join(_CGROUP_V2, 'memory.stat'), 'inactive_file'))
+    usage = _read_int(os.path.join(_CGROUP_V1, 'memory.usage_in_bytes'))
+    if usage is not None:
+        return max(0, usage - _read_stat(os.path.join(_CGROUP_V1, 'memory.stat'), 'total_inactive_file'))
+    return process_rss()
+
+
+class MemoryGovernor:
+    def __init__(self, limit_bytes: Optional[int] = None, high: float = 0.75, critical: float = 0.9,
+                 usage_fn: Callable[[], int] = container_usage, check_interval: float = 0.25):
+        self.limit_bytes = limit_bytes if limit_bytes is not None else container_limit()
+        self.high = high
+        self.critical = critical
+        self.usage_fn = usage_fn
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self._last_check = 0.0
+        self._usage = 0
+        self._level = 'ok'
+
+    def usage(self) -> int:
+        """Current usage in bytes, re-read at most every `check_interval` seconds."""
+        now = time.monotonic()
+        with self.lock:
+            if now - self._last_check < self.check_interval:
+                return self._usage
+            self._last_check = now
+        usage = self.usage_fn()
+        with self.lock:
+            self._usage = usage
+        self._publish(usage)
+        return usage
+
+    def pressure(self) -> float:
+        """Usage as a fraction of the limit (0.0 when the limit is unknown)."""
+        usage = self.usage()
+        if not self.limit_bytes:
+            return 0.0
+        return usage / self.limit_bytes
+
+    def level(self) -> str:
+        p = self.pressure()
+        if p >= self.critical:
+            return 'critical'
+        if p >= self.high:
+            return 'high'
+        return 'ok'
+
+    def _publish(self, usage: int):
+        p = usage / self.limit_bytes if self.limit_bytes else 0.0
+        level = 'critical' if p >= self.critical else 'high' if p >= self.high else 'ok'
+        metrics.set_gauge('memory.usage_bytes', usage)
+        metrics.set_gauge('memory.limit_bytes', self.limit_bytes)
+        metrics.set_gauge('memory.pressure', round(p, 4))
+        metrics.set_gauge('memory.level', level)
+        if level != self._level:
+            logger.info(f'Memory level {self._level} -> {level} ({usage / 1e6:.0f}MB of {(self.limit_bytes or 0) / 1e6:.0f}MB)')
+            self._level = level
+
+    def scale(self, n: int, minimum: int = 1, what: str = 'batch') -> int:
+        """Shrink `n` linearly from the high watermark down to `minimum` at the critical one."""
+        p = self.pressure()
+        if p < self.high or n <= minimum:
+            return n
+        if p >= self.critical:
+            scaled = minimum
+        else:
+            frac = (self.critical - p) / (self.critical - self.high)
+            scaled = max(minimum, int(minimum + (n - minimum) * frac))
+        if scaled < n:
+            metrics.incr('memory.shrinks', what=what)
+            metrics.set_gauge('memory.scaled', scaled, what=what)
+        return scaled
+
+    def allowed_concurrency(self, n: int) -> int:
+        return self.scale(n, minimum=1, what='concurrency')
+
+    def maybe_collect(self) -> bool:
+        """Run a full GC pass only when memory is above the high watermark."""
+        if self.pressure() < self.high:
+            return False
+        gc.collect()
+        metrics.incr('memory.gc_runs')
+        # re-measure immediately so callers see the effect of the collection
+        with self.lock:
+            self._last_check = 0.0
+        return True
+
+    def wait_for_headroom(self, timeout: Optional[float] = None, poll: float = 0.5) -> bool:
+        """Block while usage is critical. Returns False if `timeout` expired first."""
+        if self.pressure() < self.critical:
+            return True
+        metrics.incr('memory.waits')
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.maybe_collect()
+            if self.pressure() < self.critical:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                metrics.incr('memory.wait_timeouts')
+                return False
+            time.sleep(poll)
+
+
+_governor: Optional[MemoryGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> MemoryGovernor:
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = MemoryGovernor(
+                    high=float(os.environ.get('MEMORY_HIGH_WATERMARK', '0.75')),
+                    critical=float(os.environ.get('MEMORY_CRITICAL_WATERMARK', '0.9')),
+                )
+    return _governor
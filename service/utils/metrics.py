@@ -0,0 +1,81 @@
+"""Minimal in-process metrics registry.
+
+Counters, gauges and latency/size summaries keyed by name plus optional
+labels. Everything is kept in memory per worker and exposed as JSON through
+`/rag/metrics`; summaries keep a bounded window of recent samples.
+"""
+
+import threading
+from collections import deque
+
+_WINDOW = 1024
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_samples = {}
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}={v}' for k, v in sorted(labels.items())) + '}'
+
+
+def incr(name: str, value=1, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def set_gauge(name: str, value, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _gauges[k] = value
+
+
+def observe(name: str, value: float, **labels):
+    k = _key(name, labels)
+    with _lock:
+        window = _samples.get(k)
+        if window is None:
+            window = _samples[k] = deque(maxlen=_WINDOW)
+        window.append(value)
+
+
+def percentile(values, pct: float):
+    """Nearest-rank percentile of `values` (pct in 0..100); None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[idx]
+
+
+def samples(name: str, **labels):
+    with _lock:
+        return list(_samples.get(_key(name, labels), ()))
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        windows = {k: list(v) for k, v in _samples.items()}
+    summaries = {}
+    for k, values in windows.items():
+        summaries[k] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'max': max(values) if values else None,
+        }
+    return {'counters': counters, 'gauges': gauges, 'summaries': summaries}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _samples.clear()
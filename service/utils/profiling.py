@@ -0,0 +1,195 @@
+"""On-demand profiling for a running worker.
+
+Everything is off unless PROFILING_ENABLED is true and ADMIN_TOKEN is set;
+when off, the only cost is one environment check per request.
+
+- `sample(seconds)` records the stacks of every other thread in this worker
+  every `interval` seconds from the calling thread and returns them in collapsed
+  form ("frame;frame;frame count", the input of flamegraph.pl/speedscope).
+  It sees all threads (request threads, the index worker, the fan-out pool)
+  at the cost of one `sys._current_frames()` walk per interval.
+- `RequestProfile` runs `cProfile` around a single request, in the request
+  thread only, and writes a `.pstats` file.
+- `tracemalloc_diff()` starts tracemalloc on the first call and afterwards
+  returns the allocation sites that grew most since the previous call.
+
+Profiles are written to PROFILE_DIR (default data/profiles).
+"""
+
+import cProfile
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from service.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+TOKEN_HEADER = 'X-Admin-Token'
+MAX_SAMPLE_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', '10'))
+
+
+def enabled() -> bool:
+    return os.getenv('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes') and bool(os.getenv('ADMIN_TOKEN'))
+
+
+def authorized(token: Optional[str]) -> bool:
+    expected = os.getenv('ADMIN_TOKEN')
+    return bool(expected and token) and hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8'))
+
+
+def profile_dir() -> str:
+    path = os.getenv('PROFILE_DIR') or os.path.join(os.getcwd(), 'data', 'profiles')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _output_path(kind: str, suffix: str) -> str:
+    return os.path.join(profile_dir(), f'{kind}-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}-'
+                                      f'{int(time.time() * 1000) % 1000:03d}{suffix}')
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+_sample_lock = threading.Lock()
+
+# innermost frames of threads that are blocked rather than working
+_IDLE_FRAMES = frozenset({('wait', 'threading.py'), ('_wait_for_tstate_lock', 'threading.py'), ('get', 'queue.py'),
+                          ('select', 'selectors.py'), ('accept', 'socket.py'), ('readinto', 'socket.py')})
+
+
+def _idle(frame) -> bool:
+    return (frame.f_code.co_name, os.path.basename(frame.f_code.co_filename)) in _IDLE_FRAMES
+
+
+def sample(seconds: float, interval: float = 0.005, idle: bool = False) -> Dict[str, Any]:
+    """Sample every thread's stack for `seconds`; returns collapsed stacks and the file they were saved to.
+
+    Threads parked in a lock or queue wait look identical on every sample, so stacks whose
+    innermost frame is a known wait are dropped unless `idle` is true.
+    """
+    seconds = max(0.0, min(seconds, MAX_SAMPLE_SECONDS))
+    if not _sample_lock.acquire(blocking=False):
+        raise RuntimeError('A sampling profile is already running in this worker')
+    try:
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks = Counter()
+        samples = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if not idle and _idle(frame):
+                    continue
+                stacks[f'{names.get(ident, ident)};{_collapse(frame)}'] += 1
+            samples += 1
+            time.sleep(interval)
+    finally:
+        _sample_lock.release()
+    collapsed = '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common())
+    path = _output_path('sample', '.collapsed')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(collapsed + '\n')
+    logger.info(f"Sampling profile: {samples} samples over {seconds:.1f}s saved to {path}")
+    return {'samples': samples, 'seconds': seconds, 'interval': interval, 'path': path, 'collapsed': collapsed}
+
+
+# cProfile installs a process-wide hook on Python 3.12+, so one request is profiled at a time
+_request_lock = threading.Lock()
+
+
+class RequestProfile:
+    """cProfile around one request; `start()` returns False when another request is being profiled."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.profiler = None
+        self.path = None
+
+    def start(self) -> bool:
+        if not _request_lock.acquire(blocking=False):
+            return False
+        self.profiler = cProfile.Profile()
+        try:
+            self.profiler.enable()
+        except Exception as e:
+            _request_lock.release()
+            self.profiler = None
+            logger.warning(f"Could not start request profile: {e}")
+            return False
+        return True
+
+    def stop(self) -> Optional[str]:
+        if self.profiler is None:
+            return None
+        try:
+            self.profiler.disable()
+            self.path = _output_path('request-' + self.name.strip('/').replace('/', '-'), '.pstats')
+            self.profiler.dump_stats(self.path)
+        except Exception as e:
+            logger.warning(f"Could not save request profile: {e}")
+        finally:
+            self.profiler = None
+            _request_lock.release()
+        return self.path
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def _take_snapshot():
+    # leave out the memory held by tracemalloc's own snapshots
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+def tracemalloc_diff(top: int = 20) -> Dict[str, Any]:
+    """Allocation sites that grew most since the previous call (the first call only starts tracing)."""
+    global _snapshot
+    with _snapshot_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _snapshot = _take_snapshot()
+            return {'started': True, 'frames': TRACEMALLOC_FRAMES}
+        current = _take_snapshot()
+        previous, _snapshot = _snapshot, current
+    stats = current.compare_to(previous, 'traceback') if previous is not None else []
+    growth: List[Dict[str, Any]] = []
+    for stat in stats[:max(0, top)]:
+        growth.append({
+            'size_diff': stat.size_diff,
+            'size': stat.size,
+            'count_diff': stat.count_diff,
+            'traceback': [f'{f.filename}:{f.lineno}' for f in stat.traceback],
+        })
+    traced, peak = tracemalloc.get_traced_memory()
+    return {'started': False, 'traced_bytes': traced, 'peak_bytes': peak, 'top': growth}
+
+
+def tracemalloc_stop() -> bool:
+    global _snapshot
+    with _snapshot_lock:
+        was_tracing = tracemalloc.is_tracing()
+        tracemalloc.stop()
+        _snapshot = None
+    return was_tracing
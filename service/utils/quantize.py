@@ -0,0 +1,67 @@
+"""Produce reduced-precision variants of the exported embedding model.
+
+Reads the fp32 model exported with service/utils/export_onnx.py and
+writes the variants selected with EMBEDDING_MODEL_VARIANT next to it:
+
+    python -m service.utils.quantize --int8            # model.int8.onnx
+    python -m service.utils.quantize --int8 --fp16     # also model.fp16.onnx
+
+int8 uses ONNX Runtime dynamic quantization (weights quantized offline,
+activations quantized per batch at run time); it is the fastest option on
+CPU-only nodes. fp16 halves the model size but usually does not speed up
+CPU inference; it needs the `onnx` package.
+"""
+
+import argparse
+import os
+import sys
+
+from service.embedding.embedding_utils import DEFAULT_MODEL_PATH, variant_model_path
+
+
+def quantize_int8(src: str, dst: str, per_channel: bool = False):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8, per_channel=per_channel)
+    return dst
+
+
+def convert_fp16(src: str, dst: str):
+    try:
+        import onnx
+    except ImportError as e:
+        raise RuntimeError('fp16 conversion requires `pip install onnx`') from e
+    # the converter bundled with onnxruntime also fixes up Cast nodes
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+
+    model = onnx.load(src)
+    # keep fp32 inputs/outputs so callers do not need to change
+    model_fp16 = convert_float_to_float16(model, keep_io_types=True)
+    onnx.save(model_fp16, dst)
+    return dst
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=os.getenv('ONNX_MODEL_PATH', DEFAULT_MODEL_PATH), help='fp32 source model')
+    parser.add_argument('--int8', action='store_true', help='write the dynamically int8-quantized variant')
+    parser.add_argument('--fp16', action='store_true', help='write the fp16 variant')
+    parser.add_argument('--per-channel', action='store_true', help='per-channel int8 weights (slower, slightly more accurate)')
+    args = parser.parse_args(argv)
+
+    if not (args.int8 or args.fp16):
+        parser.error('choose at least one of --int8/--fp16')
+    if not os.path.exists(args.model):
+        parser.error(f'source model not found: {args.model}')
+
+    if args.int8:
+        dst = quantize_int8(args.model, variant_model_path(args.model, 'int8'), per_channel=args.per_channel)
+        print(f'int8 model written to {dst} ({os.path.getsize(dst) / 1e6:.1f} MB)')
+    if args.fp16:
+        dst = convert_fp16(args.model, variant_model_path(args.model, 'fp16'))
+        print(f'fp16 model written to {dst} ({os.path.getsize(dst) / 1e6:.1f} MB)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""Retries, deadlines and circuit breakers for backend calls.
+
+- `retry` / `async_retry`: exponential backoff with full jitter (sleep a
+  uniform random time up to the backoff cap), never sleeping past the
+  current deadline. `async_retry` awaits instead of blocking the loop.
+- Deadlines: `deadline_scope(seconds)` sets a per-request budget in a
+  contextvar, so every backend call below `process_rag` / `index_repo`
+  sees it through `remaining()` without extra parameters. Work submitted to
+  thread pools must be wrapped with `contextvars.copy_context().run`.
+- Circuit breakers, one per backend (`get_breaker('pinecone')`, 'mongo',
+  'onnx', 'gemini:<model>'): after BREAKER_FAILURES consecutive failures a
+  breaker opens and calls fail fast with CircuitOpenError for
+  BREAKER_RESET_SECONDS; then a single trial call decides whether it closes
+  again. Callers can serve cached results on CircuitOpenError. States are
+  reported by `breaker_states()` (in /rag/health) and as metrics gauges.
+- `retry(..., transient=fn)` retries and counts towards the breaker only the
+  errors `fn` accepts (connection drops, timeouts, 5xx); a client error such
+  as a bad request is re-raised at once and leaves the breaker alone.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple, Type
+
+from service.utils import metrics
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline budget ran out."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The backend's circuit breaker is open; the call was not attempted."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f'{name} is unavailable (circuit open, retry in {retry_in:.0f}s)')
+        self.name = name
+        self.retry_in = retry_in
+
+
+# ---- deadlines -------------------------------------------------------------
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('deadline', default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """Run the block with a deadline `seconds` from now (None or <= 0: no new deadline).
+
+    A nested scope can only shorten the deadline already in effect.
+    """
+    current = _deadline.get()
+    if seconds is None or seconds <= 0:
+        yield current
+        return
+    new = time.monotonic() + seconds
+    if current is not None:
+        new = min(new, current)
+    token = _deadline.set(new)
+    try:
+        yield new
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current deadline, or None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(what: str = 'request'):
+    left = remaining()
+    if left is not None and left <= 0:
+        metrics.incr('resilience.deadline_exceeded', what=what)
+        raise DeadlineExceeded(f'deadline exceeded before {what}')
+
+
+# ---- circuit breakers ------------------------------------------------------
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        self.state = state
+        metrics.set_gauge('breaker.state', {self.CLOSED: 0, self.HALF_OPEN: 1, self.OPEN: 2}[state], backend=self.name)
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self.lock:
+            if self.state == self.OPEN:
+                wait = self.opened_at + self.reset_timeout - time.monotonic()
+                if wait > 0:
+                    metrics.incr('breaker.rejected', backend=self.name)
+                    raise CircuitOpenError(self.name, wait)
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self.trial_in_flight:
+                    metrics.incr('breaker.rejected', backend=self.name)
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.trial_in_flight = False
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_ignored(self):
+        """The call failed for a reason that says nothing about the backend's health."""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    metrics.incr('breaker.opened', backend=self.name)
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def call(self, fn, *args, transient: Optional[Callable[[BaseException], bool]] = None, **kwargs):
+        """Run `fn` if the breaker allows it; errors `transient` rejects are not counted as failures."""
+        self.allow()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record_error(e, transient)
+            raise
+        self.record_success()
+        return result
+
+    def record_error(self, error: BaseException, transient: Optional[Callable[[BaseException], bool]]):
+        if transient is None or transient(error):
+            self.record_failure()
+        else:
+            self.record_ignored()
+
+    def snapshot(self) -> Dict[str, object]:
+        with self.lock:
+            info = {'state': self.state, 'consecutive_failures': self.failures}
+            if self.state == self.OPEN:
+                info['retry_in'] = round(max(0.0, self.opened_at + self.reset_timeout - time.monotonic()), 1)
+            return info
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(
+                    name,
+                    failure_threshold=int(os.getenv('BREAKER_FAILURES', '5')),
+                    reset_timeout=float(os.getenv('BREAKER_RESET_SECONDS', '30')))
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict[str, object]]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
+
+
+# ---- retries ---------------------------------------------------------------
+
+def _backoff(attempt: int, delay: float, backoff: float, max_delay: float) -> float:
+    """Full jitter: uniform in [0, min(max_delay, delay * backoff**attempt)]."""
+    return random.uniform(0, min(max_delay, delay * backoff ** attempt))
+
+
+def _next_sleep(name: str, attempt: int, delay: float, backoff: float, max_delay: float) -> Optional[float]:
+    """Sleep before the next attempt, or None when the deadline leaves no room for one."""
+    sleep = _backoff(attempt, delay, backoff, max_delay)
+    left = remaining()
+    if left is not None and left <= sleep:
+        return None
+    metrics.incr('resilience.retries', fn=name)
+    return sleep
+
+
+def retry(exception_types: Tuple[Type[BaseException], ...] = (Exception,), tries: int = 3, delay: float = 0.5,
+          backoff: float = 2.0, max_delay: float = 10.0, breaker: Optional[str] = None,
+          transient: Optional[Callable[[BaseException], bool]] = None):
+    """Retry a sync function with jittered backoff, within the current deadline.
+
+    With `breaker`, every attempt goes through that backend's circuit breaker;
+    CircuitOpenError and DeadlineExceeded are never retried. With `transient`,
+    errors it rejects are neither retried nor counted by the breaker.
+    """
+    def decorator(func):
+        name = func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(max(1, tries)):
+                check_deadline(name)
+                try:
+                    if breaker:
+                        return get_breaker(breaker).call(func, *args, transient=transient, **kwargs)
+                    return func(*args, **kwargs)
+                except (CircuitOpenError, DeadlineExceeded):
+                    raise
+                except exception_types as e:
+                    if transient is not None and not transient(e):
+                        raise
+                    sleep = _next_sleep(name, attempt, delay, backoff, max_delay) if attempt + 1 < tries else None
+                    if sleep is None:
+                        raise
+                    time.sleep(sleep)
+            raise RuntimeError(f'Retries exhausted for {name}')
+        return wrapper
+    return decorator
+
+
+def async_retry(exception_types: Tuple[Type[BaseException], ...] = (Exception,), tries: int = 3, delay: float = 0.5,
+                backoff: float = 2.0, max_delay: float = 10.0, breaker: Optional[str] = None,
+                transient: Optional[Callable[[BaseException], bool]] = None):
+    """`retry` for coroutine functions; waits with asyncio.sleep so the loop keeps running."""
+    def decorator(func):
+        name = func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(max(1, tries)):
+                check_deadline(name)
+                b = get_breaker(breaker) if breaker else None
+                try:
+                    if b is not None:
+                        b.allow()
+                    try:
+                        result = await func(*args, **kwargs)
+                    except Exception as e:
+                        if b is not None:
+                            b.record_error(e, transient)
+                        raise
+                    if b is not None:
+                        b.record_success()
+                    return result
+                except (CircuitOpenError, DeadlineExceeded):
+                    raise
+                except exception_types as e:
+                    if transient is not None and not transient(e):
+                        raise
+                    sleep = _next_sleep(name, attempt, delay, backoff, max_delay) if attempt + 1 < tries else None
+                    if sleep is None:
+                        raise
+                    await asyncio.sleep(sleep)
+            raise RuntimeError(f'Retries exhausted for {name}')
+        return wrapper
+    return decorator
@@ -0,0 +1,236 @@
+"""Durable records for background index jobs.
+
+A job record holds the job's status and its progress checkpoint: how many
+of the (filtered) input files are fully indexed (`files_done`) and how many
+upsert batches of the file group in progress were written (`batches_done`).
+The input files are stored next to the record, so after a crash or deploy
+`IndexWorker.resume()` picks the job up from its last checkpoint instead of
+starting over. Cancellation (`DELETE /rag/jobs/<id>`) sets
+`cancel_requested`; the running job sees it at the next checkpoint.
+
+Records live in Mongo (`index_jobs`, inputs in `index_job_files`) when
+MONGODB_URI is configured, else as JSON files under JOB_STORE_PATH
+(default data/jobs); JOB_STORE=mongo|local forces one. A worker process owns
+a job through a lease refreshed at every checkpoint and, while the job is
+queued or running there, by a periodic heartbeat; a lease older than
+JOB_LEASE_SECONDS lets another process resume the job.
+"""
+
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from service.db import database
+from service.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+UNFINISHED = ('queued', 'waiting', 'running')
+FINISHED = ('completed', 'failed', 'cancelled')
+LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '120'))
+OWNER = f'{socket.gethostname()}:{os.getpid()}'
+# fields whose update must not wait for the next batched checkpoint write
+_IMMEDIATE = frozenset({'status', 'cancel_requested'})
+
+
+class JobCancelled(Exception):
+    """Raised at a checkpoint when the job was cancelled."""
+
+
+class JobInterrupted(Exception):
+    """Raised at a checkpoint when the worker is shutting down; the job resumes elsewhere or later."""
+
+
+class JobLost(Exception):
+    """Raised before a job starts when another process holds its lease (it resumed the job)."""
+
+
+class LocalJobStore:
+    """One JSON record and one JSON input file per job in a directory."""
+
+    name = 'local'
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _file(self, job_id: str, suffix: str = '.json') -> str:
+        return os.path.join(self.path, job_id + suffix)
+
+    @contextmanager
+    def _locked(self):
+        # records are shared by every worker process on this host
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock, open(os.path.join(self.path, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._file(job_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, record: Dict[str, Any]):
+        target = self._file(record['job_id'])
+        tmp = f'{target}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(record, f, default=str)
+        os.replace(tmp, target)
+
+    def create(self, record: Dict[str, Any], files: List[Dict[str, Any]]):
+        with self._locked():
+            tmp = self._file(record['job_id'], '.files.json.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(files, f)
+            os.replace(tmp, self._file(record['job_id'], '.files.json'))
+            self._write(record)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._read(job_id)
+
+    def update(self, job_id: str, **fields):
+        with self._locked():
+            record = self._read(job_id)
+            if record is not None:
+                record.update(fields)
+                self._write(record)
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.path):
+            return []
+        out = []
+        for name in os.listdir(self.path):
+            if name.endswith('.json') and not name.endswith('.files.json'):
+                record = self._read(name[:-5])
+                if record and record.get('status') in UNFINISHED:
+                    out.append(record)
+        return sorted(out, key=lambda r: r.get('created_at', 0))
+
+    def claim(self, job_id: str, owner: str) -> bool:
+        now = time.time()
+        with self._locked():
+            record = self._read(job_id)
+            if record is None:
+                return False
+            if record.get('owner') not in (None, owner) and record.get('heartbeat', 0) >= now - LEASE_SECONDS:
+                return False
+            record.update(owner=owner, heartbeat=now)
+            self._write(record)
+            return True
+
+    def recent(self, repo_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.path):
+            return []
+        records = []
+        for name in os.listdir(self.path):
+            if name.endswith('.json') and not name.endswith('.files.json'):
+                record = self._read(name[:-5])
+                if record and record.get('repo_id') == repo_id:
+                    records.append({k: record.get(k) for k in database.JOB_SUMMARY_FIELDS if k != '_id'})
+        records.sort(key=lambda r: r.get('created_at') or 0, reverse=True)
+        return records[:max(1, limit)]
+
+    def load_files(self, job_id: str) -> List[Dict[str, Any]]:
+        with open(self._file(job_id, '.files.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def drop_files(self, job_id: str):
+        try:
+            os.remove(self._file(job_id, '.files.json'))
+        except OSError:
+            pass
+
+
+class MongoJobStore:
+    """Job records in `index_jobs`, inputs in `index_job_files` (see service/db/database.py)."""
+
+    name = 'mongo'
+
+    def create(self, record: Dict[str, Any], files: List[Dict[str, Any]]):
+        database.save_index_job_files(record['job_id'], files)
+        database.create_index_job(record)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return database.get_index_job(job_id)
+
+    def update(self, job_id: str, **fields):
+        # progress checkpoints are batched; status changes and cancellation are written at once
+        database.update_index_job(job_id, fields, defer=not _IMMEDIATE.intersection(fields))
+
+    def recent(self, repo_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        return database.recent_index_jobs(repo_id, limit)
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        return sorted(database.find_index_jobs(UNFINISHED), key=lambda r: r.get('created_at', 0))
+
+    def claim(self, job_id: str, owner: str) -> bool:
+        now = time.time()
+        return database.claim_index_job(job_id, owner, now, now - LEASE_SECONDS)
+
+    def load_files(self, job_id: str) -> List[Dict[str, Any]]:
+        return database.load_index_job_files(job_id)
+
+    def drop_files(self, job_id: str):
+        database.delete_index_job_files(job_id)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_job_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                kind = os.getenv('JOB_STORE', 'auto').lower()
+                if kind == 'mongo' or (kind == 'auto' and database.get_db() is not None):
+                    _store = MongoJobStore()
+                else:
+                    _store = LocalJobStore(os.getenv('JOB_STORE_PATH') or os.path.join(os.getcwd(), 'data', 'jobs'))
+    return _store
+
+
+class IndexCheckpoint:
+    """Progress reporter handed to `index_repo` for one group of files of a job."""
+
+    def __init__(self, store, job_id: str, skip_batches: int = 0, cancelled: Optional[threading.Event] = None,
+                 stopping: Optional[threading.Event] = None):
+        self.store = store
+        self.job_id = job_id
+        self.skip_batches = skip_batches
+        self.cancelled = cancelled or threading.Event()
+        self.stopping = stopping or threading.Event()
+
+    def check_cancelled(self):
+        if self.stopping.is_set():
+            raise JobInterrupted(self.job_id)
+        if self.cancelled.is_set():
+            raise JobCancelled(self.job_id)
+        try:
+            record = self.store.get(self.job_id)
+        except Exception as e:
+            logger.warning(f"Could not read job {self.job_id}: {e}")
+            return
+        if record and record.get('cancel_requested'):
+            # cancelled through another worker process
+            self.cancelled.set()
+            raise JobCancelled(self.job_id)
+
+    def batch_done(self, batches_done: int, chunks: int):
+        try:
+            self.store.update(self.job_id, batches_done=batches_done, heartbeat=time.time(), owner=OWNER)
+        except Exception as e:
+            # keep indexing; a restart would redo this batch (upserts are idempotent)
+            logger.warning(f"Could not checkpoint job {self.job_id}: {e}")
+        self.check_cancelled()
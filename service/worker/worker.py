@@ -1,3 +1,4 @@
+import os
 import threading
 import queue
 import time
@@ -6,31 +7,67 @@ import logging
 import inspect
 from typing import Optional
 
-from service.piplines.rag_pipeline import index_repo
+from service.piplines.rag_pipeline import delete_excluded_files, excluded_paths, index_repo
+from service.piplines.file_filter import FileFilter
+from service.embedding import embedding_utils
 from service.db import database
+from service.utils.memory import get_governor
+from service.utils import metrics
+from service.worker.jobs import (FINISHED, LEASE_SECONDS, OWNER, IndexCheckpoint, JobCancelled, JobInterrupted,
+                                 JobLost, get_job_store)
 
 logger = logging.getLogger(__name__)
 
+# files indexed per checkpointed step, and attempts before a job is marked failed
+JOB_FILE_BATCH = int(os.getenv('JOB_FILE_BATCH', '50'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# how often to look for jobs abandoned by dead workers (their lease expired)
+JOB_RESUME_INTERVAL = float(os.getenv('JOB_RESUME_INTERVAL', '60'))
+# how often the leases of jobs queued or running in this process are refreshed
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', str(LEASE_SECONDS / 4)))
+
+_TOTALS = ('chunk_count', 'upserts', 'reused', 'refreshed', 'deleted_stale', 'file_vectors', 'skipped_batches')
+
 
 class IndexWorker:
-    def __init__(self, num_workers=1):
+    def __init__(self, num_workers=1, store=None):
         self.q = queue.Queue()
         self.status = {}  # job_id -> {'status': str, 'meta': ...}
         self.threads = []
         self.running = False
         self.num_workers = num_workers
+        # jobs currently running; capped by the memory governor
+        self._active = 0
+        self._active_cond = threading.Condition()
+        self.store = store
+        self._cancel = {}  # job_id -> threading.Event
+        self._stopping = threading.Event()
+
+    def _store(self):
+        if self.store is None:
+            self.store = get_job_store()
+        return self.store
 
     def start(self):
         if self.running:
             return
         self.running = True
+        self._stopping.clear()
         for _ in range(self.num_workers):
             t = threading.Thread(target=self._worker_loop, daemon=True)
             t.start()
             self.threads.append(t)
+        t = threading.Thread(target=self._resume_loop, daemon=True)
+        t.start()
+        t = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        t.start()
 
     def stop(self):
         self.running = False
+        # running jobs stop at their next checkpoint and hand their lease back
+        self._stopping.set()
+        with self._active_cond:
+            self._active_cond.notify_all()
         # put None sentinel for each thread
         for _ in range(len(self.threads)):
             self.q.put(None)
@@ -42,66 +79,275 @@ class IndexWorker:
             except Exception:
                 pass
 
-    def submit(self, repo_id: str, files, metadata=None) -> str:
+    def submit(self, repo_id: str, files, metadata=None, file_filter=None) -> str:
         job_id = str(uuid.uuid4())
-        self.status[job_id] = {'status': 'queued', 'repo_id': repo_id, 'result': None, 'error': None, 'created_at': time.time()}
-        self.q.put((job_id, repo_id, files, metadata))
-        # Optionally persist job to DB
+        now = time.time()
+        self.status[job_id] = {'status': 'queued', 'repo_id': repo_id, 'result': None, 'error': None, 'created_at': now,
+                               'total_files': len(files), 'files_done': 0}
+        self._cancel[job_id] = threading.Event()
+        record = {'job_id': job_id, 'repo_id': repo_id, 'status': 'queued', 'metadata': metadata or {},
+                  'file_filter': file_filter, 'total_files': len(files), 'files_done': 0, 'batches_done': 0,
+                  'attempts': 0, 'created_at': now, 'updated_at': now, 'owner': OWNER, 'heartbeat': now,
+                  'cancel_requested': False}
         try:
-            database.save_index_job(job_id, repo_id, metadata or {})
-        except Exception:
-            pass
+            self._store().create(record, files)
+        except Exception as e:
+            logger.warning(f"Could not persist index job {job_id}, it will not survive a restart: {e}")
+        self.q.put((job_id, repo_id, files, metadata, file_filter))
         return job_id
 
     def get_status(self, job_id: str):
-        return self.status.get(job_id)
+        status = self.status.get(job_id)
+        if status is not None:
+            return status
+        # a job submitted to (or resumed by) another worker process
+        try:
+            record = self._store().get(job_id)
+        except Exception:
+            return None
+        if record is None:
+            return None
+        return {k: record.get(k) for k in ('status', 'repo_id', 'result', 'error', 'created_at', 'total_files',
+                                           'files_done')}
+
+    def cancel(self, job_id: str):
+        """Cancel a queued or running job; returns its status, or None for an unknown job.
+
+        A running job stops at its next checkpoint (after the current upsert batch).
+        """
+        status = self.get_status(job_id)
+        if status is None or status['status'] in FINISHED:
+            return status
+        self._cancel.setdefault(job_id, threading.Event()).set()
+        new_status = 'cancelled' if status['status'] == 'queued' else 'cancelling'
+        try:
+            fields = {'cancel_requested': True, 'updated_at': time.time()}
+            if new_status == 'cancelled' and job_id in self.status:
+                fields['status'] = 'cancelled'
+            self._store().update(job_id, **fields)
+        except Exception as e:
+            logger.warning(f"Could not record cancellation of job {job_id}: {e}")
+        if job_id in self.status:
+            self.status[job_id]['status'] = new_status
+        return {**status, 'status': new_status}
+
+    def resume(self) -> int:
+        """Queue unfinished jobs from the job store whose owner is gone (lease expired or released)."""
+        try:
+            records = self._store().unfinished()
+        except Exception as e:
+            logger.warning(f"Could not list unfinished index jobs: {e}")
+            return 0
+        resumed = 0
+        for record in records:
+            job_id = record['job_id']
+            if job_id in self.status and self.status[job_id]['status'] not in FINISHED:
+                continue
+            try:
+                if not self._store().claim(job_id, OWNER):
+                    continue
+                files = self._store().load_files(job_id)
+            except Exception as e:
+                logger.warning(f"Could not resume index job {job_id}: {e}")
+                continue
+            self.status[job_id] = {'status': 'queued', 'repo_id': record['repo_id'], 'result': None, 'error': None,
+                                   'created_at': record.get('created_at'), 'total_files': record.get('total_files'),
+                                   'files_done': record.get('files_done', 0), 'resumed': True}
+            self._cancel[job_id] = threading.Event()
+            self.q.put((job_id, record['repo_id'], files, record.get('metadata'), record.get('file_filter')))
+            resumed += 1
+        if resumed:
+            logger.info(f"Resumed {resumed} index job(s) from their last checkpoint")
+            metrics.incr('index_worker.resumed', resumed)
+        return resumed
+
+    def _resume_loop(self):
+        self.resume()
+        while not self._stopping.wait(JOB_RESUME_INTERVAL):
+            self.resume()
+
+    def heartbeat(self) -> int:
+        """Refresh the lease of every job queued, waiting or running here; returns the number kept.
+
+        Without it a job waiting in this process's queue (or for a slot) longer than
+        JOB_LEASE_SECONDS would look abandoned and be resumed by another process too.
+        """
+        kept = 0
+        for job_id, status in list(self.status.items()):
+            if status['status'] not in ('queued', 'waiting', 'running', 'cancelling'):
+                continue
+            try:
+                if self._store().claim(job_id, OWNER):
+                    kept += 1
+                else:
+                    logger.warning(f"Lost the lease of index job {job_id} to another worker")
+            except Exception as e:
+                logger.warning(f"Could not refresh the lease of index job {job_id}: {e}")
+        return kept
+
+    def _heartbeat_loop(self):
+        while not self._stopping.wait(JOB_HEARTBEAT_INTERVAL):
+            self.heartbeat()
+
+    def _claim(self, job_id: str):
+        """Raise JobLost unless this process (still) holds the job's lease."""
+        try:
+            claimed = self._store().claim(job_id, OWNER)
+        except Exception as e:
+            # the store is unreachable: nobody else can have resumed the job through it
+            logger.warning(f"Could not confirm the lease of index job {job_id}: {e}")
+            return
+        if not claimed:
+            raise JobLost(job_id)
+
+    def _acquire_slot(self, job_id: str):
+        """Wait until the governor allows another concurrent job and memory has headroom."""
+        governor = get_governor()
+        with self._active_cond:
+            while self.running and self._active >= governor.allowed_concurrency(self.num_workers):
+                self.status[job_id]['status'] = 'waiting'
+                self._active_cond.wait(timeout=0.5)
+            self._active += 1
+            metrics.set_gauge('index_worker.active', self._active)
+        # hold the job (rather than risk an OOM kill) while memory is critical
+        while self.running and not governor.wait_for_headroom(timeout=1.0):
+            self.status[job_id]['status'] = 'waiting'
+
+    def _release_slot(self):
+        with self._active_cond:
+            self._active -= 1
+            metrics.set_gauge('index_worker.active', self._active)
+            self._active_cond.notify_all()
+
+    def _progress(self, job_id: str, **fields):
+        self.status[job_id].update({k: v for k, v in fields.items() if k in ('status', 'files_done', 'total_files')})
+        now = time.time()
+        try:
+            self._store().update(job_id, updated_at=now, heartbeat=now, owner=OWNER, **fields)
+        except Exception as e:
+            logger.warning(f"Could not checkpoint index job {job_id}: {e}")
+
+    def _run_index(self, repo_id, files, metadata, **kwargs):
+        # call index_repo (async) from sync thread
+        import asyncio
+        from functools import partial
+        loop = asyncio.new_event_loop()
+        try:
+            # support both async and sync implementations of index_repo:
+            if inspect.iscoroutinefunction(index_repo):
+                return loop.run_until_complete(index_repo(repo_id, files, metadata or {}, **kwargs))
+            # run synchronous index_repo in a thread executor so run_until_complete
+            # always receives an awaitable
+            func = partial(index_repo, repo_id, files, metadata or {}, **kwargs)
+            return loop.run_until_complete(loop.run_in_executor(None, func))
+        finally:
+            try:
+                loop.close()
+            except Exception:
+                pass
+
+    def _run_job(self, job_id, repo_id, files, metadata, file_filter):
+        """Index `files` in groups of JOB_FILE_BATCH, checkpointing after every upsert batch and group."""
+        self._claim(job_id)
+        try:
+            record = self._store().get(job_id) or {}
+        except Exception:
+            record = {}
+        files_done = record.get('files_done', 0)
+        batches_done = record.get('batches_done', 0)
+        totals = {k: 0 for k in _TOTALS}
+        totals.update(record.get('totals') or {})
+        # filter once for the whole job so duplicates are found across groups; the same
+        # input and settings give the same list, so a resumed job's offsets still apply
+        filter_report = None
+        pre_filter = FileFilter.from_env(file_filter)
+        if pre_filter is not None:
+            received = files
+            files, filter_report = pre_filter.apply(files)
+            # the groups below run unfiltered and only see the kept paths
+            delete_excluded_files(repo_id, excluded_paths(received, files))
+        self._progress(job_id, status='running', total_files=len(files), attempts=record.get('attempts', 0) + 1)
+        cancelled = self._cancel.setdefault(job_id, threading.Event())
+        for start in range(files_done, len(files), max(1, JOB_FILE_BATCH)):
+            group = files[start:start + max(1, JOB_FILE_BATCH)]
+            checkpoint = IndexCheckpoint(self._store(), job_id, skip_batches=batches_done, cancelled=cancelled,
+                                         stopping=self._stopping)
+            checkpoint.check_cancelled()
+            res = self._run_index(repo_id, group, metadata, file_filter={'enabled': False}, checkpoint=checkpoint)
+            for k in _TOTALS:
+                totals[k] += int(res.get(k) or 0)
+            batches_done = 0
+            self._progress(job_id, files_done=start + len(group), batches_done=0, totals=totals)
+        try:
+            database.save_index_metadata(repo_id, {'file_count': len(files), 'chunk_count': totals['chunk_count'],
+                                                   'metadata': metadata or {},
+                                                   'embedding_version': embedding_utils.embedding_version()})
+        except Exception as e:
+            logger.warning(f"Could not save index metadata for {repo_id}: {e}")
+        return {'repo_id': repo_id, 'file_count': len(files), **totals, 'resumed_from_file': files_done,
+                'filter_report': filter_report}
+
+    def _finish(self, job_id: str, drop_files: bool = True, **fields):
+        self._progress(job_id, finished_at=time.time(), **fields)
+        if drop_files:
+            try:
+                self._store().drop_files(job_id)
+            except Exception:
+                pass
 
     def _worker_loop(self):
         while self.running:
             item = self.q.get()
             if item is None:
                 break
-            job_id, repo_id, files, metadata = item
+            job_id, repo_id, files, metadata, file_filter = item
+            if self._cancel.get(job_id) is not None and self._cancel[job_id].is_set():
+                self._finish(job_id, status='cancelled')
+                continue
+            self._acquire_slot(job_id)
+            self.status[job_id]['status'] = 'running'
             try:
-                # call index_repo (async) from sync thread
-                import asyncio
-                from functools import partial
-                loop = asyncio.new_event_loop()
-                try:
-                    # support both async and sync implementations of index_repo:
-                    if inspect.iscoroutinefunction(index_repo):
-                        coro = index_repo(repo_id, files, metadata or {})
-                        res = loop.run_until_complete(coro)
-                    else:
-                        # run synchronous index_repo in a thread executor so run_until_complete
-                        # always receives an awaitable
-                        func = partial(index_repo, repo_id, files, metadata or {})
-                        res = loop.run_until_complete(loop.run_in_executor(None, func))
-                finally:
-                    try:
-                        loop.stop()
-                    except Exception:
-                        pass
-                    try:
-                        loop.close()
-                    except Exception:
-                        pass
-                        pass
-                self.status[job_id]['status'] = 'completed'
+                res = self._run_job(job_id, repo_id, files, metadata, file_filter)
                 self.status[job_id]['result'] = res
+                self._finish(job_id, status='completed', result=res)
+            except JobCancelled:
+                logger.info(f"Index job {job_id} cancelled")
+                metrics.incr('index_worker.cancelled')
+                self._finish(job_id, status='cancelled')
+            except JobLost:
+                # another process resumed it while it waited here; it reports the status from now on
+                logger.info(f"Index job {job_id} is owned by another worker, dropping it")
+                metrics.incr('index_worker.lost')
+                self.status.pop(job_id, None)
+                self._cancel.pop(job_id, None)
+            except JobInterrupted:
+                # shutting down: release the lease so the next worker resumes from the checkpoint
+                self.status[job_id]['status'] = 'queued'
                 try:
-                    if inspect.iscoroutine(res):
-                        res = loop.run_until_complete(res)
-                    database.update_index_job_result(job_id, res)
+                    self._store().update(job_id, status='queued', owner=None)
                 except Exception:
                     pass
             except Exception as e:
                 logger.exception('Index job failed')
-                self.status[job_id]['status'] = 'failed'
                 self.status[job_id]['error'] = str(e)
-                try:
-                    database.update_index_job_error(job_id, str(e))
-                except Exception:
-                    pass
+                attempts = (self._store_get(job_id) or {}).get('attempts', JOB_MAX_ATTEMPTS)
+                if attempts < JOB_MAX_ATTEMPTS and self.running:
+                    # transient failures (Pinecone, Mongo) retry from the last checkpoint
+                    self._progress(job_id, status='queued', error=str(e))
+                    retry = threading.Timer(min(60.0, 5.0 * 2 ** attempts), self.q.put,
+                                            args=((job_id, repo_id, files, metadata, file_filter),))
+                    retry.daemon = True
+                    retry.start()
+                else:
+                    self._finish(job_id, status='failed', error=str(e))
+            finally:
+                self._release_slot()
+                get_governor().maybe_collect()
         # worker exiting, attempt to persist or cleanup if needed
         logger.info('IndexWorker threads exiting')
+
+    def _store_get(self, job_id: str):
+        try:
+            return self._store().get(job_id)
+        except Exception:
+            return None
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from service.utils import metrics
+from service.utils import admission
+from service.utils.admission import AdmissionRejected, AdmissionScheduler, slots_from_weights
+
+
+class TestAdmission(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.sched = AdmissionScheduler({'query': 2, 'index': 1}, queue_limits={'query': 4, 'index': 1},
+                                        timeouts={'query': 1.0, 'index': 0.2})
+
+    def test_classes_are_isolated(self):
+        with self.sched.admit('index'):
+            # a running index job does not block queries
+            with self.sched.admit('query'), self.sched.admit('query'):
+                self.assertEqual(self.sched.stats()['query']['active'], 2)
+        self.assertEqual(self.sched.stats()['index']['active'], 0)
+
+    def test_queue_full_and_timeout_rejections(self):
+        self.sched.acquire('index')
+        waiter = threading.Thread(target=lambda: self.assertRaises(AdmissionRejected, self.sched.acquire, 'index'))
+        waiter.start()
+        time.sleep(0.05)
+        with self.assertRaises(AdmissionRejected) as full:
+            self.sched.acquire('index')
+        self.assertEqual(full.exception.reason, 'queue_full')
+        self.assertGreaterEqual(full.exception.retry_after, 1)
+        waiter.join()
+        snap = metrics.snapshot()['counters']
+        self.assertEqual(snap['admission.rejected{cls=index,reason=timeout}'], 1)
+        self.assertEqual(self.sched.stats()['index']['queued'], 0)
+        self.sched.release('index')
+
+    def test_waiters_are_served_in_order(self):
+        order = []
+        sched = AdmissionScheduler({'index': 1}, queue_limits={'index': 4}, timeouts={'index': 2.0})
+        sched.acquire('index')
+
+        def worker(i):
+            with sched.admit('index'):
+                order.append(i)
+
+        threads = []
+        for i in range(3):
+            t = threading.Thread(target=worker, args=(i,))
+            t.start()
+            threads.append(t)
+            time.sleep(0.02)
+        sched.release('index')
+        for t in threads:
+            t.join()
+        self.assertEqual(order, [0, 1, 2])
+        self.assertEqual(sched.stats()['index']['active'], 0)
+
+    def test_slots_from_weights(self):
+        self.assertEqual(slots_from_weights(4, {'query': 2, 'index': 1, 'reset': 1}), {'query': 2, 'index': 1, 'reset': 1})
+        self.assertEqual(slots_from_weights(1, {'query': 2, 'index': 1}), {'query': 1, 'index': 1})
+
+    def test_default_admits_concurrent_queries(self):
+        env = {k: v for k, v in os.environ.items() if not k.startswith('ADMISSION_') and k != 'MAX_CONCURRENCY'}
+        with patch.dict(os.environ, env, clear=True), patch.object(admission, '_scheduler', None):
+            sched = admission.get_scheduler()
+            # the old global semaphore let MAX_CONCURRENCY (2) queries run at once
+            sched.acquire('query', timeout=0)
+            sched.acquire('query', timeout=0)
+            self.assertEqual(sched.stats()['query']['active'], 2)
+            self.assertEqual(sched.stats()['index']['slots'], 1)
+            self.assertEqual(sched.stats()['reset']['slots'], 1)
+            sched.release('query')
+            sched.release('query')
+
+
+if __name__ == '__main__':
+    unittest.main()
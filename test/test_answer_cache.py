@@ -0,0 +1,41 @@
+import os
+import tempfile
+import time
+import unittest
+
+from service.cache.answer_cache import DiskAnswerCache, answer_key
+
+
+class TestAnswerCache(unittest.TestCase):
+
+    def test_key_tracks_chunk_content(self):
+        results = [{'id': 'r:a.py:0', 'text': 'def a(): pass'}, {'id': 'r:b.py:0', 'text': 'def b(): pass'}]
+        k = answer_key('why?', results, model='m')
+        self.assertEqual(k, answer_key('why?', [dict(r) for r in results], model='m'))
+        changed = [results[0], {'id': 'r:b.py:0', 'text': 'def b(): return 1'}]
+        self.assertNotEqual(k, answer_key('why?', changed, model='m'))
+        self.assertNotEqual(k, answer_key('why not?', results, model='m'))
+        self.assertNotEqual(k, answer_key('why?', results, model='other'))
+        # without the text only the ids would be fingerprinted: not cacheable
+        self.assertIsNone(answer_key('why?', [results[0], {'id': 'r:b.py:0'}], model='m'))
+
+    def test_disk_roundtrip_and_size_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = DiskAnswerCache(tmp, max_bytes=2000)
+            value = {'raw': 'x' * 400, 'json': None}
+            for i in range(8):
+                cache.set(f'k{i}', value)
+                # distinct mtimes so eviction order is deterministic
+                os.utime(os.path.join(tmp, f'k{i}.json'), (time.time() - 100 + i, time.time() - 100 + i))
+            self.assertEqual(cache.get('k7'), value)
+            self.assertIsNone(cache.get('k0'))
+            total = sum(os.path.getsize(os.path.join(tmp, n)) for n in os.listdir(tmp))
+            self.assertLessEqual(total, 2000)
+            # a fresh instance (another worker / restart) sees the same entries
+            self.assertEqual(DiskAnswerCache(tmp, max_bytes=2000).get('k7'), value)
+            self.assertIsNone(DiskAnswerCache(tmp, max_bytes=2000, ttl=1e-9).get('k7'))
+            self.assertFalse(os.path.exists(os.path.join(tmp, 'k7.json')))
+
+
+if __name__ == '__main__':
+    unittest.main()
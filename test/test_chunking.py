@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from service.db.local_store import LocalVectorStore
+from service.piplines import rag_pipeline
+from service.piplines.chunking import cdc_chunks, chunk_file, fixed_chunks
+
+
+def sample_source(n_funcs=60):
+    parts = []
+    for i in range(n_funcs):
+        parts.append(f"def function_{i}(a, b):\n    total = a + b * {i}\n    if total > {i * 3}:\n"
+                     f"        return total - {i}\n    return total\n\n")
+    return ''.join(parts)
+
+
+class TestChunking(unittest.TestCase):
+
+    def test_fixed_matches_original_windows(self):
+        text = 'x' * 4500
+        self.assertEqual([(s, e) for s, e, _ in fixed_chunks(text)], [(0, 2000), (1800, 3800), (3600, 4500)])
+
+    def test_cdc_covers_text_and_respects_max(self):
+        text = sample_source() + 'y' * 5000 + '\n' + sample_source(5)
+        chunks = cdc_chunks(text, max_chars=2000)
+        self.assertEqual(''.join(c[2] for c in chunks), text)
+        self.assertTrue(all(len(c[2]) <= 2000 for c in chunks))
+
+    def test_cdc_ids_survive_small_edit(self):
+        text = sample_source()
+        before = {c[0] for c in chunk_file('r', 'a.py', text, 'cdc')}
+        after = [c[0] for c in chunk_file('r', 'a.py', '# header\n' + text, 'cdc')]
+        self.assertGreater(len(after), 3)
+        self.assertLessEqual(sum(1 for cid in after if cid not in before), 2)
+        fixed_before = {c[3] for c in chunk_file('r', 'a.py', text, 'fixed')}
+        fixed_after = [c[3] for c in chunk_file('r', 'a.py', '# header\n' + text, 'fixed')]
+        self.assertTrue(all(t not in fixed_before for t in fixed_after))
+
+    def test_cdc_ids_are_unique(self):
+        text = 'same line\n' * 2000
+        ids = [c[0] for c in chunk_file('r', 'a.txt', text, 'cdc')]
+        self.assertEqual(len(ids), len(set(ids)))
+
+
+
+async def fake_embeddings(texts):
+    return [[float(len(t)), 1.0, 0.0] for t in texts]
+
+
+class TestIncrementalIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.store = LocalVectorStore()
+        patches = [
+            mock.patch('service.db.vector_store.get_backend', return_value=self.store),
+            mock.patch.object(rag_pipeline, 'get_embeddings', fake_embeddings),
+            mock.patch.object(rag_pipeline, 'save_index_metadata'),
+            mock.patch.object(rag_pipeline, 'CHUNKING_MODE', 'cdc'),
+            mock.patch.object(rag_pipeline, 'FILE_VECTORS', False),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_reused_chunks_get_current_metadata(self):
+        files = [{'filename': 'src/a.py', 'content': sample_source()}]
+        first = asyncio.run(rag_pipeline.index_repo('repo', files, {'branch': 'main'}))
+        ids = self.store.list_ids('', namespace='repo')
+        # vectors written before `ext`/`dirs` were stored
+        for vid, values, meta in self.store.fetch(ids, namespace='repo'):
+            meta.pop('ext'), meta.pop('dirs')
+            self.store.upsert([(vid, values, meta)], namespace='repo')
+
+        second = asyncio.run(rag_pipeline.index_repo('repo', files, {'branch': 'dev'}))
+        self.assertEqual((second['upserts'], second['reused'], second['refreshed']), (0, first['chunk_count'],
+                                                                                      first['chunk_count']))
+        for _, _, meta in self.store.fetch(ids, namespace='repo'):
+            self.assertEqual((meta['branch'], meta['ext']), ('dev', '.py'))
+        self.assertEqual(asyncio.run(rag_pipeline.index_repo('repo', files, {'branch': 'dev'}))['refreshed'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
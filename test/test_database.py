@@ -0,0 +1,93 @@
+import time
+import unittest
+from unittest import mock
+
+from service.db import database
+
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.MagicMock()
+        self.patch = mock.patch.object(database, 'get_db', return_value=self.db)
+        self.patch.start()
+        database._job_updates.clear()
+
+    def tearDown(self):
+        self.patch.stop()
+        database._indexes_ensured = False
+        database._indexes_next_try = 0.0
+
+    def test_indexes_are_ensured_once(self):
+        database._indexes_ensured = False
+        self.assertTrue(database.ensure_indexes(self.db))
+        self.assertTrue(database.ensure_indexes(self.db))
+        names = [c.kwargs['name'] for c in self.db.__getitem__.return_value.create_index.call_args_list]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertIn('job_id_unique', names)
+        self.assertIn('ts_ttl', names)
+
+    def test_query_log_is_compact(self):
+        database.save_query_log('repo', {'prompt': 'p' * 2000, 'chunks': 6, 'result': {'guidance': 'g' * 5000}})
+        doc = self.db.query_logs.insert_one.call_args.args[0]
+        self.assertNotIn('result', doc)
+        self.assertEqual(len(doc['prompt']), database.QUERY_LOG_PROMPT_CHARS)
+        self.assertEqual(doc['chunks'], 6)
+        self.assertIn('ts', doc)
+        self.assertEqual((doc['repoId'], doc['repoIds']), ('repo', ['repo']))
+
+        database.save_query_log(['a', 'b'], {'prompt': 'p'})
+        doc = self.db.query_logs.insert_one.call_args.args[0]
+        self.assertEqual((doc['repoId'], doc['repoIds']), ('a', ['a', 'b']))
+
+    def test_deferred_job_updates_are_coalesced(self):
+        self.db.index_jobs.find_one.return_value = {'job_id': 'a', 'batches_done': 0}
+        with mock.patch.object(database, 'JOB_UPDATE_FLUSH_SECONDS', 60):
+            for n in range(1, 4):
+                database.update_index_job('a', {'batches_done': n}, defer=True)
+            database.update_index_job('b', {'heartbeat': 1.0}, defer=True)
+            self.db.index_jobs.bulk_write.assert_not_called()
+            # reads see the job's own pending checkpoint
+            self.assertEqual(database.get_index_job('a')['batches_done'], 3)
+            database.update_index_job('a', {'status': 'completed'})
+        ops = self.db.index_jobs.bulk_write.call_args.args[0]
+        self.assertEqual(self.db.index_jobs.bulk_write.call_count, 1)
+        self.assertEqual({op._filter['job_id']: op._doc['$set'] for op in ops},
+                         {'a': {'batches_done': 3, 'status': 'completed'}, 'b': {'heartbeat': 1.0}})
+
+    def test_insert_committed_before_a_timeout_is_not_written_twice(self):
+        from pymongo.errors import AutoReconnect, DuplicateKeyError
+        stored = {}
+
+        def insert_one(doc):
+            if doc['_id'] in stored:
+                raise DuplicateKeyError('E11000', 11000, {'code': 11000, 'keyPattern': {'_id': 1}})
+            stored[doc['_id']] = dict(doc)
+            if len(stored) == 1:
+                raise AutoReconnect('connection closed after the write')
+
+        self.db.index_jobs.insert_one.side_effect = insert_one
+        database.create_index_job({'job_id': 'j1', 'status': 'queued'})
+        self.assertEqual(self.db.index_jobs.insert_one.call_count, 2)
+        self.assertEqual([d['job_id'] for d in stored.values()], ['j1'])
+
+        self.db.index_jobs.insert_one.side_effect = DuplicateKeyError(
+            'E11000', 11000, {'code': 11000, 'keyPattern': {'job_id': 1}})
+        with self.assertRaises(DuplicateKeyError):
+            database.create_index_job({'job_id': 'j1', 'status': 'queued'})
+
+    def test_deferred_job_updates_are_written_by_a_timer(self):
+        with mock.patch.object(database, 'JOB_UPDATE_FLUSH_SECONDS', 0.05):
+            database.update_index_job('a', {'batches_done': 7, 'heartbeat': 1.0}, defer=True)
+            self.db.index_jobs.bulk_write.assert_not_called()
+            deadline = time.monotonic() + 2
+            while not self.db.index_jobs.bulk_write.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+        ops = self.db.index_jobs.bulk_write.call_args.args[0]
+        self.assertEqual([(op._filter, op._doc) for op in ops],
+                         [({'job_id': 'a'}, {'$set': {'batches_done': 7, 'heartbeat': 1.0}})])
+        self.assertEqual(database._job_updates, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
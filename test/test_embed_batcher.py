@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from service.embedding import embedding_utils
+from service.embedding.cache import EmbeddingCache
+from service.embedding.embedding_utils import EmbeddingBatcher
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.calls.append(list(texts))
+        return np.array([[len(t), ord(t[0]) if t else 0, 1.0] for t in texts], dtype='float32')
+
+
+class TestEmbeddingBatcher(unittest.TestCase):
+
+    def test_concurrent_callers_share_runs(self):
+        model = FakeModel()
+        batcher = EmbeddingBatcher(model, max_batch=64, max_wait=0.1)
+        results = {}
+        barrier = threading.Barrier(8)
+
+        def call(i):
+            barrier.wait()
+            results[i] = batcher.embed([f'text-{i}', 'shared'])
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        batcher.stop()
+        self.assertLess(len(model.calls), 8)
+        self.assertEqual(sum(c.count('shared') for c in model.calls), len(model.calls))
+        for i in range(8):
+            np.testing.assert_array_equal(results[i][0], [len(f'text-{i}'), ord('t'), 1.0])
+
+    def test_large_request_split_and_errors_propagate(self):
+        model = FakeModel()
+        batcher = EmbeddingBatcher(model, max_batch=4, max_wait=0)
+        out = batcher.embed([f'x{i}' for i in range(10)])
+        self.assertEqual(out.shape, (10, 3))
+        self.assertEqual([len(c) for c in model.calls], [4, 4, 2])
+        failing = EmbeddingBatcher(lambda texts: 1 / 0, max_wait=0)
+        with self.assertRaises(ZeroDivisionError):
+            failing.embed(['a'])
+        batcher.stop()
+        failing.stop()
+
+    def test_async_callers_on_separate_loops(self):
+        # like /rag/query: each request thread runs its own event loop
+        model = FakeModel()
+        batcher = EmbeddingBatcher(model, max_batch=64, max_wait=0.1)
+        results = {}
+        barrier = threading.Barrier(6)
+
+        def call(i):
+            barrier.wait()
+            results[i] = asyncio.run(batcher.embed_async([f'q{i}']))
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertLess(len(model.calls), 6)
+        for i in range(6):
+            np.testing.assert_array_equal(results[i], [[len(f'q{i}'), ord('q'), 1.0]])
+        failing = EmbeddingBatcher(lambda texts: 1 / 0, max_wait=0)
+        with self.assertRaises(ZeroDivisionError):
+            asyncio.run(failing.embed_async(['a']))
+        batcher.stop()
+        failing.stop()
+
+    def test_small_get_embeddings_calls_use_batcher(self):
+        model = FakeModel()
+        unused = FakeModel()
+        with mock.patch.object(embedding_utils, '_query_batcher', EmbeddingBatcher(model, max_wait=0)), \
+                mock.patch.object(embedding_utils, '_batcher', EmbeddingBatcher(unused, max_wait=0)), \
+                mock.patch.object(embedding_utils, '_cache', EmbeddingCache(max_memory_items=16)), \
+                mock.patch.object(embedding_utils, 'EMBED_QUERY_BATCHING', True):
+            out = asyncio.run(embedding_utils.get_embeddings(['hello', 'hello']))
+            self.assertEqual(out, [[5.0, 104.0, 1.0], [5.0, 104.0, 1.0]])
+            asyncio.run(embedding_utils.get_embeddings(['hello']))
+            embedding_utils._query_batcher.stop()
+        self.assertEqual(model.calls, [['hello']])
+        # prompts never share a dispatcher (or a queue) with /rag/embed requests
+        self.assertEqual(unused.calls, [])
+
+
+class TestEmbedEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        from main import app
+        self.client = app.test_client()
+        model = FakeModel()
+        patches = [
+            mock.patch.object(embedding_utils, '_batcher', EmbeddingBatcher(model, max_wait=0)),
+            mock.patch.object(embedding_utils, '_cache', EmbeddingCache(max_memory_items=16)),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_json_and_binary(self):
+        res = self.client.post('/rag/embed', json={'texts': ['ab', 'c']})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['embeddings'], [[2.0, 97.0, 1.0], [1.0, 99.0, 1.0]])
+
+        res = self.client.post('/rag/embed', json={'texts': ['ab', 'c', 'ab']},
+                               headers={'Accept': 'application/octet-stream'})
+        self.assertEqual(res.headers['X-Shape'], '3,3')
+        arr = np.frombuffer(res.data, dtype='<f4').reshape(3, 3)
+        np.testing.assert_array_equal(arr[2], [2.0, 97.0, 1.0])
+
+    def test_rejects_bad_input(self):
+        self.assertEqual(self.client.post('/rag/embed', json={'texts': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.post('/rag/embed', json={'texts': ['a'], 'format': 'xml'}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from service.embedding.cache import EmbeddingCache
+from service.embedding.embedding_utils import variant_model_path
+
+
+class TestEmbeddingCache(unittest.TestCase):
+
+    def test_variants_do_not_mix(self):
+        fp32 = EmbeddingCache(max_memory_items=8)
+        int8 = EmbeddingCache(max_memory_items=8, namespace='int8')
+        # both caches share a backing store, as the disk cache would
+        int8.mem = fp32.mem
+        fp32.set('def foo(): pass', [1.0, 2.0])
+        self.assertIsNone(int8.get('def foo(): pass'))
+        int8.set('def foo(): pass', [3.0, 4.0])
+        self.assertEqual(fp32.get('def foo(): pass'), [1.0, 2.0])
+        self.assertEqual(int8.get('def foo(): pass'), [3.0, 4.0])
+
+    def test_fp32_keys_unchanged(self):
+        import hashlib
+        text = 'print(1)'
+        self.assertEqual(EmbeddingCache()._key_for_text(text), hashlib.sha256(text.encode('utf-8')).hexdigest())
+
+    def test_variant_model_path(self):
+        self.assertEqual(variant_model_path('service/embedding/model.onnx', 'fp32'), 'service/embedding/model.onnx')
+        self.assertEqual(variant_model_path('service/embedding/model.onnx', 'int8'), 'service/embedding/model.int8.onnx')
+
+
+if __name__ == '__main__':
+    unittest.main()
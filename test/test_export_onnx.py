@@ -0,0 +1,55 @@
+import importlib.util
+import unittest
+
+import numpy as np
+import onnxruntime as ort
+
+# onnx is only needed to export models (service/utils/export_onnx.py), not to serve them
+HAVE_ONNX = importlib.util.find_spec('onnx') is not None
+if HAVE_ONNX:
+    from onnx import TensorProto, helper, numpy_helper
+
+from service.embedding.embedding_utils import POOLED_OUTPUT, mean_pool
+from service.utils.export_onnx import fuse_pooling
+
+
+def tiny_model(vocab=50, dim=8, opset=14):
+    """input_ids -> embedding lookup -> last_hidden_state, shaped like the exported transformer."""
+    table = np.random.default_rng(0).standard_normal((vocab, dim)).astype('float32')
+    graph = helper.make_graph(
+        [helper.make_node('Gather', ['table', 'input_ids'], ['last_hidden_state'])],
+        'tiny',
+        [helper.make_tensor_value_info('input_ids', TensorProto.INT64, ['batch', 'sequence']),
+         helper.make_tensor_value_info('attention_mask', TensorProto.INT64, ['batch', 'sequence'])],
+        [helper.make_tensor_value_info('last_hidden_state', TensorProto.FLOAT, ['batch', 'sequence', dim])],
+        [numpy_helper.from_array(table, 'table')])
+    return helper.make_model(graph, opset_imports=[helper.make_opsetid('', opset)], ir_version=8)
+
+
+@unittest.skipUnless(HAVE_ONNX, 'onnx is not installed')
+class TestFusedPooling(unittest.TestCase):
+
+    def run_model(self, model, output):
+        sess = ort.InferenceSession(model.SerializeToString(), providers=['CPUExecutionProvider'])
+        ids = np.array([[1, 2, 3, 0], [4, 5, 0, 0]], dtype='int64')
+        mask = (ids > 0).astype('int64')
+        return sess, sess.run([output], {'input_ids': ids, 'attention_mask': mask})[0], mask
+
+    def test_fused_output_matches_numpy_pooling(self):
+        for opset in (11, 14, 18):
+            model = tiny_model(opset=opset)
+            _, hidden, mask = self.run_model(model, 'last_hidden_state')
+            sess, fused, _ = self.run_model(fuse_pooling(model), POOLED_OUTPUT)
+            self.assertEqual([o.name for o in sess.get_outputs()], [POOLED_OUTPUT])
+            self.assertEqual(fused.shape, (2, 8))
+            np.testing.assert_allclose(fused, mean_pool(hidden, mask), rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(np.linalg.norm(fused, axis=1), 1.0, rtol=1e-5)
+
+    def test_fusing_twice_is_a_no_op(self):
+        model = fuse_pooling(tiny_model())
+        n = len(model.graph.node)
+        self.assertEqual(len(fuse_pooling(model).graph.node), n)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import time
+import unittest
+from unittest import mock
+
+from service.piplines import rag_pipeline
+from service.utils import metrics
+
+
+def fake_query(delay):
+    def query(query_vec, top_k=6, namespace=None, filter=None):
+        time.sleep(delay)
+        if namespace.startswith('broken'):
+            raise RuntimeError('namespace unavailable')
+        base, step = {'svc': (0.9, 0.1), 'lib': (0.55, 0.01)}.get(namespace, (0.1, 0.01))
+        return [{'id': f'{namespace}:{i}', 'score': base - i * step, 'metadata': {'path': f'{namespace}.py'}}
+                for i in range(top_k)]
+    return query
+
+
+class TestFanout(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_merges_global_top_k_concurrently(self):
+        with mock.patch.object(rag_pipeline, 'query_vectors', fake_query(0.2)):
+            start = time.perf_counter()
+            res = rag_pipeline.retrieve(['svc', 'lib', 'other'], [0.0], top_k=8)
+            elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual([r['id'] for r in res], [f'svc:{i}' for i in range(4)] + [f'lib:{i}' for i in range(4)])
+        self.assertEqual(len(metrics.samples('rag.namespace_latency')), 3)
+
+    def test_minmax_normalisation_and_partial_failure(self):
+        with mock.patch.object(rag_pipeline, 'query_vectors', fake_query(0)):
+            res = rag_pipeline.retrieve(['svc', 'lib', 'broken'], [0.0], top_k=4, score_norm='minmax')
+            self.assertEqual({r['namespace'] for r in res[:2]}, {'svc', 'lib'})
+            self.assertEqual(res[0]['score'], 1.0)
+            self.assertIn('raw_score', res[0])
+            with self.assertRaises(RuntimeError):
+                rag_pipeline.retrieve(['broken', 'broken2'], [0.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
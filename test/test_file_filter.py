@@ -0,0 +1,70 @@
+import base64
+import os
+import unittest
+
+from service.piplines.file_filter import FileFilter, PathMatcher, shannon_entropy
+
+SOURCE = ''.join(f"def handler_{i}(request):\n    return render(request, 'page_{i}.html')\n\n" for i in range(50))
+
+
+class TestFileFilter(unittest.TestCase):
+
+    def test_gitignore_patterns(self):
+        m = PathMatcher(['node_modules/', '*.min.js', '/build/', 'docs/**/gen_*.md', '!vendor/ours/', 'vendor/'])
+        self.assertEqual(m.match('web/node_modules/react/index.js'), 'node_modules/')
+        self.assertEqual(m.match('static/app.min.js'), '*.min.js')
+        self.assertEqual(m.match('build/out.txt'), '/build/')
+        self.assertIsNone(m.match('src/build/out.txt'))
+        self.assertEqual(m.match('docs/api/v1/gen_index.md'), 'docs/**/gen_*.md')
+        self.assertIsNone(m.match('src/app.js'))
+        # the last matching pattern wins
+        self.assertEqual(m.match('vendor/ours/lib.py'), 'vendor/')
+        self.assertIsNone(PathMatcher(['vendor/', '!vendor/ours/']).match('vendor/ours/lib.py'))
+
+    def test_default_excludes(self):
+        ff = FileFilter()
+        self.assertIsNotNone(ff.matcher.match('build/app.js'))
+        self.assertIsNotNone(ff.matcher.match('web/node_modules/react/index.js'))
+        # build-like directory names below the root are often source
+        self.assertIsNone(ff.matcher.match('tools/build/release.py'))
+        self.assertIsNone(ff.matcher.match('src/main/java/com/acme/out/Writer.java'))
+        self.assertIsNone(ff.matcher.match('fixtures/schema.db'))
+
+    def test_content_heuristics(self):
+        ff = FileFilter(max_file_bytes=50_000)
+        self.assertIsNone(ff.check_content(SOURCE))
+        self.assertEqual(ff.check_content('var a=1;' * 2000), 'minified')
+        self.assertEqual(ff.check_content('ok\x00\x01\x02' * 100), 'binary')
+        blob = '\n'.join(base64.b64encode(os.urandom(57)).decode() for _ in range(200))
+        self.assertGreater(shannon_entropy(blob), 5.5)
+        self.assertEqual(ff.check_content(blob), 'high-entropy')
+        self.assertEqual(ff.check_content('x = 1\n' * 10_000), 'too-large')
+        self.assertEqual(ff.check_content('  \n'), 'empty')
+
+    def test_apply_report(self):
+        files = [
+            {'filename': 'app/views.py', 'content': SOURCE},
+            {'filename': 'app/views_copy.py', 'content': SOURCE},
+            {'filename': 'package-lock.json', 'content': '{"lockfileVersion": 3}'},
+            {'filename': 'logo.png', 'content': b'\x89PNG\r\n\x1a\n\x00\x00'},
+            {'filename': 'data.json', 'content': {'not': 'text'}},
+            {'filename': 'requirements.txt', 'content': 'flask==3.0\r\n'.encode('utf-16')},
+        ]
+        kept, report = FileFilter().apply(files)
+        self.assertEqual([f['filename'] for f in kept], ['app/views.py', 'requirements.txt'])
+        self.assertEqual(kept[1]['content'], 'flask==3.0\r\n')
+        self.assertEqual(report['skipped_by_reason'], {'duplicate': 1, 'excluded': 1, 'binary': 1, 'not-text': 1})
+        dup = next(s for s in report['skipped_files'] if s['reason'] == 'duplicate')
+        self.assertEqual(dup['duplicate_of'], 'app/views.py')
+        self.assertEqual(report['bytes_saved'], sum(s['bytes'] for s in report['skipped_files']))
+        self.assertGreaterEqual(report['chunks_saved'], 3)
+
+    def test_request_overrides(self):
+        self.assertIsNone(FileFilter.from_env({'enabled': False}))
+        ff = FileFilter.from_env({'include': ['vendor/ours/'], 'exclude': ['*.generated.py']})
+        self.assertIsNone(ff.matcher.match('vendor/ours/lib.py'))
+        self.assertEqual(ff.matcher.match('api/models.generated.py'), '*.generated.py')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from service.db.filters import build_filter, path_fields
+from service.db.local_store import LocalVectorStore
+
+
+def store_with_paths():
+    paths = ['src/api/routes.py', 'src/api/models.ts', 'src/core/engine.py', 'docs/readme.md', 'setup.py']
+    rng = np.random.default_rng(1)
+    vectors = []
+    for i in range(200):
+        path = paths[i % len(paths)]
+        meta = {'path': path, 'repoId': 'repo', 'provider': 'github' if i % 2 else 'gitlab', **path_fields(path)}
+        vectors.append((f'repo:{path}:{i}', rng.normal(size=8).astype('float32'), meta))
+    store = LocalVectorStore()
+    store.upsert(vectors, namespace='repo')
+    return store
+
+
+class TestFilters(unittest.TestCase):
+
+    def test_path_fields(self):
+        self.assertEqual(path_fields('./src/api/routes.PY'), {'ext': '.py', 'dirs': ['src', 'src/api']})
+        self.assertEqual(path_fields('setup.py')['dirs'], [])
+
+    def test_build_filter(self):
+        self.assertIsNone(build_filter({}))
+        self.assertEqual(build_filter({'path_prefix': 'src/api/'}), {'dirs': {'$in': ['src/api']}})
+        self.assertEqual(build_filter({'ext': 'py', 'provider': 'github', 'where': {'title': ['a', 1]}}),
+                         {'$and': [{'ext': {'$in': ['.py']}}, {'provider': {'$eq': 'github'}},
+                                   {'title': {'$in': ['a', '1']}}]})
+        with self.assertRaises(ValueError):
+            build_filter({'where': {'x': {'$regex': '.*'}}})
+
+    def test_local_filter_scores_only_matching_rows(self):
+        store = store_with_paths()
+        q = np.ones(8, dtype='float32')
+        res = store.query(q, top_k=100, namespace='repo', filter=build_filter({'path_prefix': 'src/api', 'ext': '.py'}))
+        self.assertEqual({r['metadata']['path'] for r in res}, {'src/api/routes.py'})
+        self.assertEqual(len(res), 40)
+        self.assertEqual(store.stats['rows_scored'], 40)
+
+        res = store.query(q, top_k=5, namespace='repo',
+                          filter={'$or': [{'path': {'$eq': 'setup.py'}}, {'provider': {'$ne': 'github'}}]})
+        self.assertTrue(all(r['metadata']['path'] == 'setup.py' or r['metadata']['provider'] == 'gitlab' for r in res))
+
+    def test_bitmaps_follow_updates(self):
+        store = store_with_paths()
+        q = np.ones(8, dtype='float32')
+        flt = build_filter({'path_prefix': 'docs/'})
+        self.assertEqual(len(store.query(q, top_k=100, namespace='repo', filter=flt)), 40)
+        store.delete_ids(store.list_ids('repo:docs/', namespace='repo')[:10], namespace='repo')
+        self.assertEqual(len(store.query(q, top_k=100, namespace='repo', filter=flt)), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
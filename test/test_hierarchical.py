@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from service.db.local_store import LocalVectorStore
+from service.piplines import rag_pipeline
+
+VOCAB = ['token', 'session', 'query', 'index', 'render', 'template', 'retry', 'queue']
+
+
+async def fake_embeddings(texts):
+    # bag of vocabulary words plus a little noise, enough to make files distinguishable
+    rng = np.random.default_rng(len(texts))
+    return [np.array([t.count(w) for w in VOCAB], dtype='float32') + rng.random(len(VOCAB)).astype('float32') * 0.1
+            for t in texts]
+
+
+def topic_file(name, words, n_lines=400):
+    lines = [f"x_{i} = {words[i % len(words)]}_{i}()\n" for i in range(n_lines)]
+    return {'filename': name, 'content': ''.join(lines)}
+
+
+class TestHierarchicalRetrieval(unittest.TestCase):
+
+    def setUp(self):
+        self.store = LocalVectorStore()
+        patches = [
+            mock.patch('service.db.vector_store.get_backend', return_value=self.store),
+            mock.patch.object(rag_pipeline, 'get_embeddings', fake_embeddings),
+            mock.patch.object(rag_pipeline, 'save_index_metadata'),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        files = [topic_file('auth.py', ['token', 'session']), topic_file('db.py', ['query', 'index']),
+                 topic_file('views.py', ['render', 'template']), topic_file('jobs.py', ['retry', 'queue'])]
+        self.summary = asyncio.run(rag_pipeline.index_repo('repo', files, {'provider': 'github'}))
+
+    def test_file_vectors_written(self):
+        self.assertEqual(self.summary['file_vectors'], 4)
+        ids = self.store.list_ids('', namespace=rag_pipeline.files_namespace('repo'))
+        self.assertEqual(sorted(ids), ['repo:auth.py', 'repo:db.py', 'repo:jobs.py', 'repo:views.py'])
+
+    def test_hierarchical_searches_fewer_rows(self):
+        q = asyncio.run(fake_embeddings(['token session']))[0]
+        self.store.stats['rows_scored'] = 0
+        flat = rag_pipeline.retrieve(['repo'], q, top_k=3, mode='flat')
+        flat_rows = self.store.stats['rows_scored']
+        with mock.patch.object(rag_pipeline, 'RAG_HIER_FILES', 1):
+            hier = rag_pipeline.retrieve(['repo'], q, top_k=3, mode='hierarchical')
+        hier_rows = self.store.stats['rows_scored'] - flat_rows
+        self.assertEqual({r['metadata']['path'] for r in hier}, {'auth.py'})
+        self.assertEqual([r['id'] for r in hier], [r['id'] for r in flat])
+        self.assertLess(hier_rows, flat_rows)
+
+    def test_delete_removes_files_namespace(self):
+        asyncio.run(rag_pipeline.delete_repo('repo'))
+        self.assertEqual(self.store.list_ids('', namespace=rag_pipeline.files_namespace('repo')), [])
+
+
+    def test_stale_file_vectors_removed(self):
+        files_ns = rag_pipeline.files_namespace('repo')
+        patcher = mock.patch.object(rag_pipeline, 'EMBEDDING_DIM', len(VOCAB))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # views.py is now excluded by the filter, jobs.py became empty
+        asyncio.run(rag_pipeline.index_repo('repo', [topic_file('views.py', ['render']),
+                                                     {'filename': 'jobs.py', 'content': ''},
+                                                     topic_file('auth.py', ['token'])],
+                                            {}, file_filter={'exclude': ['views.py']}))
+        self.assertEqual(sorted(self.store.list_ids('', namespace=files_ns)), ['repo:auth.py', 'repo:db.py'])
+        # a reset replaces the file vectors with those of the files it is given
+        asyncio.run(rag_pipeline.reset_repo('repo', [topic_file('db.py', ['query'])], {}))
+        self.assertEqual(self.store.list_ids('', namespace=files_ns), ['repo:db.py'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from service.db.local_store import LocalVectorStore
+from service.piplines import rag_pipeline
+from service.worker import worker as worker_mod
+from service.worker.jobs import JobCancelled, JobLost, LocalJobStore
+from service.worker.worker import IndexWorker
+
+FILES = [{'filename': f'src/m{i}.py', 'content': f'def f{i}():\n    return {i}\n'} for i in range(10)]
+
+
+async def fake_embeddings(texts):
+    return [[1.0, 0.0, 0.0] for _ in texts]
+
+
+class TestIndexJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = LocalJobStore(self.tmp.name)
+        self.upserts = []
+        self.patches = [
+            mock.patch.object(rag_pipeline, 'get_embeddings', fake_embeddings),
+            mock.patch.object(rag_pipeline, 'upsert_vectors', lambda vectors, namespace=None: self.upserts.append(vectors)),
+            mock.patch.object(rag_pipeline, 'CHUNKING_MODE', 'fixed'),
+            mock.patch.object(rag_pipeline, 'FILE_VECTORS', False),
+            mock.patch.object(rag_pipeline, 'INDEX_CHECKPOINT_BATCH', 2),
+            mock.patch.object(worker_mod.database, 'save_index_metadata', lambda *a, **k: None),
+        ]
+        for p in self.patches:
+            p.start()
+        self.worker = IndexWorker(store=self.store)
+        self.worker.running = True
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.tmp.cleanup()
+
+    def _record(self, job_id, **fields):
+        record = {'job_id': job_id, 'repo_id': 'repo', 'status': 'running', 'metadata': {}, 'file_filter': None,
+                  'total_files': len(FILES), 'files_done': 0, 'batches_done': 0, 'attempts': 1,
+                  'created_at': time.time(), 'owner': 'gone:1', 'heartbeat': 0, 'cancel_requested': False}
+        record.update(fields)
+        self.store.create(record, FILES)
+
+    def test_resume_skips_checkpointed_batches(self):
+        self._record('job-1', batches_done=3)
+        self.assertEqual(self.worker.resume(), 1)
+        item = self.worker.q.get_nowait()
+        res = self.worker._run_job(*item)
+        # 10 one-chunk files in batches of 2: the first 3 batches were written before the "crash"
+        self.assertEqual(len(self.upserts), 2)
+        self.assertEqual(res['skipped_batches'], 3)
+        self.assertEqual(self.store.get('job-1')['files_done'], len(FILES))
+
+    def test_cancel_stops_between_batches(self):
+        job_id = self.worker.submit('repo', FILES, {})
+        item = self.worker.q.get_nowait()
+        self.worker.status[job_id]['status'] = 'running'
+
+        def upsert_then_cancel(vectors, namespace=None):
+            self.upserts.append(vectors)
+            self.worker.cancel(job_id)
+
+        with mock.patch.object(rag_pipeline, 'upsert_vectors', upsert_then_cancel):
+            with self.assertRaises(JobCancelled):
+                self.worker._run_job(*item)
+        self.assertEqual(len(self.upserts), 1)
+        self.assertEqual(self.store.get(job_id)['batches_done'], 1)
+        self.assertTrue(self.store.get(job_id)['cancel_requested'])
+
+    def test_live_lease_is_not_claimed(self):
+        self._record('job-2', owner='other:2', heartbeat=time.time())
+        self.assertEqual(self.worker.resume(), 0)
+        self.assertFalse(self.store.claim('job-2', 'me:3'))
+        self.store.update('job-2', heartbeat=0)
+        self.assertTrue(self.store.claim('job-2', 'me:3'))
+
+
+    def test_queued_job_keeps_its_lease(self):
+        job_id = self.worker.submit('repo', FILES, {})
+        self.store.update(job_id, heartbeat=0)
+        # without the heartbeat, a job queued past the lease looks abandoned to other processes
+        self.assertEqual(self.worker.heartbeat(), 1)
+        self.assertFalse(self.store.claim(job_id, 'other:2'))
+
+        # a job another process took over anyway is dropped when dequeued, not run twice
+        self.store.update(job_id, owner='other:2', heartbeat=time.time())
+        with self.assertRaises(JobLost):
+            self.worker._run_job(*self.worker.q.get_nowait())
+        self.assertEqual(self.upserts, [])
+
+    def test_excluded_files_are_removed_from_the_index(self):
+        store = LocalVectorStore()
+        files = FILES[:2] + [{'filename': 'vendor/lib.py', 'content': 'def lib():\n    return 1\n'}]
+        with mock.patch('service.db.vector_store.get_backend', return_value=store), \
+                mock.patch.object(rag_pipeline, 'upsert_vectors', store.upsert), \
+                mock.patch.object(rag_pipeline, 'FILE_VECTORS', True):
+            self.worker.submit('repo', files, {}, file_filter={'enabled': False})
+            self.worker._run_job(*self.worker.q.get_nowait())
+            self.assertTrue(store.list_ids('repo:vendor/lib.py:', namespace='repo'))
+            # vendor/ is excluded now: the background job drops the file's chunk and file vectors
+            self.worker.submit('repo', files, {}, file_filter={'exclude': ['/vendor/']})
+            self.worker._run_job(*self.worker.q.get_nowait())
+        self.assertEqual(store.list_ids('repo:vendor/', namespace='repo'), [])
+        self.assertEqual(sorted(store.list_ids('', namespace=rag_pipeline.files_namespace('repo'))),
+                         ['repo:src/m0.py', 'repo:src/m1.py'])
+        self.assertTrue(store.list_ids('repo:src/m0.py:', namespace='repo'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import time
+import unittest
+
+from service.llm.providers import HedgedLLM, LLMDeadlineExceeded, LLMError, LocalProvider
+from service.utils.resilience import DeadlineExceeded
+from service.utils import metrics
+
+
+class TestHedgedLLM(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_local_provider_is_deterministic(self):
+        p = LocalProvider()
+        self.assertEqual(p.generate('q'), p.generate('q'))
+        self.assertIn('suggestions', p.generate('q')['json'])
+
+    def test_hedge_wins_when_primary_is_slow(self):
+        llm = HedgedLLM(LocalProvider('slow', latency=1.0), hedge=LocalProvider('fast', latency=0.01),
+                        deadline=5, hedge_default_delay=0.05)
+        t0 = time.monotonic()
+        out = llm.generate('prompt')
+        self.assertLess(time.monotonic() - t0, 0.5)
+        self.assertEqual(out['json']['guidance'], 'guidance from fast')
+        self.assertEqual(out['provider'], 'fast')
+        self.assertEqual(metrics.snapshot()['counters'].get('llm.wins{provider=fast}'), 1)
+
+    def test_no_hedge_when_primary_is_fast(self):
+        llm = HedgedLLM(LocalProvider('primary'), hedge=LocalProvider('fast'), hedge_default_delay=1.0)
+        self.assertEqual(llm.generate('prompt')['json']['guidance'], 'guidance from primary')
+        self.assertNotIn('llm.hedges', metrics.snapshot()['counters'])
+
+    def test_fallback_chain_on_error(self):
+        llm = HedgedLLM(LocalProvider('broken', fail=True), fallbacks=[LocalProvider('also-broken', fail=True),
+                                                                      LocalProvider('backup')])
+        out = llm.generate('prompt')
+        self.assertEqual(out['json']['guidance'], 'guidance from backup')
+        self.assertEqual(out['provider'], 'backup')
+
+    def test_deadline(self):
+        llm = HedgedLLM(LocalProvider('slow', latency=2.0), deadline=0.1)
+        with self.assertRaises(LLMDeadlineExceeded):
+            llm.generate('prompt')
+
+    def test_fast_failure_is_not_a_timeout(self):
+        llm = HedgedLLM(LocalProvider('bad-key', fail=True), fallbacks=[LocalProvider('also-bad', fail=True)])
+        with self.assertRaises(LLMError) as ctx:
+            llm.generate('prompt')
+        self.assertNotIsInstance(ctx.exception, DeadlineExceeded)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import json
+import logging
+import unittest
+
+from service.utils.log import JobSummary, JsonFormatter, Sampler, log_event, redact
+
+
+class _Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestLog(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test.log')
+        self.logger.propagate = False
+        self.capture = _Capture()
+        self.logger.addHandler(self.capture)
+        self.logger.setLevel(logging.INFO)
+        self.addCleanup(self.logger.removeHandler, self.capture)
+
+    def test_redact(self):
+        out = redact({'apiKey': 'abc', 'files': [{'content': 'x' * 5000}] * 3, 'note': 'y' * 1000,
+                      'ids': list(range(50))})
+        self.assertEqual(out['apiKey'], '[REDACTED]')
+        self.assertEqual(out['files'], '<3 items>')
+        self.assertLess(len(out['note']), 300)
+        self.assertEqual(len(out['ids']), 11)
+        self.assertEqual(redact({'content': 'abc'}), {'content': '<3 chars>'})
+
+    def test_structured_json_record(self):
+        log_event(self.logger, 'rag.index', repo_id='r1', chunks=3)
+        doc = json.loads(JsonFormatter().format(self.capture.records[0]))
+        self.assertEqual((doc['msg'], doc['repo_id'], doc['chunks']), ('rag.index', 'r1', 3))
+
+    def test_disabled_level_builds_nothing(self):
+        class Exploding:
+            def __str__(self):
+                raise AssertionError('formatted a disabled record')
+
+        log_event(self.logger, 'noisy', level=logging.DEBUG, value=Exploding())
+        self.assertEqual(self.capture.records, [])
+
+    def test_sampler_and_summary(self):
+        sampler = Sampler(every=10)
+        for _ in range(25):
+            sampler.log(self.logger, 'hit')
+        self.assertEqual(len(self.capture.records), 3)
+        job = JobSummary(self.logger, 'job', repo_id='r')
+        for _ in range(100):
+            job.add('chunks')
+        job.stage('embed')
+        job.emit(status='ok')
+        fields = self.capture.records[-1].fields
+        self.assertEqual((fields['chunks'], fields['status']), (100, 'ok'))
+        self.assertIn('embed', fields['stages'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,7 +16,9 @@ class TestMainRoutes(unittest.TestCase):
     def test_health(self):
         response = self.app.get('/rag/health')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(json.loads(response.data.decode('utf-8')), {"status": "ok"})
+        body = json.loads(response.data.decode('utf-8'))
+        self.assertIn(body["status"], ("ok", "degraded"))
+        self.assertIsInstance(body["breakers"], dict)
 
     def test_rag_query(self):
         """Test the RAG query endpoint."""
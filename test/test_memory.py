@@ -0,0 +1,38 @@
+import unittest
+
+from service.utils.memory import MemoryGovernor
+
+
+class TestMemoryGovernor(unittest.TestCase):
+
+    def governor(self, usage):
+        state = {'usage': usage}
+        g = MemoryGovernor(limit_bytes=1000, high=0.7, critical=0.9, usage_fn=lambda: state['usage'], check_interval=0)
+        return g, state
+
+    def test_scale_follows_pressure(self):
+        g, state = self.governor(100)
+        self.assertEqual(g.level(), 'ok')
+        self.assertEqual(g.scale(32), 32)
+        state['usage'] = 800
+        self.assertEqual(g.level(), 'high')
+        self.assertTrue(1 < g.scale(32) < 32)
+        state['usage'] = 950
+        self.assertEqual(g.scale(32), 1)
+        self.assertEqual(g.allowed_concurrency(4), 1)
+
+    def test_collect_only_under_pressure(self):
+        g, state = self.governor(100)
+        self.assertFalse(g.maybe_collect())
+        state['usage'] = 750
+        self.assertTrue(g.maybe_collect())
+
+    def test_wait_for_headroom(self):
+        g, state = self.governor(950)
+        self.assertFalse(g.wait_for_headroom(timeout=0.05, poll=0.01))
+        state['usage'] = 500
+        self.assertTrue(g.wait_for_headroom(timeout=0.05, poll=0.01))
+
+
+if __name__ == '__main__':
+    unittest.main()
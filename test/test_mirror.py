@@ -0,0 +1,73 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from service.db.filters import build_filter
+from service.db.local_store import LocalVectorStore
+from service.db.mirror import MirroredBackend
+
+
+def _vectors(n, dim=32, seed=0, prefix='v'):
+    rng = np.random.default_rng(seed)
+    vecs = rng.normal(size=(n, dim)).astype('float32')
+    return [(f'{prefix}{i}', vecs[i], {'path': f'src/f{i % 5}.py', 'ext': '.py' if i % 2 else '.md',
+                                       'text': f'chunk {i}'}) for i in range(n)]
+
+
+class TestMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.inner = LocalVectorStore()
+        self.inner.upsert(_vectors(500), namespace='hot')
+        self.mirror = MirroredBackend(self.inner, min_queries=2, rescore=8, path=tempfile.mkdtemp(),
+                                      background=False)
+        self.addCleanup(self.mirror.close)
+        self.query = np.random.default_rng(1).normal(size=32).astype('float32')
+
+    def test_hot_namespace_served_locally_with_exact_scores(self):
+        expected = self.inner.query(self.query, top_k=5, namespace='hot')
+        self.mirror.query(self.query, top_k=5, namespace='hot')
+        self.assertNotIn('hot', self.mirror.resident)
+        got = self.mirror.query(self.query, top_k=5, namespace='hot')
+        self.assertIn('hot', self.mirror.resident)
+        self.assertEqual([r['id'] for r in got], [r['id'] for r in expected])
+        np.testing.assert_allclose([r['score'] for r in got], [r['score'] for r in expected], rtol=1e-5)
+        self.assertEqual(got[0]['text'], expected[0]['text'])
+        flt = build_filter({'ext': 'py', 'path_prefix': 'src/f1.py'})
+        filtered = self.mirror.query(self.query, top_k=3, namespace='hot', filter=flt)
+        self.assertEqual([r['id'] for r in filtered],
+                         [r['id'] for r in self.inner.query(self.query, top_k=3, namespace='hot', filter=flt)])
+        snap = self.mirror.snapshot()
+        self.assertEqual((snap['hits'], snap['misses'], snap['loads']), (1, 2, 1))
+
+    def test_writes_invalidate(self):
+        for _ in range(2):
+            self.mirror.query(self.query, top_k=1, namespace='hot')
+        self.mirror.upsert([('new', self.query, {'text': 'exact match'})], namespace='hot')
+        self.assertNotIn('hot', self.mirror.resident)
+        self.assertEqual(self.mirror.query(self.query, top_k=1, namespace='hot')[0]['id'], 'new')
+
+    def test_query_in_flight_survives_invalidation(self):
+        for _ in range(2):
+            self.mirror.query(self.query, top_k=1, namespace='hot')
+        ns = self.mirror.resident['hot']
+        # a write drops (closes) the namespace between another query's lookup and its scoring
+        self.mirror.upsert([('new', self.query, {})], namespace='hot')
+        got, _ = ns.query(self.query, top_k=3, flt=None, rescore=8)
+        self.assertEqual([r['id'] for r in got],
+                         [r['id'] for r in self.inner.query(self.query, top_k=4, namespace='hot')][1:])
+
+    def test_lru_eviction_under_budget(self):
+        self.inner.upsert(_vectors(500, seed=2, prefix='w'), namespace='warm')
+        for ns in ('hot', 'hot'):
+            self.mirror.query(self.query, top_k=1, namespace=ns)
+        self.mirror.max_bytes = int(self.mirror.resident['hot'].nbytes * 1.5)
+        for ns in ('warm', 'warm'):
+            self.mirror.query(self.query, top_k=1, namespace=ns)
+        self.assertEqual(list(self.mirror.resident), ['warm'])
+        self.assertEqual(self.mirror.snapshot()['evictions'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import pstats
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from service.utils import profiling
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {'PROFILING_ENABLED': 'true', 'ADMIN_TOKEN': 'secret',
+                                                'PROFILE_DIR': self.tmp.name})
+        self.env.start()
+
+    def tearDown(self):
+        profiling.tracemalloc_stop()
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def test_gating(self):
+        self.assertTrue(profiling.enabled())
+        self.assertTrue(profiling.authorized('secret'))
+        self.assertFalse(profiling.authorized('wrong'))
+        self.assertFalse(profiling.authorized(None))
+        with mock.patch.dict(os.environ, {'ADMIN_TOKEN': ''}):
+            self.assertFalse(profiling.enabled())
+
+    def test_sample_collapses_other_threads(self):
+        stop = threading.Event()
+        t = threading.Thread(target=busy_loop, args=(stop,), name='busy')
+        t.start()
+        try:
+            result = profiling.sample(0.2, interval=0.005)
+        finally:
+            stop.set()
+            t.join()
+        self.assertGreater(result['samples'], 5)
+        busy = [line for line in result['collapsed'].splitlines() if line.startswith('busy;')]
+        self.assertTrue(busy)
+        self.assertIn('busy_loop (test_profiling.py:', busy[0])
+        self.assertTrue(os.path.isfile(result['path']))
+
+    def test_request_profile_and_tracemalloc(self):
+        prof = profiling.RequestProfile('/rag/query')
+        self.assertTrue(prof.start())
+        self.assertFalse(profiling.RequestProfile('/rag/query').start())
+        sorted(range(10000), key=lambda x: -x)
+        path = prof.stop()
+        self.assertTrue(pstats.Stats(path).total_calls > 0)
+
+        self.assertTrue(profiling.tracemalloc_diff()['started'])
+        hold = [bytearray(1000) for _ in range(1000)]
+        diff = profiling.tracemalloc_diff(top=5)
+        self.assertGreater(diff['top'][0]['size_diff'], 900000)
+        self.assertIn('test_profiling.py', diff['top'][0]['traceback'][-1])
+        del hold
+
+    def test_admin_endpoints(self):
+        from main import app
+        client = app.test_client()
+        self.assertEqual(client.get('/rag/admin/tracemalloc').status_code, 403)
+        res = client.post('/rag/admin/profile?seconds=0.05', headers={'X-Admin-Token': 'secret'})
+        self.assertEqual(res.status_code, 200)
+        res = client.get('/rag/health', headers={'X-Profile': '1', 'X-Admin-Token': 'secret'})
+        self.assertTrue(res.headers['X-Profile-File'].endswith('.pstats'))
+        self.assertEqual(client.get('/rag/admin/profile/' + res.headers['X-Profile-File'],
+                                    headers={'X-Admin-Token': 'secret'}).status_code, 200)
+        with mock.patch.dict(os.environ, {'PROFILING_ENABLED': 'false'}):
+            self.assertEqual(client.get('/rag/admin/tracemalloc', headers={'X-Admin-Token': 'secret'}).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from service.embedding import projection
+from service.embedding.projection import Projection, evaluate, fit_pca, random_orthogonal
+
+
+def low_rank_vectors(n=2000, in_dim=64, rank=12):
+    """Vectors that live (up to small noise) in a `rank`-dimensional subspace, like real embeddings mostly do."""
+    rng = np.random.default_rng(0)
+    basis = rng.standard_normal((rank, in_dim))
+    return (rng.standard_normal((n, rank)) @ basis + 0.01 * rng.standard_normal((n, in_dim))).astype('float32')
+
+
+class TestProjection(unittest.TestCase):
+
+    def test_pca_keeps_recall(self):
+        vectors = low_rank_vectors()
+        proj = fit_pca(vectors, 16)
+        out = proj.apply(vectors[:3])
+        self.assertEqual(out.shape, (3, 16))
+        np.testing.assert_allclose(np.linalg.norm(out, axis=1), 1.0, rtol=1e-5)
+        report = evaluate(vectors, proj, queries=50, k=10)
+        self.assertGreater(report['recall@10'], 0.9)
+        self.assertEqual(report['storage_saving'], 0.75)
+
+    def test_random_orthogonal_is_orthonormal(self):
+        proj = random_orthogonal(64, 16, seed=3)
+        np.testing.assert_allclose(proj.matrix.T @ proj.matrix, np.eye(16), atol=1e-5)
+        self.assertEqual(proj.version, random_orthogonal(64, 16, seed=3).version)
+        self.assertNotEqual(proj.version, random_orthogonal(64, 16, seed=4).version)
+
+    def test_save_load_round_trip(self):
+        proj = fit_pca(low_rank_vectors(n=200), 8)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'projection.npz')
+            proj.save(path)
+            loaded = Projection.load(path)
+        self.assertEqual(loaded.version, proj.version)
+        self.assertTrue(loaded.version.startswith('pca8-'))
+        np.testing.assert_array_equal(loaded.apply(np.ones(64)), proj.apply(np.ones(64)))
+
+    def test_version_filter(self):
+        with patch.object(projection, 'get_projection', return_value=None):
+            self.assertEqual(projection.version_filter({'ext': {'$eq': 'py'}}), {'ext': {'$eq': 'py'}})
+        proj = random_orthogonal(64, 16)
+        cond = {'emb_ver': {'$eq': proj.version}}
+        with patch.object(projection, 'get_projection', return_value=proj):
+            self.assertEqual(projection.version_filter(None), cond)
+            self.assertEqual(projection.version_filter({'ext': {'$eq': 'py'}}),
+                             {'$and': [{'ext': {'$eq': 'py'}}, cond]})
+
+
+if __name__ == '__main__':
+    unittest.main()
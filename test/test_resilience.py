@@ -0,0 +1,243 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from service.cache.query_cache import TTLCache
+from service.llm import providers
+from service.llm.providers import GeminiProvider, HedgedLLM, LocalProvider
+from service.piplines import rag_pipeline
+from service.utils import resilience
+from service.utils.resilience import (CircuitBreaker, CircuitOpenError, DeadlineExceeded, async_retry,
+                                      deadline_scope, remaining, retry)
+
+
+class TestRetry(unittest.TestCase):
+
+    def test_full_jitter_bounds(self):
+        for attempt in range(6):
+            for _ in range(50):
+                sleep = resilience._backoff(attempt, 0.1, 2.0, 1.0)
+                self.assertGreaterEqual(sleep, 0.0)
+                self.assertLessEqual(sleep, min(1.0, 0.1 * 2 ** attempt))
+
+    def test_retries_until_success(self):
+        calls = []
+
+        @retry((ValueError,), tries=3, delay=0.001)
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise ValueError('boom')
+            return 'ok'
+
+        self.assertEqual(flaky(), 'ok')
+        self.assertEqual(len(calls), 3)
+
+    def test_deadline_stops_retries(self):
+        calls = []
+
+        @retry((ValueError,), tries=10, delay=1.0, max_delay=1.0)
+        def failing():
+            calls.append(1)
+            raise ValueError('boom')
+
+        with mock.patch.object(resilience.random, 'uniform', return_value=1.0):
+            with deadline_scope(0.5):
+                t0 = time.monotonic()
+                with self.assertRaises(ValueError):
+                    failing()
+        self.assertEqual(len(calls), 1)
+        self.assertLess(time.monotonic() - t0, 0.5)
+        with deadline_scope(0.01):
+            time.sleep(0.02)
+            with self.assertRaises(DeadlineExceeded):
+                failing()
+
+    def test_nested_deadline_only_shortens(self):
+        with deadline_scope(10):
+            with deadline_scope(60):
+                self.assertLessEqual(remaining(), 10)
+        self.assertIsNone(remaining())
+
+    def test_async_retry(self):
+        calls = []
+
+        @async_retry((ValueError,), tries=2, delay=0.001)
+        async def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise ValueError('boom')
+            return 'ok'
+
+        self.assertEqual(asyncio.run(flaky()), 'ok')
+        self.assertEqual(len(calls), 2)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_open_half_open_close(self):
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.05)
+        for _ in range(2):
+            with self.assertRaises(ZeroDivisionError):
+                breaker.call(lambda: 1 / 0)
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(lambda: 'not called')
+        time.sleep(0.06)
+        # one trial call after the reset timeout; success closes the breaker
+        self.assertEqual(breaker.call(lambda: 'ok'), 'ok')
+        self.assertEqual(breaker.snapshot(), {'state': 'closed', 'consecutive_failures': 0})
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.01)
+        with self.assertRaises(ZeroDivisionError):
+            breaker.call(lambda: 1 / 0)
+        time.sleep(0.02)
+        with self.assertRaises(ZeroDivisionError):
+            breaker.call(lambda: 1 / 0)
+        self.assertEqual(breaker.state, 'open')
+
+    def test_retry_does_not_retry_open_circuit(self):
+        calls = []
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+        with mock.patch.object(resilience, 'get_breaker', return_value=breaker):
+            @retry((Exception,), tries=5, delay=0.001, breaker='test')
+            def failing():
+                calls.append(1)
+                raise IOError('down')
+
+            with self.assertRaises(CircuitOpenError):
+                failing()
+        self.assertEqual(len(calls), 1)
+
+    def test_client_errors_are_not_retried_or_counted(self):
+        calls = []
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=30)
+        with mock.patch.object(resilience, 'get_breaker', return_value=breaker):
+            @retry((Exception,), tries=2, delay=0.001, breaker='test',
+                   transient=lambda e: isinstance(e, ConnectionError))
+            def call(error):
+                calls.append(1)
+                raise error
+
+            for _ in range(5):
+                with self.assertRaises(ValueError):
+                    call(ValueError('bad filter'))
+            self.assertEqual(len(calls), 5)
+            self.assertEqual(breaker.state, 'closed')
+
+            with self.assertRaises(ConnectionError):
+                call(ConnectionError('reset'))
+            self.assertEqual(len(calls), 7)
+            self.assertEqual(breaker.state, 'open')
+
+    def test_backend_transient_errors(self):
+        from pymongo.errors import AutoReconnect, DuplicateKeyError, OperationFailure, ServerSelectionTimeoutError
+        from service.db.database import _mongo_transient
+        from service.db.vector_store import _pinecone_transient
+
+        self.assertTrue(_mongo_transient(AutoReconnect('primary stepped down')))
+        self.assertTrue(_mongo_transient(ServerSelectionTimeoutError('no servers')))
+        self.assertFalse(_mongo_transient(DuplicateKeyError('dup')))
+        self.assertFalse(_mongo_transient(OperationFailure('bad query')))
+
+        class ApiError(Exception):
+            def __init__(self, status):
+                super().__init__(status)
+                self.status = status
+
+        self.assertTrue(_pinecone_transient(ApiError(503)))
+        self.assertTrue(_pinecone_transient(ApiError(429)))
+        self.assertTrue(_pinecone_transient(TimeoutError()))
+        self.assertFalse(_pinecone_transient(ApiError(400)))
+        self.assertFalse(_pinecone_transient(ValueError('dimension mismatch')))
+
+
+class TestStaleCache(unittest.TestCase):
+
+    def test_expired_entries_served_as_stale(self):
+        cache = TTLCache(ttl_seconds=300)
+        cache.set('k', {'guidance': 'old'}, expires_at=time.time() - 10)
+        self.assertIsNone(cache.get('k'))
+        self.assertEqual(cache.get_stale('k'), {'guidance': 'old'})
+        self.assertIsNone(cache.get_stale('k', max_age=5))
+
+
+
+class TestLLMOutage(unittest.TestCase):
+
+    def setUp(self):
+        # every Gemini model's breaker is open: no call is attempted
+        self.breakers = {}
+
+        def open_breaker(name):
+            if name not in self.breakers:
+                breaker = self.breakers[name] = CircuitBreaker(name, failure_threshold=1, reset_timeout=30)
+                with self.assertRaises(ZeroDivisionError):
+                    breaker.call(lambda: 1 / 0)
+            return self.breakers[name]
+
+        async def fake_embeddings(texts):
+            return [[1.0, 0.0] for _ in texts]
+
+        import main
+        self.main = main
+        self.client = main.app.test_client()
+        self.llm = HedgedLLM(LocalProvider('local'))
+        self.addCleanup(self.llm._pool.shutdown)
+        patches = [
+            mock.patch.object(providers, 'get_breaker', open_breaker),
+            mock.patch.object(rag_pipeline, 'get_llm', lambda: self.llm),
+            mock.patch.object(rag_pipeline, 'get_embeddings', fake_embeddings),
+            mock.patch.object(rag_pipeline, 'retrieve', lambda *a, **k: []),
+            mock.patch.object(rag_pipeline, 'get_answer_cache', lambda: None),
+            mock.patch.object(rag_pipeline, 'save_query_log', lambda *a, **k: None),
+            mock.patch.object(main, '_query_cache', TTLCache(ttl_seconds=300)),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.gemini = HedgedLLM(GeminiProvider('a'), hedge=GeminiProvider('b'), fallbacks=[GeminiProvider('c')],
+                                deadline=5)
+        self.addCleanup(self.gemini._pool.shutdown)
+
+    def test_open_breakers_raise_circuit_open(self):
+        with self.assertRaises(CircuitOpenError):
+            self.gemini.generate('question')
+
+    def test_query_served_stale_when_gemini_is_down(self):
+        body = {'repoId': 'r', 'prompt': 'how?'}
+        fresh = self.client.post('/rag/query', json=body)
+        self.assertEqual(fresh.status_code, 200)
+        cache = self.main._query_cache
+        for key, (value, _) in list(cache.store.items()):
+            cache.set(key, value, expires_at=time.time() - 10)
+
+        self.llm = self.gemini
+        res = self.client.post('/rag/query', json=body)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['X-Cache'], 'stale')
+        self.assertEqual(res.get_json(), fresh.get_json())
+
+        cache.store.clear()
+        res = self.client.post('/rag/query', json=body)
+        self.assertEqual(res.status_code, 503)
+        self.assertIn('Retry-After', res.headers)
+
+    def test_provider_errors_are_not_served_stale(self):
+        body = {'repoId': 'r', 'prompt': 'how?'}
+        self.assertEqual(self.client.post('/rag/query', json=body).status_code, 200)
+        cache = self.main._query_cache
+        for key, (value, _) in list(cache.store.items()):
+            cache.set(key, value, expires_at=time.time() - 10)
+
+        self.llm = HedgedLLM(LocalProvider('bad-key', fail=True))
+        self.addCleanup(self.llm._pool.shutdown)
+        res = self.client.post('/rag/query', json=body)
+        self.assertEqual(res.status_code, 502)
+        self.assertNotIn('X-Cache', res.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
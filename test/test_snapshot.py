@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from service.db.local_store import LocalVectorStore
+from service.db.snapshot import Snapshot, export_namespace, import_snapshot, write_snapshot
+
+
+def sample_vectors(n=250, dim=8):
+    rng = np.random.default_rng(0)
+    embs = rng.normal(size=(n, dim)).astype('float32')
+    vectors = [(f'repo:f{i}.py:0', embs[i], {'path': f'f{i}.py', 'repoId': 'repo', 'text': f'def f{i}(): pass'})
+               for i in range(n)]
+    return vectors, embs
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_roundtrip_is_memory_mapped(self):
+        vectors, embs = sample_vectors()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'a.ragsnap')
+            write_snapshot(path, [v[0] for v in vectors], embs, [v[2] for v in vectors], namespace='repo')
+            snap = Snapshot(path)
+            self.assertIsInstance(snap.embeddings, np.memmap)
+            self.assertEqual((snap.count, snap.dim), (250, 8))
+            np.testing.assert_array_equal(np.asarray(snap.embeddings), embs)
+            self.assertEqual(snap.ids[3], 'repo:f3.py:0')
+            self.assertEqual(snap.metadata(3), vectors[3][2])
+
+    def test_export_import_between_backends(self):
+        vectors, embs = sample_vectors()
+        src, dst = LocalVectorStore(), LocalVectorStore()
+        src.upsert(vectors, namespace='repo')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'repo.ragsnap')
+            header = export_namespace('repo', path, backend=src, batch_size=64)
+            self.assertEqual(header['count'], 250)
+            res = import_snapshot(path, namespace='copy', backend=dst, batch_size=64)
+            self.assertEqual(res['imported'], 250)
+        top = dst.query(embs[7], top_k=1, namespace='copy')[0]
+        self.assertEqual(top['id'], 'repo:f7.py:0')
+        self.assertEqual(top['text'], 'def f7(): pass')
+
+    def test_local_store_persists(self):
+        vectors, embs = sample_vectors(10)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = LocalVectorStore(path=tmp)
+            store.upsert(vectors, namespace='repo')
+            store.delete_ids(['repo:f0.py:0'], namespace='repo')
+            store.save()
+            again = LocalVectorStore(path=tmp)
+            self.assertEqual(sorted(again.list_ids('repo:', namespace='repo')), sorted(v[0] for v in vectors[1:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
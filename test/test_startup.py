@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_import_main_is_lazy(self):
+        """Importing main must not pull in the ML/backend SDKs."""
+        probe = (
+            "import sys, main\n"
+            "heavy = ('transformers', 'onnxruntime', 'google.generativeai', 'pymongo', 'pinecone')\n"
+            "print(','.join(m for m in heavy if m in sys.modules))\n"
+        )
+        out = subprocess.run([sys.executable, '-c', probe], cwd=ROOT, capture_output=True, text=True)
+        self.assertEqual(out.returncode, 0, out.stderr)
+        self.assertEqual(out.stdout.strip().splitlines()[-1] if out.stdout.strip() else '', '')
+
+    def test_backends_unconfigured(self):
+        from service.db import vector_store, database
+        if not os.getenv('PINECONE_API_KEY'):
+            self.assertIsNone(vector_store.get_index())
+        if not os.getenv('MONGODB_URI'):
+            self.assertIsNone(database.get_db())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import time
+import unittest
+
+from service.cache import warm_start
+from service.cache.query_cache import TTLCache
+from service.embedding.cache import EmbeddingCache
+
+
+class TestWarmStart(unittest.TestCase):
+
+    def test_roundtrip_keeps_recent_entries_within_budget(self):
+        src = EmbeddingCache(max_memory_items=100)
+        for i in range(50):
+            src.set(f'text {i}', [float(i)] * 8)
+        src.get('text 3')  # most recently used
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'embeddings.npz')
+            # room for 10 rows of 32-byte key + 8 float32
+            self.assertEqual(warm_start.save_embeddings(src, path, max_bytes=10 * 64), 10)
+            dst = EmbeddingCache(max_memory_items=100)
+            self.assertEqual(warm_start.load_embeddings(dst, path, max_bytes=1 << 20), 10)
+        # the most recently used key stays most recent after reload
+        self.assertEqual(dst.mem.items_recent()[0][1], [3.0] * 8)
+        self.assertEqual(dst.get('text 3'), [3.0] * 8)
+        self.assertEqual(dst.get('text 49'), [49.0] * 8)
+        self.assertIsNone(dst.get('text 0'))
+        self.assertEqual(dst.stats, {'memory_hits': 2, 'disk_hits': 0, 'misses': 1})
+
+    def test_other_model_is_ignored(self):
+        src = EmbeddingCache()
+        src.set('a', [1.0, 2.0])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'embeddings.npz')
+            warm_start.save_embeddings(src, path, 1 << 20)
+            self.assertEqual(warm_start.load_embeddings(EmbeddingCache(namespace='int8'), path, 1 << 20), 0)
+
+    def test_query_cache_keeps_expiry(self):
+        src = TTLCache(ttl_seconds=300)
+        src.set('fresh', {'guidance': 'x'})
+        src.set('stale', {'guidance': 'y'}, expires_at=time.time() - 1)
+        with tempfile.TemporaryDirectory() as tmp:
+            report = warm_start.save(query_cache=src, directory=tmp)
+            self.assertEqual(report, {'queries': 1})
+            dst = TTLCache(ttl_seconds=300)
+            warm_start.restore(query_cache=dst, directory=tmp)
+        self.assertEqual(dst.get('fresh'), {'guidance': 'x'})
+        self.assertAlmostEqual(dst.store['fresh'][1], src.store['fresh'][1], places=3)
+        self.assertEqual(warm_start.hit_rates(query_cache=dst)['queries']['hit_rate'], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()